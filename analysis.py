@@ -0,0 +1,201 @@
+import os
+import shutil
+import signal
+import subprocess
+import threading
+from datetime import datetime, timezone
+
+import duckdb
+
+from archive import Archive
+from cgroup import Cgroup, cgroup_available
+from pages import OUTPUT_PATH, SAMPLER_PATH, SAMPLER_TABLES, TABLES, Session
+from rstracer import ProcessTree, Rstracer
+from sampler import ProcSampler
+
+LOG_PATH = ".output/log"
+RSTRACER_READY_TIMEOUT = 120
+
+
+def terminate(pid):
+    # The command runs through sudo, its processes owned by root are only signalled through sudo
+    try:
+        os.kill(pid, signal.SIGTERM)
+    except ProcessLookupError:
+        pass
+    except OSError:
+        subprocess.run(["sudo", "kill", "-TERM", str(pid)])
+
+
+class Analysis:
+    # Runs the analysis lifecycle in a background thread, callers poll its state and may cancel it
+
+    def __init__(self, command, user, lifetime, daemon=False, contain=False, sample=False):
+        self.command = command
+        self.user = user
+        self.lifetime = lifetime
+        # A daemon analysis reuses a running rstracer and leaves it up for the next one
+        self.daemon = daemon
+        # A contained command runs in its own cgroup v2, which gives its exact processes and resource counters
+        self.contain = contain
+        self.cgroup = None
+        # A sampled command has its processes and files read from /proc at a sub-second rate
+        self.sample = sample
+        self.sampler = None
+        self.started_at = None
+        self.ended_at = None
+        self.state = "Pending"
+        self.progress = 0
+        self.message = ""
+        self.error = None
+        self.process = None
+        self.session = None
+        self.archive = None
+        self.sampler_archive = None
+        self.cancelled = threading.Event()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    def cancel(self):
+        self.cancelled.set()
+
+    def running(self):
+        return self.thread.is_alive()
+
+    def warning(self):
+        # The analysis still completes, without the files of the processes the sampler could not read
+        if self.sampler is None or not self.sampler.denied:
+            return None
+        return (
+            f"Open files of {len(self.sampler.denied)} processes are not sampled, /proc/<pid>/fd is only readable by "
+            "their user and root"
+        )
+
+    def update(self, progress, message):
+        self.progress = progress
+        self.message = message
+
+    def wait(self, duration, message):
+        for second in range(duration):
+            self.update(int(second / duration * 100), message)
+            if self.archive is not None:
+                self.archive_export()
+            if self.cancelled.wait(1):
+                return False
+        return True
+
+    def run(self):
+        os.makedirs(LOG_PATH, exist_ok=True)
+        with open(f"{LOG_PATH}/command.log", "w") as log_file:
+            try:
+                self.state = "Running"
+                if not self.daemon:
+                    Rstracer().stop()
+                self.update(0, "Waiting for the first rstracer export...")
+                ready = Rstracer().ensure_running(OUTPUT_PATH, TABLES, RSTRACER_READY_TIMEOUT, self.cancelled)
+                if ready:
+                    self.started_at = datetime.now(timezone.utc)
+                    # A sampler export left by a previous analysis would be merged into this one
+                    shutil.rmtree(SAMPLER_PATH, ignore_errors=True)
+                    command = f"sudo -u {self.user} {self.command}"
+                    if self.contain:
+                        if not cgroup_available():
+                            raise RuntimeError("cgroup v2 is not mounted on /sys/fs/cgroup")
+                        self.cgroup = Cgroup(f"{self.started_at:%Y%m%d%H%M%S}")
+                        self.cgroup.create()
+                        command = self.cgroup.command(self.command, self.user)
+                    self.process = subprocess.Popen(command, stdout=log_file, stderr=log_file, shell=True)
+                    if self.cgroup is not None:
+                        self.cgroup.start()
+                    if self.sample:
+                        pids = self.cgroup.pids if self.cgroup is not None else None
+                        self.sampler = ProcSampler(self.process.pid, pids).start()
+                    self.session = Session(
+                        f"{self.started_at:%Y%m%d%H%M%S}_{self.process.pid}",
+                        self.command,
+                        self.process.pid,
+                        Rstracer().pid(),
+                        self.started_at.replace(tzinfo=None),
+                    )
+                    self.session.save()
+                    self.archive = Archive(self.session.directory)
+                    if self.sampler is not None:
+                        self.sampler_archive = Archive(self.session.directory, SAMPLER_TABLES)
+                    self.wait(self.lifetime, "Analysing your command...")
+                elif not self.cancelled.is_set():
+                    raise RuntimeError(f"no complete rstracer export, rstracer is {Rstracer().state().lower()}")
+            except Exception as error:
+                self.error = error
+            finally:
+                self.stop()
+
+    def stop(self):
+        # Each step runs whatever the previous ones raised, so the state always ends as Failed, Cancelled or Done
+        self.ended_at = datetime.now(timezone.utc)
+        steps = [self.end_session, self.stop_command, self.remove_cgroup, self.stop_sampler, self.store_session]
+        if not self.daemon:
+            steps.append(self.stop_rstracer)
+        for step in steps:
+            try:
+                step()
+            except Exception as error:
+                self.error = self.error or error
+        if self.error is not None:
+            self.state = "Failed"
+            self.update(100, f"Failed: {self.error}")
+        else:
+            self.state = "Cancelled" if self.cancelled.is_set() else "Done"
+            self.update(100, "Ready !")
+
+    def end_session(self):
+        if self.session is not None:
+            self.session.end(self.ended_at.replace(tzinfo=None))
+
+    def stop_command(self):
+        if self.cgroup is not None:
+            # Members reparented out of the launched tree are killed as well
+            self.cgroup.kill()
+        elif self.process is not None:
+            for pid in [self.process.pid] + ProcessTree().descendants(self.process.pid):
+                terminate(pid)
+
+    def remove_cgroup(self):
+        if self.cgroup is not None:
+            self.cgroup.remove()
+
+    def stop_sampler(self):
+        if self.sampler is not None:
+            self.sampler.stop()
+
+    def stop_rstracer(self):
+        self.update(90, "Stop rstracer...")
+        Rstracer().stop()
+
+    def archive_export(self):
+        # An export rewritten while it is read is archived at the next pass
+        try:
+            self.archive.update(OUTPUT_PATH)
+            if self.sampler_archive is not None:
+                self.sampler_archive.update(SAMPLER_PATH)
+        except (duckdb.Error, OSError):
+            pass
+
+    def store_session(self):
+        # The last pass waits for the export covering the end of the command, a stalled export archives the last one
+        if self.session is None:
+            return
+        self.update(80, "Archive the session...")
+        Rstracer().wait_ready(OUTPUT_PATH, TABLES, RSTRACER_READY_TIMEOUT, since=self.ended_at.timestamp())
+        try:
+            self.archive.update(OUTPUT_PATH, force=True)
+            if self.sampler_archive is not None:
+                self.sampler_archive.update(SAMPLER_PATH, force=True)
+            self.archive.compact(OUTPUT_PATH)
+            if self.cgroup is not None:
+                self.cgroup.write(self.archive.path)
+            self.session.close(self.ended_at.replace(tzinfo=None), self.archive.path)
+        except (duckdb.Error, OSError) as error:
+            self.error = self.error or error
@@ -0,0 +1,109 @@
+import glob
+import os
+import shutil
+from time import monotonic
+
+import duckdb
+
+from pages import FACT_KEYS, TABLES, merge_rows_query, new_rows_query, snapshot_version
+
+# rstracer vacuums gold rows after 600 seconds, archiving every minute leaves a wide margin
+ARCHIVE_INTERVAL = 60
+ROW_GROUP_SIZE = 100_000
+
+# Fact tables are partitioned by hour of created_at
+FACT_ARCHIVE_QUERY = """
+COPY (
+    SELECT
+        *,
+        STRFTIME(DATE_TRUNC('hour', created_at), '%Y%m%d%H') AS bucket,
+    FROM ({rows})
+    ORDER BY created_at
+) TO '{directory}' (
+    FORMAT PARQUET,
+    COMPRESSION ZSTD,
+    ROW_GROUP_SIZE {row_group_size},
+    PARTITION_BY (bucket),
+    APPEND,
+    FILENAME_PATTERN 'part_{{uuid}}'
+)
+"""
+
+DIMENSION_ARCHIVE_QUERY = """
+COPY ({rows}) TO '{path}' (FORMAT PARQUET, COMPRESSION ZSTD)
+"""
+
+COMPACT_QUERY = """
+COPY (
+    SELECT * FROM read_parquet({files}, hive_partitioning = false) ORDER BY created_at
+) TO '{path}' (FORMAT PARQUET, COMPRESSION ZSTD, ROW_GROUP_SIZE {row_group_size})
+"""
+
+
+class Archive:
+    # Session store accumulating every export, partitioned by table and time bucket, pages read it once compacted
+
+    def __init__(self, path, tables=TABLES):
+        self.path = path
+        # Exports of several collectors are archived into the same tables, each with its own archive
+        self.tables = tables
+        self.version = None
+        self.archived_at = None
+
+    def update(self, export, force=False):
+        # Archives the export when it changed, at most every ARCHIVE_INTERVAL seconds unless forced
+        if not force and self.archived_at is not None and monotonic() - self.archived_at < ARCHIVE_INTERVAL:
+            return False
+        version = snapshot_version(export, self.tables)
+        if version == self.version:
+            return False
+        with duckdb.connect() as con:
+            for table in self.tables:
+                if table in FACT_KEYS:
+                    self.archive_fact(con, export, table)
+                else:
+                    self.archive_dimension(con, export, table)
+        self.version = version
+        self.archived_at = monotonic()
+        return True
+
+    def archive_fact(self, con, export, table):
+        directory = f"{self.path}/{table}"
+        rows = f"SELECT * FROM '{export}/{table}.parquet'"
+        if glob.glob(f"{directory}/*/*.parquet"):
+            stored = f"read_parquet('{directory}/*/*.parquet', hive_partitioning = false)"
+            rows = new_rows_query(table, f"'{export}/{table}.parquet'", stored)
+        os.makedirs(directory, exist_ok=True)
+        con.execute(FACT_ARCHIVE_QUERY.format(rows=rows, directory=directory, row_group_size=ROW_GROUP_SIZE))
+
+    def archive_dimension(self, con, export, table):
+        directory = f"{self.path}/{table}"
+        path = f"{directory}/data.parquet"
+        rows = f"SELECT * FROM '{export}/{table}.parquet'"
+        if os.path.exists(path):
+            rows = merge_rows_query(table, f"'{export}/{table}.parquet'", f"'{path}'")
+        os.makedirs(directory, exist_ok=True)
+        con.execute(DIMENSION_ARCHIVE_QUERY.format(rows=rows, path=f"{path}.tmp"))
+        os.replace(f"{path}.tmp", path)
+
+    def compact(self, export):
+        # Merges the parts of each bucket into one file sorted by created_at, so row groups prune on time ranges
+        with duckdb.connect() as con:
+            for table in [table for table in self.tables if table in FACT_KEYS]:
+                directory = f"{self.path}/{table}"
+                for bucket in glob.glob(f"{directory}/bucket=*"):
+                    files = sorted(glob.glob(f"{bucket}/*.parquet"))
+                    if len(files) > 1:
+                        con.execute(
+                            COMPACT_QUERY.format(files=files, path=f"{bucket}.parquet", row_group_size=ROW_GROUP_SIZE)
+                        )
+                        shutil.rmtree(bucket)
+                        os.makedirs(bucket)
+                        os.replace(f"{bucket}.parquet", f"{bucket}/part_0.parquet")
+                if not glob.glob(f"{directory}/*/*.parquet"):
+                    # Tables without rows keep their schema
+                    os.makedirs(f"{directory}/bucket=empty", exist_ok=True)
+                    con.execute(
+                        f"COPY (SELECT * FROM '{export}/{table}.parquet' LIMIT 0) "
+                        f"TO '{directory}/bucket=empty/part_0.parquet' (FORMAT PARQUET)"
+                    )
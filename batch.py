@@ -0,0 +1,141 @@
+import argparse
+import csv
+import json
+import os
+import re
+
+from streamlit.logger import set_log_level
+
+from analysis import Analysis
+from pages import connection, get_descendants, register_launched_tree, register_network_flow, register_process_key
+from rstracer import Rstracer
+
+REPORT_PATH = ".output/report"
+TOP = 10
+
+PROCESS_REPORT_QUERY = """
+SELECT
+    COALESCE(dim.command, dim.full_command) AS command,
+    COUNT(DISTINCT fact.process_key) AS processes,
+    MAX(fact.pcpu) AS max_pcpu,
+    MAX(fact.pmem) AS max_pmem,
+FROM gold_fact_process_keyed fact
+INNER JOIN gold_dim_process dim ON fact.process_key = dim.process_key
+WHERE fact.process_key IN (SELECT _id FROM {tree})
+AND fact.created_at BETWEEN ? AND ?
+GROUP BY ALL
+ORDER BY max_pcpu DESC
+"""
+
+FILE_REPORT_QUERY = """
+SELECT
+    dim.name AS file,
+    MAX(fact.size) - MIN(fact.size) AS written_bytes,
+FROM gold_fact_file_reg_keyed fact
+LEFT JOIN gold_dim_file_reg dim ON fact.pid = dim.pid AND fact.fd = dim.fd AND fact.node = dim.node
+WHERE fact.process_key IN (SELECT _id FROM {tree})
+AND fact.created_at BETWEEN ? AND ?
+GROUP BY ALL
+ORDER BY written_bytes DESC
+"""
+
+NETWORK_REPORT_QUERY = """
+SELECT
+    CASE WHEN source_local THEN COALESCE(destination_host, destination_address)
+    ELSE COALESCE(source_host, source_address) END AS host,
+    SUM(packet_count)::BIGINT AS packets,
+    SUM(byte_count)::BIGINT AS bytes,
+FROM network_flow
+WHERE LIST_HAS_ANY(process_keys, (SELECT LIST(_id) FROM {tree}))
+AND second BETWEEN DATE_TRUNC('second', ?::TIMESTAMP) AND ?
+GROUP BY ALL
+ORDER BY bytes DESC
+"""
+
+
+def read_commands(path):
+    with open(path, newline="") as command_file:
+        return [
+            (row["command"], row["user"], int(row["lifetime"]))
+            for row in csv.DictReader(command_file)
+            if not row["command"].startswith("#")
+        ]
+
+
+def build_report(analysis):
+    report = {
+        "command": analysis.command,
+        "user": analysis.user,
+        "state": analysis.state,
+        "error": None if analysis.error is None else str(analysis.error),
+        "warning": analysis.warning(),
+        "started_at": analysis.started_at,
+        "ended_at": analysis.ended_at,
+    }
+    session = analysis.session
+    if session is None or session.live():
+        return report
+
+    report["session"] = session.id
+    con = connection(session)
+    tree = register_launched_tree(con, session.pid)
+    register_process_key(con, "gold_fact_process")
+    register_process_key(con, "gold_fact_file_reg")
+    register_network_flow(con)
+    window = [session.started_at, session.ended_at]
+
+    descendants = get_descendants(con, session.pid, cgroup=True)
+    processes = con.execute(PROCESS_REPORT_QUERY.format(tree=tree), window).df()
+    files = con.execute(FILE_REPORT_QUERY.format(tree=tree), window).df()
+    hosts = con.execute(NETWORK_REPORT_QUERY.format(tree=tree), window).df()
+
+    report["process"] = {
+        "count": len(descendants),
+        "commands": processes.head(TOP).to_dict(orient="records"),
+    }
+    report["file"] = {
+        "opened": len(files),
+        "modified": int((files["written_bytes"] > 0).sum()),
+        "written_bytes": int(files["written_bytes"].sum()),
+        "top_written": files.head(TOP).to_dict(orient="records"),
+    }
+    report["network"] = {
+        "hosts": len(hosts),
+        "packets": int(hosts["packets"].sum()),
+        "bytes": int(hosts["bytes"].sum()),
+        "top_hosts": hosts.head(TOP).to_dict(orient="records"),
+    }
+    report["lineage"] = descendants[["pid", "ppid", "user", "full_command", "started_at"]].to_dict(orient="records")
+    return report
+
+
+def run_batch(commands, output_path, contain=False, sample=False):
+    os.makedirs(output_path, exist_ok=True)
+    try:
+        for number, (command, user, lifetime) in enumerate(commands):
+            analysis = Analysis(command, user, lifetime, daemon=True, contain=contain, sample=sample).start()
+            analysis.thread.join()
+            report = build_report(analysis)
+            name = re.sub(r"[^A-Za-z0-9]+", "_", command).strip("_")[:50]
+            path = f"{output_path}/{number:03d}_{name}.json"
+            with open(path, "w") as report_file:
+                json.dump(report, report_file, indent=2, default=str)
+            print(f"{analysis.state:<9} {command} -> {path}")
+    finally:
+        Rstracer().stop()
+
+
+def run():
+    parser = argparse.ArgumentParser(description="Analyse a list of commands without the dashboard.")
+    parser.add_argument("commands", help="csv file with command, user and lifetime columns")
+    parser.add_argument("--output", default=REPORT_PATH, help="directory of the reports")
+    parser.add_argument("--cgroup", action="store_true", help="contain each command in a cgroup v2")
+    parser.add_argument("--sample", action="store_true", help="sample each command from /proc")
+    args = parser.parse_args()
+    # Pages helpers run outside of a streamlit server, which only warns about it
+    set_log_level("error")
+    run_batch(read_commands(args.commands), args.output, args.cgroup, args.sample)
+
+
+if __name__ == "__main__":
+    run()
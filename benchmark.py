@@ -0,0 +1,350 @@
+import argparse
+import hashlib
+import json
+import os
+import resource
+import statistics
+import subprocess
+import sys
+from datetime import datetime, timedelta
+from timeit import default_timer as timer
+
+import duckdb
+
+from pages import OUTPUT_PATH, Session
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+PAGES = ["pages/1_process.py", "pages/2_files.py", "pages/3_network.py", "pages/4_lineage.py", "pages/5_tracer.py"]
+SCALES = [10**4, 10**5, 10**6]
+BENCHMARK_PATH = ".benchmark"
+
+# The synthetic export covers one hour, the analysed command is started at its middle
+EXPORT_START = "2024-01-01 00:00:00"
+EXPORT_DURATION = 3600
+ANALYSE_START = datetime(2024, 1, 1, 0, 30)
+ROOT_PID = 400
+RSTRACER_PID = 500
+
+# Every pid is reused by PID_REUSE successive incarnations, each process forks FANOUT children
+PID_REUSE = 8
+FANOUT = 4
+COMMANDS = ["make", "cc1", "as", "ld", "sh", "python", "curl", "git", "cargo", "rustc"]
+FOREIGN_HOSTS = 50
+PAGE_TIMEOUT = 3600
+SESSIONS = ["stored", "live"]
+
+PROCESS_QUERY = """
+SELECT
+    i AS incarnation,
+    1000 + i % {slots} AS pid,
+    CASE
+        WHEN i % {slots} = 0 THEN (CASE WHEN (i // {slots}) % 2 = 0 THEN {root_pid} ELSE 1 END)
+        ELSE 1000 + (i % {slots} - 1) // {fanout}
+    END AS ppid,
+    (i % 5)::INTEGER AS uid,
+    {commands}[i % {slots} % {command_count} + 1] AS command,
+    {commands}[i % {slots} % {command_count} + 1] || ' ' || (i % {slots}) AS full_command,
+    TIMESTAMP '{start}'
+        + TO_MICROSECONDS(((i // {slots}) * {epoch} + (i % {slots}) / {slots} * {epoch} * 0.1)::BIGINT) AS started_at,
+    TIMESTAMP '{start}'
+        + TO_MICROSECONDS(((i // {slots} + 1) * {epoch} - 1e6 - (i % {slots}) / {slots} * {epoch} * 0.1)::BIGINT)
+        AS inserted_at,
+FROM range({processes}) t(i)
+UNION ALL
+SELECT
+    {processes} + n, pid, ppid, 0, command, full_command,
+    TIMESTAMP '{start}', TIMESTAMP '{start}' + INTERVAL {duration} SECOND
+FROM (VALUES
+    (0, 1, 0, 'init', 'init'),
+    (1, {root_pid}, 1, 'sudo', 'sudo -u user make all'),
+    (2, {rstracer_pid}, 1, 'sudo', 'sudo rstracer'),
+    (3, {rstracer_pid} + 1, {rstracer_pid}, 'rstracer', 'rstracer')
+) t(n, pid, ppid, command, full_command)
+"""
+
+# Facts pick an incarnation and a timestamp inside its lifetime
+SAMPLE_QUERY = """
+SELECT
+    t.i,
+    proc.*,
+    proc.started_at + TO_MICROSECONDS(
+        (HASH(t.i, 'time') % GREATEST(EPOCH_US(proc.inserted_at) - EPOCH_US(proc.started_at), 1))::BIGINT
+    ) AS created_at,
+FROM range({rows}) t(i)
+INNER JOIN proc ON proc.incarnation = HASH(t.i) % ({processes} + 4)
+"""
+
+FIXTURE_QUERIES = {
+    "gold_dim_process": "SELECT * EXCLUDE (incarnation) FROM proc",
+    "gold_file_user": "SELECT i::INTEGER AS uid, 'user' || i AS name FROM range(5) t(i)",
+    "gold_fact_process": """
+        SELECT HASH(i, 'process') AS _id, pid, (HASH(i, 'cpu') % 10000) / 100 AS pcpu,
+               (HASH(i, 'mem') % 1000) / 100 AS pmem, created_at, created_at AS inserted_at
+        FROM sample""",
+    "gold_dim_file_reg": """
+        SELECT DISTINCT pid, (3 + k)::VARCHAR AS fd, HASH(incarnation, k) % 100000 AS node,
+               '/tmp/' || command || '/' || (HASH(incarnation, k) % 100000) AS name
+        FROM proc, range(2) t(k)""",
+    "gold_fact_file_reg": """
+        SELECT HASH(i, 'file') AS _id, pid, (3 + i % 2)::VARCHAR AS fd, HASH(incarnation, i % 2) % 100000 AS node,
+               ((EPOCH_US(created_at) - EPOCH_US(started_at)) // 1000 * (1 + i % 2))::BIGINT AS size,
+               created_at, created_at AS inserted_at
+        FROM sample""",
+    "gold_dim_network_host": """
+        SELECT '93.184.' || i || '.1' AS address, 'host' || i || '.example.com' AS host FROM range({foreign_hosts}) t(i)
+        UNION ALL SELECT '10.0.0.2', 'localhost.local' UNION ALL SELECT '127.0.0.1', 'localhost'""",
+    "gold_dim_network_interface": "SELECT * FROM (VALUES ('eth0', '10.0.0.2'), ('lo', '127.0.0.1')) t(name, address)",
+    "gold_dim_network_foreign_ip": "SELECT '93.184.' || i || '.1' AS address FROM range({foreign_hosts}) t(i)",
+    "gold_dim_network_open_port": """
+        SELECT 30000 + incarnation % 20000 AS port, command, started_at, inserted_at FROM proc""",
+    "gold_dim_network_socket": """
+        SELECT pid, '10.0.0.2' AS source_address, 30000 + incarnation % 20000 AS source_port, started_at, inserted_at
+        FROM proc""",
+    "gold_fact_network_packet": """
+        SELECT HASH(i, 'packet') AS _id, created_at, created_at AS inserted_at,
+               (60 + HASH(i, 'length') % 1400)::INTEGER AS length,
+               CASE WHEN i % 7 = 0 THEN 'lo' ELSE 'eth0' END AS interface,
+               CASE WHEN i % 11 = 0 THEN NULL ELSE 'ipv4' END AS network,
+               CASE WHEN i % 11 = 0 THEN NULL WHEN i % 5 = 0 THEN 'udp' ELSE 'tcp' END AS transport,
+               CASE WHEN i % 5 = 0 THEN 'dns' WHEN i % 3 = 0 THEN 'https' END AS application,
+               i % 2 = 0 AS send
+        FROM sample""",
+    "gold_fact_network_ip": """
+        SELECT HASH(i, 'packet') AS _id, created_at, created_at AS inserted_at,
+               CASE WHEN i % 2 = 0 THEN local_address ELSE foreign_address END AS source_address,
+               CASE WHEN i % 2 = 0 THEN foreign_address ELSE local_address END AS destination_address,
+               CASE WHEN i % 2 = 0 THEN local_port ELSE foreign_port END AS source_port,
+               CASE WHEN i % 2 = 0 THEN foreign_port ELSE local_port END AS destination_port
+        FROM (
+            SELECT *, CASE WHEN i % 7 = 0 THEN '127.0.0.1' ELSE '10.0.0.2' END AS local_address,
+                   '93.184.' || HASH(i, 'host') % {foreign_hosts} || '.1' AS foreign_address,
+                   30000 + incarnation % 20000 AS local_port, [443, 80, 53][i % 3 + 1] AS foreign_port
+            FROM sample
+        )
+        WHERE i % 11 <> 0""",
+    "gold_fact_process_network": """
+        SELECT HASH(i, 'packet') AS packet_id, pid, created_at FROM sample WHERE i % 10 <> 0""",
+    "gold_file_host": "SELECT '127.0.0.1' AS address, 'localhost' AS name",
+    "gold_file_service": """
+        SELECT * FROM (VALUES ('https', 443, 'tcp'), ('http', 80, 'tcp'), ('domain', 53, 'udp'))
+        t(name, port, protocol)""",
+    "gold_tech_chrono": """
+        SELECT layer AS name, TIMESTAMP '{start}' + TO_SECONDS(i * 10) AS created_at, HASH(i, layer) % 500 AS duration
+        FROM range({duration} // 10) t(i), (VALUES ('bronze'), ('silver'), ('gold')) v(layer)""",
+    "gold_tech_table_count": """
+        SELECT name, i * 100 AS count, TIMESTAMP '{start}' + TO_SECONDS(i * 10) AS created_at
+        FROM range({duration} // 10) t(i), (VALUES ('gold_fact_process'), ('gold_fact_network_packet')) v(name)""",
+}
+
+# Attribution of events to port intervals, compared for the interval index of pages/__init__.py
+INTERVAL_QUERIES = {
+    "range": """
+        SELECT COALESCE(interval.command, 'Unknown') AS command, COUNT(*) FROM event
+        LEFT JOIN interval ON event.port = interval.port
+        AND event.created_at >= interval.started_at AND event.created_at <= interval.inserted_at
+        GROUP BY ALL ORDER BY ALL""",
+    "asof": """
+        SELECT COALESCE(CASE WHEN event.created_at <= interval.inserted_at THEN interval.command END, 'Unknown')
+        AS command, COUNT(*) FROM event
+        ASOF LEFT JOIN interval ON event.port = interval.port AND event.created_at >= interval.started_at
+        GROUP BY ALL ORDER BY ALL""",
+    "index": """
+        SELECT COALESCE(interval.command, 'Unknown') AS command, COUNT(*) FROM event
+        LEFT JOIN interval_index interval ON event.port = interval.port
+        AND DATE_TRUNC('minute', event.created_at) = interval.bucket
+        AND event.created_at >= interval.started_at AND event.created_at <= interval.inserted_at
+        GROUP BY ALL ORDER BY ALL""",
+}
+
+
+def generate(path, rows):
+    os.makedirs(path, exist_ok=True)
+    processes = max(200, rows // 100)
+    slots = max(FANOUT + 1, processes // PID_REUSE)
+    epochs = -(-processes // slots)
+    parameters = {
+        "slots": slots,
+        "processes": processes,
+        "rows": rows,
+        "fanout": FANOUT,
+        "root_pid": ROOT_PID,
+        "rstracer_pid": RSTRACER_PID,
+        "commands": str(COMMANDS),
+        "command_count": len(COMMANDS),
+        "start": EXPORT_START,
+        "duration": EXPORT_DURATION,
+        "epoch": EXPORT_DURATION * 1_000_000 // epochs,
+        "foreign_hosts": FOREIGN_HOSTS,
+    }
+    con = duckdb.connect(database=":memory:")
+    con.execute(f"CREATE TABLE proc AS {PROCESS_QUERY.format(**parameters)}")
+    con.execute(f"CREATE TABLE sample AS {SAMPLE_QUERY.format(**parameters)}")
+    for table, query in FIXTURE_QUERIES.items():
+        con.execute(f"COPY ({query.format(**parameters)}) TO '{path}/{table}.parquet' (FORMAT PARQUET)")
+    con.close()
+
+
+def show_only(app):
+    return [selectbox for selectbox in app.sidebar.selectbox if selectbox.label == "Show only"]
+
+
+def page_app(page, mode):
+    # Each measured run starts from a new session state, live series would only query the rows added since the
+    # previous run
+    from streamlit.testing.v1 import AppTest
+
+    app = AppTest.from_file(os.path.join(ROOT, page), default_timeout=PAGE_TIMEOUT)
+    if mode is not None:
+        app.run()
+        show_only(app)[0].set_value(mode)
+    return app
+
+
+def run_page(page, repeat, session):
+    # Runs in a dedicated process, so the peak memory is the one of this page only
+    benchmark_session = Session("benchmark", "benchmark", ROOT_PID, RSTRACER_PID, ANALYSE_START)
+    if session == "stored":
+        # A stored session reads the export files as an archive, a live one loads them in a session database
+        benchmark_session.close(ANALYSE_START + timedelta(seconds=EXPORT_DURATION // 2), os.path.abspath(OUTPUT_PATH))
+    else:
+        benchmark_session.save()
+    queries = {}
+    # The first run also derives the snapshot tables, the next ones measure each "Show only" mode
+    app = page_app(page, None)
+    app.run()
+    runs = [("cold", None)]
+    for mode in [None] + (show_only(app)[0].options[1:] if show_only(app) else []):
+        runs += [("default" if mode is None else mode, mode)] * repeat
+    for name, mode in runs:
+        app = page_app(page, mode)
+        app.run()
+        if app.exception:
+            return {"error": app.exception[0].value}
+        for number, log in enumerate(app.session_state["query_log"]):
+            key = f"{page}:{session}:{name}:{number}"
+            queries.setdefault(key, dict(log, seconds=[]))["seconds"].append(log["seconds"])
+    for key, log in queries.items():
+        log["seconds"] = statistics.median(log["seconds"])
+        log["query"] = hashlib.sha1(log["query"].encode()).hexdigest()[:8] + " " + " ".join(log["query"].split())[:80]
+    return {"queries": queries, "peak_memory": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024}
+
+
+def benchmark_page(path, page, repeat, session):
+    environment = dict(
+        os.environ,
+        PYTHONPATH=ROOT,
+        RSBV_QUERY_CACHE_SIZE="0",
+    )
+    process = subprocess.run(
+        [sys.executable, os.path.abspath(__file__), "--page", page, "--repeat", str(repeat), "--session", session],
+        cwd=path,
+        env=environment,
+        capture_output=True,
+        text=True,
+    )
+    if process.returncode != 0:
+        return {"error": process.stderr.strip().splitlines()[-1]}
+    return json.loads(process.stdout.strip().splitlines()[-1])
+
+
+def benchmark_intervals(events, ports=2000, intervals=20000):
+    con = duckdb.connect(database=":memory:")
+    span = max(1, 600 * ports // intervals)
+    con.execute(f"""CREATE TABLE interval AS SELECT (i % {ports}) + 30000 AS port, 'command' || (i % 50) AS command,
+        TIMESTAMP '{EXPORT_START}' + TO_SECONDS((i // {ports}) * {span}) AS started_at,
+        TIMESTAMP '{EXPORT_START}' + TO_SECONDS((i // {ports}) * {span} + {span} - 1) AS inserted_at
+        FROM range({intervals}) t(i)""")
+    con.execute(f"""CREATE TABLE event AS SELECT (HASH(i) % {ports})::INTEGER + 30000 AS port,
+        TIMESTAMP '{EXPORT_START}' + TO_MICROSECONDS((HASH(i, 'time') % 600000000)::BIGINT) AS created_at
+        FROM range({events}) t(i)""")
+    start = timer()
+    con.execute("""CREATE TABLE interval_index AS SELECT interval.*, bucket FROM interval,
+        UNNEST(GENERATE_SERIES(DATE_TRUNC('minute', started_at), DATE_TRUNC('minute', inserted_at), INTERVAL 1 MINUTE))
+        t(bucket)""")
+    results = {"index_build": timer() - start}
+    for name, query in INTERVAL_QUERIES.items():
+        start = timer()
+        con.execute(query).fetchall()
+        results[name] = timer() - start
+    return results
+
+
+def regressions(results, baseline, threshold, min_seconds):
+    failures = []
+    for scale, pages in results.items():
+        for name, page in pages.items():
+            for key, log in page.get("queries", {}).items():
+                previous = baseline.get(scale, {}).get(name, {}).get("queries", {}).get(key)
+                if previous is None:
+                    continue
+                slower = log["seconds"] - previous["seconds"]
+                if slower > min_seconds and log["seconds"] > previous["seconds"] * (1 + threshold):
+                    failures.append(f"{scale} {key}: {previous['seconds']:.4f}s -> {log['seconds']:.4f}s")
+    return failures
+
+
+def report(scale, page, result):
+    if "error" in result:
+        print(f"{scale:>10} {page}: {result['error']}")
+        return
+    print(f"{scale:>10} {page}: peak memory {round(result['peak_memory'] / (1024 * 1024))} Mo")
+    for key, log in result["queries"].items():
+        print(f"{'':>10} {key.split(':', 2)[2]:<30} {log['seconds']:>9.4f}s {log['rows']:>9} rows  {log['query']}")
+
+
+def run():
+    parser = argparse.ArgumentParser(description="Benchmark dashboard queries on synthetic rstracer exports.")
+    parser.add_argument("--scales", type=int, nargs="+", default=SCALES, help="rows per fact table")
+    parser.add_argument("--pages", nargs="+", default=PAGES)
+    parser.add_argument("--path", default=BENCHMARK_PATH, help="directory of the generated exports")
+    parser.add_argument("--repeat", type=int, default=3, help="runs per page and mode, the median is kept")
+    parser.add_argument(
+        "--sessions", nargs="+", choices=SESSIONS, default=SESSIONS, help="read the export as a stored or live session"
+    )
+    parser.add_argument("--intervals", action="store_true", help="compare the interval join strategies")
+    parser.add_argument("--output", help="write the results as json")
+    parser.add_argument("--baseline", help="json results to compare with")
+    parser.add_argument("--threshold", type=float, default=0.25, help="tolerated slowdown ratio per query")
+    parser.add_argument("--min-seconds", type=float, default=0.01, help="ignore slowdowns below this duration")
+    parser.add_argument("--page", help=argparse.SUPPRESS)
+    parser.add_argument("--session", choices=SESSIONS, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.page:
+        print(json.dumps(run_page(args.page, args.repeat, args.session)))
+        return
+
+    results = {}
+    for scale in args.scales:
+        path = os.path.abspath(os.path.join(args.path, str(scale)))
+        if not os.path.exists(os.path.join(path, OUTPUT_PATH)):
+            start = timer()
+            generate(os.path.join(path, OUTPUT_PATH), scale)
+            print(f"{scale:>10} export generated in {timer() - start:.2f}s")
+        results[str(scale)] = {}
+        for page in args.pages:
+            for session in args.sessions:
+                name = f"{page}:{session}"
+                results[str(scale)][name] = benchmark_page(path, page, args.repeat, session)
+                report(scale, name, results[str(scale)][name])
+        if args.intervals:
+            results[str(scale)]["intervals"] = benchmark_intervals(scale)
+            print(
+                f"{scale:>10} intervals: "
+                + ", ".join(f"{k} {v:.4f}s" for k, v in results[str(scale)]["intervals"].items())
+            )
+
+    if args.output:
+        with open(args.output, "w") as output_file:
+            json.dump(results, output_file, indent=2)
+    if args.baseline:
+        with open(args.baseline) as baseline_file:
+            failures = regressions(results, json.load(baseline_file), args.threshold, args.min_seconds)
+        for failure in failures:
+            print(f"Regression {failure}")
+        if failures:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    run()
@@ -0,0 +1,130 @@
+import os
+import shlex
+import subprocess
+import threading
+from datetime import datetime, timezone
+from time import sleep
+
+import duckdb
+import pandas as pd
+
+CGROUP_ROOT = "/sys/fs/cgroup/rsbv"
+CONTROLLERS = "+cpu +memory +io"
+SAMPLE_INTERVAL = 0.1
+REMOVE_TIMEOUT = 5
+
+CPU_COUNTERS = {"usage_usec": "cpu_usage_usec", "user_usec": "cpu_user_usec", "system_usec": "cpu_system_usec"}
+# Summed over every device of io.stat
+IO_COUNTERS = {"rbytes": "io_read_bytes", "wbytes": "io_write_bytes", "rios": "io_read_count", "wios": "io_write_count"}
+
+
+def cgroup_available():
+    return os.path.exists("/sys/fs/cgroup/cgroup.controllers")
+
+
+class Cgroup:
+    # Dedicated cgroup v2 of a launched command: members are exact whatever their parent, counters are read
+    # at a high rate and the whole command is killed at once
+
+    def __init__(self, name):
+        self.path = f"{CGROUP_ROOT}/{name}"
+        self.stats = []
+        # Presence intervals of each pid, a new one starts when a pid comes back after pid reuse
+        self.members = []
+        self.current = {}
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+
+    def create(self):
+        subprocess.run(["sudo", "mkdir", "-p", self.path], check=True)
+        # Controllers missing from the hierarchy only leave their counters out
+        subprocess.run(
+            ["sudo", "sh", "-c", f"echo '{CONTROLLERS}' > {CGROUP_ROOT}/cgroup.subtree_control"],
+            stderr=subprocess.DEVNULL,
+        )
+
+    def command(self, command, user):
+        # The shell joins the cgroup before it becomes the command, every process it starts is then a member
+        script = f"echo $$ > {self.path}/cgroup.procs && exec sudo -u {shlex.quote(user)} {command}"
+        return f"sudo sh -c {shlex.quote(script)}"
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    def run(self):
+        while not self.stopped.wait(SAMPLE_INTERVAL):
+            self.record()
+
+    def stop(self):
+        self.stopped.set()
+        if self.thread.is_alive():
+            self.thread.join()
+
+    def read(self, name):
+        try:
+            with open(f"{self.path}/{name}") as cgroup_file:
+                return cgroup_file.read()
+        except OSError:
+            return None
+
+    def pids(self):
+        procs = self.read("cgroup.procs")
+        return [int(pid) for pid in procs.split()] if procs else []
+
+    def sample(self):
+        stat = {"created_at": datetime.now(timezone.utc).replace(tzinfo=None)}
+        for column in CPU_COUNTERS.values():
+            stat[column] = None
+        for line in (self.read("cpu.stat") or "").splitlines():
+            key, value = line.split()
+            if key in CPU_COUNTERS:
+                stat[CPU_COUNTERS[key]] = int(value)
+        memory = self.read("memory.current")
+        stat["memory_current"] = int(memory) if memory else None
+        for column in IO_COUNTERS.values():
+            stat[column] = 0
+        for line in (self.read("io.stat") or "").splitlines():
+            for counter in line.split()[1:]:
+                key, value = counter.split("=")
+                if key in IO_COUNTERS:
+                    stat[IO_COUNTERS[key]] += int(value)
+        return stat
+
+    def record(self):
+        stat = self.sample()
+        pids = self.pids()
+        stat["process_count"] = len(pids)
+        self.stats.append(stat)
+        for pid in pids:
+            if pid not in self.current:
+                self.current[pid] = {"pid": pid, "first_seen": stat["created_at"]}
+                self.members.append(self.current[pid])
+            self.current[pid]["last_seen"] = stat["created_at"]
+        self.current = {pid: self.current[pid] for pid in pids}
+
+    def kill(self):
+        # cgroup.kill (Linux 5.14) kills every member at once, older kernels signal the members one by one
+        if os.path.exists(f"{self.path}/cgroup.kill"):
+            subprocess.run(["sudo", "sh", "-c", f"echo 1 > {self.path}/cgroup.kill"])
+        elif self.pids():
+            subprocess.run(["sudo", "kill", "-TERM"] + [str(pid) for pid in self.pids()])
+
+    def remove(self):
+        # Sampling goes on until the last member exited, the cgroup is only removable once empty
+        for _ in range(int(REMOVE_TIMEOUT / SAMPLE_INTERVAL)):
+            if not self.pids():
+                break
+            sleep(SAMPLE_INTERVAL)
+        self.stop()
+        subprocess.run(["sudo", "rmdir", self.path])
+
+    def write(self, directory):
+        # Stored next to the session tables, as the archived dimensions
+        with duckdb.connect() as con:
+            for table, rows in [("cgroup_stat", self.stats), ("cgroup_process", self.members)]:
+                if rows:
+                    os.makedirs(f"{directory}/{table}", exist_ok=True)
+                    con.register("rows", pd.DataFrame(rows))
+                    con.execute(f"COPY rows TO '{directory}/{table}/data.parquet' (FORMAT PARQUET, COMPRESSION ZSTD)")
+                    con.unregister("rows")
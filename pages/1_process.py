@@ -1,104 +1,177 @@
-import os
-from datetime import datetime
 from timeit import default_timer as timer
 
 import streamlit as st
 
-from pages import connection, get_descendants
+from pages import (
+    SHOW_ALL,
+    SHOW_LAUNCHED,
+    SHOW_NEW,
+    LiveSeries,
+    ShowFilter,
+    connection,
+    get_descendants,
+    live_fragment,
+    query_cache_stats,
+    query_panel,
+    register_launched_tree,
+    register_process_key,
+    register_process_tree,
+    select_session,
+    snapshot_cursor,
+)
+
+SHOW_ONLY = {
+    "launched processes": SHOW_LAUNCHED,
+    "new processes": SHOW_NEW,
+    "all processes": SHOW_ALL,
+}
 
-start_timer = timer()
-con = connection()
-analyse_start = datetime.strptime(os.environ["RSBV_START"], "%Y/%m/%d %H:%M:%S")
-pid = int(os.environ["RSBV_PID"])
-descendants = get_descendants(con, pid)
-rstracer_processes = get_descendants(con, int(os.environ["RSBV_RSTRACER_PID"]))
 
+def register_tables(con):
+    launched = register_launched_tree(con, pid)
+    tracer = register_process_tree(con, session.tracer_pid)
+    register_process_key(con, "gold_fact_process")
+    return launched, tracer
 
+
+start_timer = timer()
 st.set_page_config(
     page_title="Process",
     page_icon="⚙",
     layout="wide",
 )
+session = select_session()
+con = connection(session)
+analyse_start = session.started_at
+pid = session.pid
+descendants = get_descendants(con, pid, cgroup=True)
+launched, tracer = register_tables(con)
+
+
 st.header("Process", divider=True)
 
 
 # SLIDE BAR
 st.sidebar.header("Parameters", divider=True)
 
-show = st.sidebar.selectbox("Show only", ["launched processes", "new processes", "all processes"])
+show = st.sidebar.selectbox("Show only", SHOW_ONLY)
 
-# Base filter arguments
+# Base filter
 
-filter_args = [
-    [process.pid for process in descendants],
-    show,
-    analyse_start,
-    show,
-    show,
-    [process.pid for process in rstracer_processes],
-]
+show_filter = ShowFilter(SHOW_ONLY[show], launched, analyse_start)
 
 # Mem & Cpu Analysis
 
-resource_per_command = con.execute(
-    """
+
+@live_fragment(session)
+def resource_usage():
+    con = snapshot_cursor(session)
+    register_tables(con)
+    series = LiveSeries("process_resource", (session.id, session.path, show))
+    resource_per_command = series.append(
+        con.execute(
+            f"""
 SELECT
     MAX(fact.pcpu) AS pcpu,
     MAX(fact.pmem) AS pmem,
     COALESCE(dim.command, dim.full_command) AS command,
     TO_TIMESTAMP(FLOOR(EXTRACT('epoch' FROM fact.created_at))) AT TIME ZONE 'UTC' AS time,
 FROM
-    gold_fact_process fact
+    gold_fact_process_keyed fact
 LEFT JOIN
-    gold_dim_process dim ON fact.pid = dim.pid
-WHERE ((fact.pid IN ? AND ? = 'launched processes')
-OR (dim.started_at >= ? AND ? = 'new processes')
-OR (? = 'all processes'))
-AND fact.pid NOT IN ?
+    gold_dim_process dim ON fact.process_key = dim.process_key
+ANTI JOIN {tracer} tracer ON fact.process_key = tracer._id
+WHERE {show_filter.predicate("fact.process_key", "dim.started_at")}
+AND {series.predicate("fact.created_at")}
 GROUP BY time, COALESCE(dim.command, dim.full_command)
 ORDER BY time
 """,
-    filter_args,
-).df()
+            show_filter.parameters + series.parameters,
+        ).df()
+    )
+
+    st.subheader("CPU Usage by Command", divider=True)
+    st.area_chart(
+        resource_per_command,
+        x="time",
+        y="pcpu",
+        color="command",
+        stack="center",
+        x_label="date",
+        y_label="CPU usage",
+    )
+    st.subheader("Memory Usage by Command", divider=True)
+    st.area_chart(
+        resource_per_command,
+        x="time",
+        y="pmem",
+        color="command",
+        stack="center",
+        x_label="date",
+        y_label="Memory usage (%)",
+    )
+
+
+resource_usage()
+
+
+# Cgroup accounting of a contained command
+
+
+@live_fragment(session)
+def cgroup_usage():
+    con = snapshot_cursor(session)
+    cgroup_stat = con.execute("""
+SELECT
+    created_at AS time,
+    (cpu_usage_usec - LAG(cpu_usage_usec) OVER (ORDER BY created_at))
+    / EPOCH_US(created_at - LAG(created_at) OVER (ORDER BY created_at)) * 100 AS pcpu,
+    memory_current / (1024 * 1024) AS memory,
+    io_read_bytes / (1024 * 1024) AS read,
+    io_write_bytes / (1024 * 1024) AS written,
+FROM cgroup_stat
+ORDER BY created_at
+""").df()
+    if cgroup_stat.empty:
+        return
+
+    st.subheader("Cgroup Usage", divider=True)
+    st.text("CPU time of every process of the command, 100% is one core")
+    st.line_chart(cgroup_stat, x="time", y="pcpu", x_label="date", y_label="CPU usage (%)")
+    st.text("Memory charged to the command, page cache included")
+    st.line_chart(cgroup_stat, x="time", y="memory", x_label="date", y_label="Memory (Mo)")
+    st.text("Cumulated disk reads and writes of the command")
+    st.line_chart(cgroup_stat, x="time", y=["read", "written"], x_label="date", y_label="Disk (Mo)")
+
+
+cgroup_usage()
 
 
-st.subheader("CPU Usage by Command", divider=True)
-st.area_chart(
-    resource_per_command, x="time", y="pcpu", color="command", stack="center", x_label="date", y_label="CPU usage"
-)
-st.subheader("Memory Usage by Command", divider=True)
-st.area_chart(
-    resource_per_command,
-    x="time",
-    y="pmem",
-    color="command",
-    stack="center",
-    x_label="date",
-    y_label="Memory usage (%)",
-)
+# Process count
 
 
-# Process count
+@live_fragment(session)
+def process_repartition():
+    con = snapshot_cursor(session)
+    register_tables(con)
 
-st.subheader("Process Repartition", divider=True)
+    st.subheader("Process Repartition", divider=True)
 
-# Process by Commands
+    # Process by Commands
 
-process_by_command_count = con.execute(
-    """
+    process_by_command_count = con.execute(
+        f"""
 WITH process AS
 (
     SELECT DISTINCT
         fact.pid,
         COALESCE(dim.command, dim.full_command) AS command,
     FROM
-        gold_fact_process fact
+        gold_fact_process_keyed fact
     LEFT JOIN
-        gold_dim_process dim ON fact.pid = dim.pid
-    WHERE ((fact.pid IN ? AND ? = 'launched processes')
-    OR (dim.started_at >= ? AND ? = 'new processes')
-    OR (? = 'all processes'))
-    AND fact.pid NOT IN ?
+        gold_dim_process dim ON fact.process_key = dim.process_key
+    ANTI JOIN {tracer} tracer ON fact.process_key = tracer._id
+    WHERE {show_filter.predicate("fact.process_key", "dim.started_at")}
 )
 SELECT
     command,
@@ -107,23 +180,23 @@ FROM process
 GROUP BY command
 ORDER BY count DESC
 """,
-    filter_args,
-).df()
-
-st.text("Process total launched by command")
-st.bar_chart(
-    process_by_command_count,
-    x="command",
-    y="count",
-    x_label="command",
-    y_label="count",
-    color="command",
-)
-
-# Process list
-
-process_list = con.execute(
-    """
+        show_filter.parameters,
+    ).df()
+
+    st.text("Process total launched by command")
+    st.bar_chart(
+        process_by_command_count,
+        x="command",
+        y="count",
+        x_label="command",
+        y_label="count",
+        color="command",
+    )
+
+    # Process list
+
+    process_list = con.execute(
+        f"""
 SELECT DISTINCT
     started_at AS 'started at',
     pid,
@@ -132,18 +205,19 @@ SELECT DISTINCT
     full_command AS command,
 FROM gold_dim_process
 LEFT JOIN gold_file_user ON gold_file_user.uid = gold_dim_process.uid
-WHERE ((pid IN ? AND ? = 'launched processes')
-OR (started_at >= ? AND ? = 'new processes')
-OR (? = 'all processes'))
-AND pid NOT IN ?
+ANTI JOIN {tracer} tracer ON gold_dim_process.process_key = tracer._id
+WHERE {show_filter.predicate("process_key", "started_at")}
 ORDER BY started_at ASC
 LIMIT 300
 """,
-    filter_args,
-).df()
+        show_filter.parameters,
+    ).df()
+
+    st.subheader("Process History", divider=True)
+    st.dataframe(process_list, use_container_width=True, hide_index=True)
+
 
-st.subheader("Process History", divider=True)
-st.dataframe(process_list, use_container_width=True, hide_index=True)
+process_repartition()
 
 # Statistics
 
@@ -158,24 +232,26 @@ st.sidebar.write("Command sub-processes: ", len(descendants))
 # Process count
 
 process_total = con.execute(
-    """
+    f"""
 SELECT
     COUNT(DISTINCT ROW(fact.pid, dim.started_at)) AS count,
 FROM
-    gold_fact_process fact
+    gold_fact_process_keyed fact
 LEFT JOIN
-    gold_dim_process pro ON fact.pid = pro.pid
-LEFT JOIN gold_dim_process dim ON fact.pid = dim.pid
-WHERE ((fact.pid IN ? AND ? = 'launched processes')
-OR (dim.started_at >= ? AND ? = 'new processes')
-OR (? = 'all processes'))
-AND fact.pid NOT IN ?
+    gold_dim_process dim ON fact.process_key = dim.process_key
+ANTI JOIN {tracer} tracer ON fact.process_key = tracer._id
+WHERE {show_filter.predicate("fact.process_key", "dim.started_at")}
 """,
-    filter_args,
+    show_filter.parameters,
 ).fetchone()[0]
 
 st.sidebar.write("Process total: ", process_total)
 
+# Query cache
+st.sidebar.write("Query cache: ", query_cache_stats())
+
 # Running time
 end_timer = timer()
 st.sidebar.write("Running time: ", round(end_timer - start_timer, 4), " seconds")
+
+query_panel()
@@ -1,78 +1,121 @@
-import os
-from datetime import datetime
 from timeit import default_timer as timer
 
 import streamlit as st
 
-from pages import connection, get_descendants
+from pages import (
+    SHOW_ALL,
+    SHOW_LAUNCHED,
+    SHOW_NEW,
+    LiveSeries,
+    ShowFilter,
+    connection,
+    live_fragment,
+    query_cache_stats,
+    query_panel,
+    register_launched_tree,
+    register_process_key,
+    register_process_tree,
+    select_session,
+    snapshot_cursor,
+)
 
-start_timer = timer()
-con = connection()
-analyse_start = datetime.strptime(os.environ["RSBV_START"], "%Y/%m/%d %H:%M:%S")
-pid = int(os.environ["RSBV_PID"])
+SHOW_ONLY = {
+    "launched processes": SHOW_LAUNCHED,
+    "new processes": SHOW_NEW,
+    "all processes": SHOW_ALL,
+}
+
+# Files resolved to the process incarnation of their last sample, a join on pid matches every incarnation of a pid
+FILE_QUERY = """
+SELECT
+    dim.*,
+    keyed.process_key,
+FROM gold_dim_file_reg dim
+LEFT JOIN (
+    SELECT pid, fd, node, ARG_MAX(process_key, created_at) AS process_key
+    FROM gold_fact_file_reg_keyed
+    GROUP BY pid, fd, node
+) keyed ON dim.pid = keyed.pid AND dim.fd = keyed.fd AND dim.node = keyed.node
+"""
 
-descendants = get_descendants(con, pid)
-rstracer_processes = get_descendants(con, int(os.environ["RSBV_RSTRACER_PID"]))
 
+def register_tables(con):
+    launched = register_launched_tree(con, pid)
+    tracer = register_process_tree(con, session.tracer_pid)
+    register_process_key(con, "gold_fact_file_reg")
+    return launched, tracer
+
+
+start_timer = timer()
 st.set_page_config(
     page_title="Files",
     page_icon="📄",
     layout="wide",
 )
+session = select_session()
+con = connection(session)
+analyse_start = session.started_at
+pid = session.pid
+
+launched, tracer = register_tables(con)
+
 st.header("Regular Files", divider=True)
 
 
 # SLIDE BAR
 st.sidebar.header("Parameters", divider=True)
 
-show = st.sidebar.selectbox("Show only", ["launched processes", "new processes", "all processes"])
+show = st.sidebar.selectbox("Show only", SHOW_ONLY)
 
-# Base filter arguments
+# Base filter
 
-filter_args = [
-    [process.pid for process in descendants],
-    show,
-    analyse_start,
-    show,
-    show,
-    [process.pid for process in rstracer_processes],
-]
+show_filter = ShowFilter(SHOW_ONLY[show], launched, analyse_start)
 
 # Open files Count
 
-st.subheader("Activity", divider=True)
-open_files_chart_row = st.columns(2)
 
-files_count = con.execute(
-    """
+@live_fragment(session)
+def activity():
+    con = snapshot_cursor(session)
+    register_tables(con)
+
+    st.subheader("Activity", divider=True)
+
+    files_count_series = LiveSeries("files_count", (session.id, session.path, show))
+    files_count = files_count_series.append(
+        con.execute(
+            f"""
 SELECT
   COUNT(DISTINCT dim.name) AS count,
   TO_TIMESTAMP(FLOOR(EXTRACT('epoch' FROM fact.created_at))) AT TIME ZONE 'UTC' AS time,
 FROM
-  gold_fact_file_reg fact
-  LEFT JOIN gold_dim_process pro ON fact.pid = pro.pid
+  gold_fact_file_reg_keyed fact
+  LEFT JOIN gold_dim_process pro ON fact.process_key = pro.process_key
   LEFT JOIN gold_dim_file_reg dim ON fact.pid = dim.pid AND fact.fd = dim.fd AND fact.node = dim.node
-WHERE ((fact.pid IN ? AND ? = 'launched processes')
-    OR (pro.started_at >= ? AND ? = 'new processes')
-    OR (? = 'all processes'))
-    AND fact.pid NOT IN ?
+ANTI JOIN {tracer} tracer ON fact.process_key = tracer._id
+WHERE {show_filter.predicate("fact.process_key", "pro.started_at")}
+AND {files_count_series.predicate("fact.created_at")}
 GROUP BY
   time
 ORDER BY
   time
 """,
-    filter_args,
-).df()
+            show_filter.parameters + files_count_series.parameters,
+        ).df()
+    )
 
-st.text("Open files total")
-st.line_chart(data=files_count, x="time", y="count", x_label="date", y_label="count")
+    st.text("Open files total")
+    st.line_chart(data=files_count, x="time", y="count", x_label="date", y_label="count")
 
-# Modification I/0
+    # Modification I/0
 
-st.subheader("Modification size by command", divider=True)
+    st.subheader("Modification size by command", divider=True)
 
-modification_by_commands = con.execute(
-    """
+    # The size delta needs the previous sample of each file, only the rows after the window are limited to new times
+    modification_series = LiveSeries("files_modification", (session.id, session.path, show))
+    modification_by_commands = modification_series.append(
+        con.execute(
+            f"""
 SELECT
   TO_TIMESTAMP(FLOOR(EXTRACT('epoch' FROM created_at))) AT TIME ZONE 'UTC' AS time,
   command,
@@ -100,45 +143,53 @@ FROM
             fact.created_at
       ) AS row_num
    FROM
-      gold_fact_file_reg fact
-      LEFT JOIN gold_dim_process pro ON fact.pid = pro.pid
+      gold_fact_file_reg_keyed fact
+      LEFT JOIN gold_dim_process pro ON fact.process_key = pro.process_key
+   ANTI JOIN {tracer} tracer ON fact.process_key = tracer._id
    WHERE
-     ((fact.pid IN ? AND ? = 'launched processes')
-        OR (pro.started_at >= ? AND ? = 'new processes')
-        OR (? = 'all processes'))
-    AND fact.pid NOT IN ?
+     {show_filter.predicate("fact.process_key", "pro.started_at")}
   )
 WHERE
   SIZE <> previous_size
   AND row_num > 1
+  AND {modification_series.predicate("created_at")}
 GROUP BY
  time,
  command
 ORDER BY
  time
   """,
-    filter_args,
-).df()
-
-
-st.area_chart(
-    modification_by_commands,
-    x="time",
-    y="write_mo",
-    color="command",
-    stack="center",
-    x_label="date",
-    y_label="size (Mo)",
-)
+            show_filter.parameters + modification_series.parameters,
+        ).df()
+    )
+
+    st.area_chart(
+        modification_by_commands,
+        x="time",
+        y="write_mo",
+        color="command",
+        stack="center",
+        x_label="date",
+        y_label="size (Mo)",
+    )
+
+
+activity()
 
 # Open files list
 
-st.subheader("History", divider=True)
 
-show_only_modified_files = st.checkbox("Show only modified files", value=True)
+@live_fragment(session)
+def history():
+    con = snapshot_cursor(session)
+    register_tables(con)
+
+    st.subheader("History", divider=True)
 
-files_list = con.execute(
-    """
+    show_only_modified_files = st.checkbox("Show only modified files", value=True)
+
+    files_list = con.execute(
+        f"""
 SELECT
   pid,
   command,
@@ -154,36 +205,33 @@ FROM
       dim.name AS file,
       ROUND((MAX(size) - MIN(size)) / (1024 * 1024) , 3) AS modification_size
     FROM
-      gold_fact_file_reg fact
-      LEFT JOIN gold_dim_process pro ON fact.pid = pro.pid
+      gold_fact_file_reg_keyed fact
+      LEFT JOIN gold_dim_process pro ON fact.process_key = pro.process_key
       LEFT JOIN gold_file_user usr ON pro.uid = usr.uid
       LEFT JOIN gold_dim_file_reg dim ON fact.pid = dim.pid AND fact.fd = dim.fd AND fact.node = dim.node
+    ANTI JOIN {tracer} tracer ON fact.process_key = tracer._id
     WHERE
-     ((fact.pid IN ? AND ? = 'launched processes')
-        OR (pro.started_at >= ? AND ? = 'new processes')
-        OR (? = 'all processes'))
-    AND fact.pid NOT IN ?
+     {show_filter.predicate("fact.process_key", "pro.started_at")}
     GROUP BY
       fact.pid,
       pro.command,
       user,
       file
 )
-WHERE (modification_size > 0 OR NOT ?)
+{"WHERE modification_size > 0" if show_only_modified_files else ""}
 ORDER BY modification_size DESC
 """,
-    filter_args + [show_only_modified_files],
-).df()
-
-st.dataframe(files_list, use_container_width=True, hide_index=True)
+        show_filter.parameters,
+    ).df()
 
+    st.dataframe(files_list, use_container_width=True, hide_index=True)
 
-# File by command
+    # File by command
 
-st.subheader("Command with most open files", divider=True)
+    st.subheader("Command with most open files", divider=True)
 
-file_by_command_count = con.execute(
-    """
+    file_by_command_count = con.execute(
+        f"""
 SELECT
   command,
   COUNT(DISTINCT file_name) AS count
@@ -199,15 +247,13 @@ FROM
       MIN(size) AS min_size,
       MAX(size) AS max_size
    FROM
-      gold_fact_file_reg fact
-      LEFT JOIN gold_dim_process pro ON fact.pid = pro.pid
+      gold_fact_file_reg_keyed fact
+      LEFT JOIN gold_dim_process pro ON fact.process_key = pro.process_key
       LEFT JOIN gold_file_user usr ON pro.uid = usr.uid
       LEFT JOIN gold_dim_file_reg dim ON fact.pid = dim.pid AND fact.fd = dim.fd AND fact.node = dim.node
+   ANTI JOIN {tracer} tracer ON fact.process_key = tracer._id
    WHERE
-     ((fact.pid IN ? AND ? = 'launched processes')
-        OR (pro.started_at >= ? AND ? = 'new processes')
-        OR (? = 'all processes'))
-    AND fact.pid NOT IN ?
+     {show_filter.predicate("fact.process_key", "pro.started_at")}
    GROUP BY
       fact.pid,
       fact.fd,
@@ -221,17 +267,20 @@ GROUP BY
 ORDER BY
  count DESC
 """,
-    filter_args,
-).df()
-
-st.bar_chart(
-    file_by_command_count,
-    x="command",
-    y="count",
-    x_label="command",
-    y_label="count",
-    color="command",
-)
+        show_filter.parameters,
+    ).df()
+
+    st.bar_chart(
+        file_by_command_count,
+        x="command",
+        y="count",
+        x_label="command",
+        y_label="count",
+        color="command",
+    )
+
+
+history()
 
 # Statistics
 
@@ -240,42 +289,39 @@ st.sidebar.header("Statistics", divider=True)
 # Open nodes
 
 open_nodes = con.execute(
-    """
+    f"""
+WITH file AS ({FILE_QUERY})
 SELECT
     COUNT(*) AS count
-FROM
-    gold_dim_file_reg file
-    LEFT JOIN gold_dim_process pro ON file.pid = pro.pid
-    WHERE ((file.pid IN ? AND ? = 'launched processes')
-        OR (pro.started_at >= ? AND ? = 'new processes')
-        OR (? = 'all processes'))
-    AND file.pid NOT IN ?
+FROM file
+    LEFT JOIN gold_dim_process pro ON file.process_key = pro.process_key
+    ANTI JOIN {tracer} tracer ON file.process_key = tracer._id
+    WHERE {show_filter.predicate("file.process_key", "pro.started_at")}
 """,
-    filter_args,
+    show_filter.parameters,
 ).fetchone()[0]
 st.sidebar.write("Opened nodes: ", open_nodes)
 
 # Open files
 
 open_files = con.execute(
-    """
+    f"""
+WITH file AS ({FILE_QUERY})
 SELECT
     COUNT(DISTINCT file.name) AS count
-FROM gold_dim_file_reg file
-    LEFT JOIN gold_dim_process pro ON file.pid = pro.pid
-    WHERE ((file.pid IN ? AND ? = 'launched processes')
-        OR (pro.started_at >= ? AND ? = 'new processes')
-        OR (? = 'all processes'))
-    AND file.pid NOT IN ?
+FROM file
+    LEFT JOIN gold_dim_process pro ON file.process_key = pro.process_key
+    ANTI JOIN {tracer} tracer ON file.process_key = tracer._id
+    WHERE {show_filter.predicate("file.process_key", "pro.started_at")}
 """,
-    filter_args,
+    show_filter.parameters,
 ).fetchone()[0]
 st.sidebar.write("Opened files: ", open_files)
 
 # Modified files
 
 modified_files = con.execute(
-    """
+    f"""
 SELECT
   COUNT(*) AS count
 FROM
@@ -284,29 +330,27 @@ FROM
       MIN(size) AS min_size,
       MAX(size) AS max_size
    FROM
-      gold_fact_file_reg fact
-     LEFT JOIN gold_dim_process pro ON fact.pid = pro.pid
-     LEFT JOIN gold_dim_file_reg file ON fact.pid = file.pid
+      gold_fact_file_reg_keyed fact
+     LEFT JOIN gold_dim_process pro ON fact.process_key = pro.process_key
+     INNER JOIN gold_dim_file_reg file ON fact.pid = file.pid
      AND fact.fd = file.fd
      AND fact.node = file.node
-     WHERE ((file.pid IN ? AND ? = 'launched processes')
-        OR (pro.started_at >= ? AND ? = 'new processes')
-        OR (? = 'all processes'))
-     AND file.pid NOT IN ?
+     ANTI JOIN {tracer} tracer ON fact.process_key = tracer._id
+     WHERE {show_filter.predicate("fact.process_key", "pro.started_at")}
    GROUP BY
      file.name,
      )
 WHERE
   max_size <> min_size
 """,
-    filter_args,
+    show_filter.parameters,
 ).fetchone()[0]
 st.sidebar.write("Modified files: ", modified_files)
 
 # Modification size
 
 modification_size = con.execute(
-    """
+    f"""
 SELECT
   ROUND(SUM(max_size - min_size) / (1024 * 1024), 3) AS write_mo
 FROM
@@ -315,15 +359,13 @@ FROM
       MIN(size) AS min_size,
       MAX(size) AS max_size
    FROM
-      gold_fact_file_reg fact
-     LEFT JOIN gold_dim_process pro ON fact.pid = pro.pid
-     LEFT JOIN gold_dim_file_reg file ON fact.pid = file.pid
+      gold_fact_file_reg_keyed fact
+     LEFT JOIN gold_dim_process pro ON fact.process_key = pro.process_key
+     INNER JOIN gold_dim_file_reg file ON fact.pid = file.pid
      AND fact.fd = file.fd
      AND fact.node = file.node
-     WHERE ((file.pid IN ? AND ? = 'launched processes')
-        OR (pro.started_at >= ? AND ? = 'new processes')
-        OR (? = 'all processes'))
-     AND file.pid NOT IN ?
+     ANTI JOIN {tracer} tracer ON fact.process_key = tracer._id
+     WHERE {show_filter.predicate("fact.process_key", "pro.started_at")}
    GROUP BY
       fact.pid,
      fact.fd,
@@ -333,11 +375,16 @@ FROM
 WHERE
   max_size <> min_size
 """,
-    filter_args,
+    show_filter.parameters,
 ).fetchone()[0]
 st.sidebar.write("Modification size: ", modification_size, " Mo")
 
+# Query cache
+st.sidebar.write("Query cache: ", query_cache_stats())
+
 # Running time
 
 end_timer = timer()
 st.sidebar.write("Running time: ", round(end_timer - start_timer, 4), " seconds")
+
+query_panel()
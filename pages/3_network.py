@@ -1,82 +1,115 @@
-import os
-from datetime import datetime
 from timeit import default_timer as timer
 
 import streamlit as st
 
-from pages import connection, get_descendants
+from pages import (
+    SHOW_ALL,
+    SHOW_LAUNCHED,
+    SHOW_NEW,
+    LiveSeries,
+    ShowFilter,
+    connection,
+    live_fragment,
+    query_cache_stats,
+    query_panel,
+    register_interval_index,
+    register_launched_tree,
+    register_network_flow,
+    register_process_tree,
+    select_session,
+    snapshot_cursor,
+)
 
-start_timer = timer()
-con = connection()
-analyse_start = datetime.strptime(os.environ["RSBV_START"], "%Y/%m/%d %H:%M:%S")
-pid = int(os.environ["RSBV_PID"])
+SHOW_ONLY = {
+    "all packet": SHOW_ALL,
+    "from launched processes": SHOW_LAUNCHED,
+    "new packet": SHOW_NEW,
+}
+
+
+def register_tables(con):
+    launched = register_launched_tree(con, pid)
+    tracer = register_process_tree(con, session.tracer_pid)
+    register_network_flow(con)
+    register_interval_index(con, "gold_dim_network_open_port")
+    return launched, tracer
 
-descendants = get_descendants(con, pid)
-rstracer_processes = get_descendants(con, int(os.environ["RSBV_RSTRACER_PID"]))
 
+start_timer = timer()
 st.set_page_config(
     page_title="Network Activity",
     page_icon="🛜",
     layout="wide",
 )
+session = select_session()
+con = connection(session)
+# Packets are filtered from the start of the analysis, flows aggregated by second from the second it started in
+analyse_start = session.started_at
+pid = session.pid
+
+launched, tracer = register_tables(con)
+
 st.header("Network Activity", divider=True)
 
 # SLIDE BAR
 
 st.sidebar.header("Parameters", divider=True)
 
-show = st.sidebar.selectbox("Show only", ["all packet", "from launched processes", "new packet"])
+show = st.sidebar.selectbox("Show only", SHOW_ONLY)
 
-# Base filter arguments
+# Base filter
 
-filter_args = [
-    [process.pid for process in descendants],
-    show,
-    analyse_start,
-    show,
-    show,
-    [process.pid for process in rstracer_processes],
-]
+show_filter = ShowFilter(SHOW_ONLY[show], launched, analyse_start)
 
 # Process by network
 
-st.subheader("Packet size by command", divider=True)
 
-packet_process = con.execute(
-    """
+@live_fragment(session)
+def packet_activity():
+    con = snapshot_cursor(session)
+    register_tables(con)
+
+    st.subheader("Packet size by command", divider=True)
+
+    packet_series = LiveSeries("network_packet_size", (session.id, session.path, show))
+    packet_process = packet_series.append(
+        con.execute(
+            f"""
 SELECT
     TO_TIMESTAMP(FLOOR(EXTRACT('epoch' FROM packet.created_at))) AT TIME ZONE 'UTC' AS time,
     COALESCE(pro.command, pro.full_command, 'Unknown') AS command,
     ROUND(SUM(length) / (1024 * 1024), 3) AS size
 FROM gold_fact_network_packet packet
-LEFT JOIN gold_fact_process_network net_pro ON net_pro.packet_id = packet._id
-LEFT JOIN gold_dim_process pro ON net_pro.pid = pro.pid
-WHERE  ((net_pro.pid IN ? AND ? = 'from launched processes')
-        OR (packet.created_at >= ? AND ? = 'new packet')
-        OR (? = 'all packet'))
-    AND COALESCE(net_pro.pid, -1) NOT IN ?
+LEFT JOIN gold_fact_process_network_keyed net_pro ON net_pro.packet_id = packet._id
+LEFT JOIN gold_dim_process pro ON net_pro.process_key = pro.process_key
+ANTI JOIN {tracer} tracer ON net_pro.process_key = tracer._id
+WHERE {show_filter.predicate("net_pro.process_key", "packet.created_at")}
+AND {packet_series.predicate("packet.created_at")}
 GROUP BY time, COALESCE(pro.command, pro.full_command, 'Unknown')
 ORDER BY time
 """,
-    filter_args,
-).df()
-
-st.area_chart(
-    data=packet_process,
-    x="time",
-    y="size",
-    color="command",
-    stack="center",
-    x_label="date",
-    y_label="size (Mo)",
-)
+            show_filter.parameters + packet_series.parameters,
+        ).df()
+    )
 
-# Packet list
+    st.area_chart(
+        data=packet_process,
+        x="time",
+        y="size",
+        color="command",
+        stack="center",
+        x_label="date",
+        y_label="size (Mo)",
+    )
 
-st.subheader("Packet I/0 history", divider=True)
+    # Packet list
 
-packets = con.execute(
-    """
+    st.subheader("Packet I/0 history", divider=True)
+
+    packets_series = LiveSeries("network_packets", (session.id, session.path, show), time="created")
+    packets = packets_series.append(
+        con.execute(
+            f"""
 WITH fact_ip_host AS
 (
     SELECT
@@ -97,29 +130,38 @@ SELECT DISTINCT
     length AS 'size (bytes)',
     send AS 'local source'
 FROM gold_fact_network_packet packet
-INNER JOIN gold_fact_process_network net_pro ON net_pro.packet_id = packet._id
-LEFT JOIN gold_dim_process pro ON net_pro.pid = pro.pid
+INNER JOIN gold_fact_process_network_keyed net_pro ON net_pro.packet_id = packet._id
+LEFT JOIN gold_dim_process pro ON net_pro.process_key = pro.process_key
 LEFT JOIN fact_ip_host ip ON packet._id = ip._id
-WHERE  ((net_pro.pid IN ? AND ? = 'from launched processes')
-        OR (packet.created_at >= ? AND ? = 'new packet')
-        OR (? = 'all packet'))
-    AND COALESCE(net_pro.pid, -1) NOT IN ?
+ANTI JOIN {tracer} tracer ON net_pro.process_key = tracer._id
+WHERE {show_filter.predicate("net_pro.process_key", "packet.created_at")}
+AND {packets_series.predicate("packet.created_at")}
 ORDER BY packet.created_at
 """,
-    filter_args,
-).df()
+            show_filter.parameters + packets_series.parameters,
+        ).df()
+    )
 
-st.dataframe(packets, use_container_width=True, hide_index=True)
+    st.dataframe(packets, use_container_width=True, hide_index=True)
+
+
+packet_activity()
 
 # Protocols by size
 
-st.subheader("Protocols repartition by size", divider=True)
-protocols_size_row = st.columns(4)
 
-# Interfaces
+@live_fragment(session)
+def protocols():
+    con = snapshot_cursor(session)
+    register_tables(con)
 
-interface_by_size = con.execute(
-    """
+    st.subheader("Protocols repartition by size", divider=True)
+    protocols_size_row = st.columns(4)
+
+    # Interfaces
+
+    interface_by_size = con.execute(
+        """
 SELECT
     interface,
     ROUND(SUM(length) / (1024 * 1024), 3) AS size
@@ -127,17 +169,17 @@ FROM gold_fact_network_packet
 WHERE created_at >= ?
 GROUP BY interface
 """,
-    [analyse_start],
-).df()
-with protocols_size_row[0]:
-    st.bar_chart(
-        interface_by_size, x="interface", y="size", x_label="interface", y_label="size (Mo)", color="interface"
-    )
+        [analyse_start],
+    ).df()
+    with protocols_size_row[0]:
+        st.bar_chart(
+            interface_by_size, x="interface", y="size", x_label="interface", y_label="size (Mo)", color="interface"
+        )
 
-# Network
+    # Network
 
-network_by_size = con.execute(
-    """
+    network_by_size = con.execute(
+        """
 SELECT
     COALESCE (network, 'unknown') AS network,
     ROUND(SUM(length) / (1024 * 1024), 3) AS size
@@ -145,15 +187,15 @@ FROM gold_fact_network_packet
 WHERE created_at >= ?
 GROUP BY network
     """,
-    [analyse_start],
-).df()
-with protocols_size_row[1]:
-    st.bar_chart(network_by_size, x="network", y="size", x_label="network", y_label="size (Mo)", color="network")
+        [analyse_start],
+    ).df()
+    with protocols_size_row[1]:
+        st.bar_chart(network_by_size, x="network", y="size", x_label="network", y_label="size (Mo)", color="network")
 
-# Transport
+    # Transport
 
-transport_by_size = con.execute(
-    """
+    transport_by_size = con.execute(
+        """
 SELECT
     COALESCE (transport, 'unknown') AS transport,
     ROUND(SUM(length) / (1024 * 1024), 3) AS size
@@ -162,17 +204,17 @@ WHERE created_at >= ?
 AND network IS NOT NULL
 GROUP BY transport
     """,
-    [analyse_start],
-).df()
-with protocols_size_row[2]:
-    st.bar_chart(
-        transport_by_size, x="transport", y="size", x_label="transport", y_label="size (Mo)", color="transport"
-    )
+        [analyse_start],
+    ).df()
+    with protocols_size_row[2]:
+        st.bar_chart(
+            transport_by_size, x="transport", y="size", x_label="transport", y_label="size (Mo)", color="transport"
+        )
 
-# Transport
+    # Transport
 
-application_by_size = con.execute(
-    """
+    application_by_size = con.execute(
+        """
 SELECT
     COALESCE (application, 'unknown') AS application,
     ROUND(SUM(length) / (1024 * 1024), 3) AS size
@@ -181,78 +223,80 @@ WHERE created_at >= ?
 AND transport IS NOT NULL
 GROUP BY application
 """,
-    [analyse_start],
-).df()
-with protocols_size_row[3]:
-    st.bar_chart(
-        application_by_size,
-        x="application",
-        y="size",
-        x_label="application",
-        y_label="size (Mo)",
-        color="application",
-    )
+        [analyse_start],
+    ).df()
+    with protocols_size_row[3]:
+        st.bar_chart(
+            application_by_size,
+            x="application",
+            y="size",
+            x_label="application",
+            y_label="size (Mo)",
+            color="application",
+        )
+
+
+protocols()
 
 # Foreign IP
 
-st.subheader("Foreign IP", divider=True)
-foreign_ip_column = st.columns(2, gap="large")
 
-foreign_ip_traffic = con.execute(
-    """
-WITH fact_ip_host AS
-(
-    SELECT
-     fact.*,
-     host1.host AS source_host,
-     host2.host AS destination_host
-    FROM gold_fact_network_ip fact
-    LEFT JOIN gold_dim_network_host host1 ON fact.source_address = host1.address
-    LEFT JOIN gold_dim_network_host host2 ON fact.destination_address = host2.address
-),
-ip AS
+@live_fragment(session)
+def foreign_ip():
+    con = snapshot_cursor(session)
+    register_tables(con)
+
+    st.subheader("Foreign IP", divider=True)
+    foreign_ip_column = st.columns(2, gap="large")
+
+    foreign_ip_traffic = con.execute(
+        """
+WITH ip AS
 (
     SELECT
-        fact.created_at,
         CASE
-            WHEN source_host.address IS NOT NULL THEN fact.source_host
-            WHEN destination_host.address IS NOT NULL THEN fact.destination_host
+            WHEN source_host.address IS NOT NULL THEN flow.source_host
+            WHEN destination_host.address IS NOT NULL THEN flow.destination_host
         END AS address,
         CASE
             WHEN source_host.address IS NOT NULL THEN 0
             WHEN destination_host.address IS NOT NULL THEN 1
         END AS send,
-        pack.length,
-    FROM fact_ip_host fact
+        flow.packet_count,
+        flow.byte_count,
+        flow.epoch_sum,
+    FROM network_flow flow
     LEFT JOIN (SELECT address FROM gold_dim_network_foreign_ip) source_host
-    ON fact.source_address = source_host.address
+    ON flow.source_address = source_host.address
     LEFT JOIN (SELECT address FROM gold_dim_network_foreign_ip) destination_host
-    ON fact.destination_address = destination_host.address
-    LEFT JOIN gold_fact_network_packet pack ON fact._id = pack._id
+    ON flow.destination_address = destination_host.address
     WHERE NOT (source_host.address IS NULL AND destination_host.address IS NULL)
     AND NOT (source_host.address IS NOT NULL AND destination_host.address IS NOT NULL)
-    AND fact.created_at >= ?
+    AND flow.second >= DATE_TRUNC('second', ?::TIMESTAMP)
 )
 SELECT
     address,
-    COUNT(*) AS count,
-    ROUND(SUM(length) / (1024 * 1024), 3) AS size,
-    AVG(send) AS send,
-    TO_TIMESTAMP(AVG(EPOCH(created_at))) AS avg_date
+    SUM(packet_count)::BIGINT AS count,
+    ROUND(SUM(byte_count) / (1024 * 1024), 3) AS size,
+    SUM(send * packet_count) / SUM(packet_count) AS send,
+    TO_TIMESTAMP(SUM(epoch_sum) / SUM(packet_count)) AS avg_date
 FROM ip
 GROUP BY address
 ORDER BY size DESC
 """,
-    [analyse_start],
-).df()
+        [analyse_start],
+    ).df()
 
-with foreign_ip_column[0]:
-    st.scatter_chart(foreign_ip_traffic, x="avg_date", y="count", color="send", size="size", x_label="date")
+    with foreign_ip_column[0]:
+        st.scatter_chart(foreign_ip_traffic, x="avg_date", y="count", color="send", size="size", x_label="date")
 
-with foreign_ip_column[1]:
-    st.dataframe(
-        foreign_ip_traffic.drop(["avg_date", "send"], axis=1).rename(columns={"size": "size (Mo)"}), hide_index=True
-    )
+    with foreign_ip_column[1]:
+        st.dataframe(
+            foreign_ip_traffic.drop(["avg_date", "send"], axis=1).rename(columns={"size": "size (Mo)"}), hide_index=True
+        )
+
+
+foreign_ip()
 
 st.text(
     """Each dot represents a unique foreign IP address. Date shows the average timestamp for packets sent or received.
@@ -264,163 +308,120 @@ Dot color white reflects the local host sent more packets to this IP than receiv
 
 # Local IP
 
-st.subheader("Local IP", divider=True)
-local_ip_column = st.columns(2, gap="large")
 
-local_ip_traffic = con.execute(
-    """
-WITH fact_ip_host AS
-(
-    SELECT
-     fact.*,
-     host1.host AS source_host,
-     host2.host AS destination_host
-    FROM gold_fact_network_ip fact
-    LEFT JOIN gold_dim_network_host host1 ON fact.source_address = host1.address
-    LEFT JOIN gold_dim_network_host host2 ON fact.destination_address = host2.address
-),
-interface_host AS
-(
-    SELECT host.host
-    FROM gold_dim_network_interface int
-    LEFT JOIN gold_dim_network_host host ON host.address = int.address
-),
-ip AS
-(
-    SELECT
-        fact.created_at,
-        CASE
-            WHEN source_int.host IS NOT NULL THEN fact.source_host
-            WHEN destination_int.host IS NOT NULL THEN fact.destination_host
-        END AS address,
-        CASE
-            WHEN source_int.host IS NULL THEN 0
-            WHEN destination_int.host IS NULL THEN 1
-        END AS send,
-        pack.length,
-    FROM fact_ip_host fact
-    LEFT JOIN interface_host source_int ON fact.source_host = source_int.host
-    LEFT JOIN interface_host destination_int ON fact.destination_host = destination_int.host
-    LEFT JOIN gold_fact_network_packet pack ON fact._id = pack._id
-    WHERE NOT (source_int.host IS NULL AND destination_int.host IS NULL)
-    AND NOT (source_int.host IS NOT NULL AND destination_int.host IS NOT NULL)
-    AND fact.created_at >= ?
-)
+@live_fragment(session)
+def local_ip():
+    con = snapshot_cursor(session)
+    register_tables(con)
+
+    st.subheader("Local IP", divider=True)
+    local_ip_column = st.columns(2, gap="large")
+
+    local_ip_traffic = con.execute(
+        """
 SELECT
-    address,
-    COUNT(*) AS count,
-    ROUND(SUM(length) / (1024 * 1024), 3) AS size,
-    AVG(send) AS send,
-    TO_TIMESTAMP(AVG(EPOCH(created_at))) AS avg_date
-FROM ip
+    CASE WHEN source_local THEN source_host ELSE destination_host END AS address,
+    SUM(packet_count)::BIGINT AS count,
+    ROUND(SUM(byte_count) / (1024 * 1024), 3) AS size,
+    SUM(source_local::INTEGER * packet_count) / SUM(packet_count) AS send,
+    TO_TIMESTAMP(SUM(epoch_sum) / SUM(packet_count)) AS avg_date
+FROM network_flow
+WHERE source_local <> destination_local
+AND second >= DATE_TRUNC('second', ?::TIMESTAMP)
 GROUP BY address
 ORDER BY size DESC
 """,
-    [analyse_start],
-).df()
-
-with local_ip_column[0]:
-    st.scatter_chart(
-        local_ip_traffic,
-        x="avg_date",
-        y="count",
-        color="send",
-        size="size",
-    )
+        [analyse_start],
+    ).df()
 
-with local_ip_column[1]:
-    st.dataframe(
-        local_ip_traffic.drop(["avg_date", "send"], axis=1).rename(columns={"size": "size (Mo)"}), hide_index=True
-    )
+    with local_ip_column[0]:
+        st.scatter_chart(
+            local_ip_traffic,
+            x="avg_date",
+            y="count",
+            color="send",
+            size="size",
+        )
 
-st.text(
-    """Each dot represents a unique local IP address. Date shows the average timestamp for packets sent or received.
+    with local_ip_column[1]:
+        st.dataframe(
+            local_ip_traffic.drop(["avg_date", "send"], axis=1).rename(columns={"size": "size (Mo)"}), hide_index=True
+        )
+
+
+local_ip()
+
+st.text("""Each dot represents a unique local IP address. Date shows the average timestamp for packets sent or received.
 Count indicates the total number of packets exchanged with the IP. Dot size reflects the packet size in megabytes (MB).
 
 Dot color blue reflects this local IP received more packets than sent (send=0).
-Dot color white reflects this local IP sent more packets than received (send=1)."""
-)
+Dot color white reflects this local IP sent more packets than received (send=1).""")
 
 # Local Port
 
-st.subheader("Local Port", divider=True)
-local_port_column = st.columns(2, gap="large")
 
-local_port_traffic = con.execute(
-    """
-WITH fact_ip_host AS
+@live_fragment(session)
+def local_port():
+    con = snapshot_cursor(session)
+    register_tables(con)
+
+    st.subheader("Local Port", divider=True)
+    local_port_column = st.columns(2, gap="large")
+
+    local_port_traffic = con.execute(
+        """
+WITH ip AS
 (
     SELECT
-     fact.*,
-     host1.host AS source_host,
-     host2.host AS destination_host
-    FROM gold_fact_network_ip fact
-    LEFT JOIN gold_dim_network_host host1 ON fact.source_address = host1.address
-    LEFT JOIN gold_dim_network_host host2 ON fact.destination_address = host2.address
-),
-interface_host AS
-(
-    SELECT host.host
-    FROM gold_dim_network_interface int
-    LEFT JOIN gold_dim_network_host host ON host.address = int.address
-),
-ip AS
-(
-    SELECT fact.created_at
-        ,CASE
-            WHEN source_int.host IS NULL THEN fact.destination_port
-            WHEN destination_int.host IS NULL THEN fact.source_port
-            END AS port
-        ,CASE
-            WHEN source_int.host IS NULL THEN 0
-            WHEN destination_int.host IS NULL THEN 1
-            END AS send
-        ,pack.length
-    FROM fact_ip_host fact
-    LEFT JOIN interface_host source_int ON fact.source_host = source_int.host
-    LEFT JOIN interface_host destination_int ON fact.destination_host = destination_int.host
-    LEFT JOIN gold_fact_network_packet pack ON fact._id = pack._id
-    WHERE NOT (source_int.host IS NULL AND destination_int.host IS NULL)
-        AND NOT (source_int.host IS NOT NULL AND destination_int.host IS NOT NULL)
-        AND fact.created_at >= ?
-    )
+        first_seen,
+        CASE WHEN source_local THEN source_port ELSE destination_port END AS port,
+        source_local::INTEGER AS send,
+        packet_count,
+        byte_count,
+        epoch_sum,
+    FROM network_flow
+    WHERE source_local <> destination_local
+    AND second >= DATE_TRUNC('second', ?::TIMESTAMP)
+)
 SELECT ip.port
     ,COALESCE(dim.command, 'Unknown') AS command
-    ,COUNT(*) AS count
-    ,ROUND(SUM(ip.length) / (1024 * 1024), 3) AS size
-    ,AVG(ip.send) AS send
-    ,TO_TIMESTAMP(AVG(EPOCH(ip.created_at))) AS avg_date
+    ,SUM(ip.packet_count)::BIGINT AS count
+    ,ROUND(SUM(ip.byte_count) / (1024 * 1024), 3) AS size
+    ,SUM(ip.send * ip.packet_count) / SUM(ip.packet_count) AS send
+    ,TO_TIMESTAMP(SUM(ip.epoch_sum) / SUM(ip.packet_count)) AS avg_date
 FROM ip
-LEFT JOIN gold_dim_network_open_port dim ON ip.port = dim.port
-    AND ip.created_at >= dim.started_at
-    AND ip.created_at <= dim.inserted_at
+LEFT JOIN gold_dim_network_open_port_index dim ON ip.port = dim.port
+    AND DATE_TRUNC('minute', ip.first_seen) = dim.bucket
+    AND ip.first_seen >= dim.started_at
+    AND ip.first_seen <= dim.inserted_at
 GROUP BY ip.port, COALESCE(dim.command, 'Unknown')
 ORDER BY size DESC
 """,
-    [analyse_start],
-).df()
-
-with local_port_column[0]:
-    st.scatter_chart(
-        local_port_traffic,
-        x="avg_date",
-        y="count",
-        color="send",
-        size="size",
-    )
-with local_port_column[1]:
-    st.dataframe(
-        local_port_traffic.drop(["avg_date", "send"], axis=1).rename(columns={"size": "size (Mo)"}),
-        hide_index=True,
-    )
-
-st.text(
-    """Each dot represents a unique local IP address. Date shows the average timestamp for packets sent or received.
+        [analyse_start],
+    ).df()
+
+    with local_port_column[0]:
+        st.scatter_chart(
+            local_port_traffic,
+            x="avg_date",
+            y="count",
+            color="send",
+            size="size",
+        )
+    with local_port_column[1]:
+        st.dataframe(
+            local_port_traffic.drop(["avg_date", "send"], axis=1).rename(columns={"size": "size (Mo)"}),
+            hide_index=True,
+        )
+
+
+local_port()
+
+st.text("""Each dot represents a unique local IP address. Date shows the average timestamp for packets sent or received.
 Count indicates the total number of packets exchanged with the IP. Dot size reflects the packet size in megabytes (MB).
 
 Dot color blue reflects this local port received more packets than sent (send=0).
-Dot color white reflects this local port sent more packets than received (send=1)."""
-)
+Dot color white reflects this local port sent more packets than received (send=1).""")
 
 # Statistics
 
@@ -466,7 +467,12 @@ AND source_port IS NOT NULL
 ).fetchone()[0]
 st.sidebar.write("Listening port: ", listening_port)
 
+# Query cache
+st.sidebar.write("Query cache: ", query_cache_stats())
+
 # Running time
 
 end_timer = timer()
 st.sidebar.write("Running time: ", round(end_timer - start_timer, 4), " seconds")
+
+query_panel()
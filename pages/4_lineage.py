@@ -1,12 +1,21 @@
-import os
 import tempfile
+from collections import Counter
 from timeit import default_timer as timer
 
 import graphviz
 import streamlit as st
 from PIL import Image
 
-from pages import connection
+from pages import (
+    connection,
+    get_descendants,
+    query_cache_stats,
+    query_panel,
+    register_interval_index,
+    register_network_flow,
+    register_process_key,
+    select_session,
+)
 
 BACKGROUND_COLOR = "#282A36"
 PROCESS_COLOR = "#50FA7B"
@@ -18,13 +27,14 @@ FOREIGN_HOST_COLOR = "#FFFF85"
 MAX_DISTINCT_COMMAND_BY_CHILD = 5
 
 start_timer = timer()
-con = connection()
-
 st.set_page_config(
     page_title="Zoom",
     page_icon="📄",
     layout="wide",
 )
+session = select_session()
+con = connection(session)
+
 st.header("Dive in your command history", divider=True)
 
 # Process selection
@@ -119,53 +129,59 @@ class ForeignHost:
 # Database function
 
 
-def get_process_by_pid(pid):
-    process = con.execute(
+def get_ancestors(pid):
+    ancestors = con.execute(
         """
+    WITH RECURSIVE ancestor AS
+    (
+        SELECT
+            pid,
+            ppid,
+            started_at,
+        FROM gold_dim_process
+        WHERE pid = ?
+        UNION
+        SELECT
+            parent.pid,
+            parent.ppid,
+            parent.started_at,
+        FROM ancestor
+        INNER JOIN gold_dim_process parent ON parent.pid = ancestor.ppid AND parent.started_at <= ancestor.started_at
+    )
     SELECT
-        HASH(pro.pid, started_at) AS _id,
+        HASH(pro.pid, pro.started_at) AS _id,
         pro.pid,
         pro.ppid,
         usr.name AS user,
         pro.full_command,
         pro.started_at,
         pro.inserted_at,
-    FROM gold_dim_process pro
+    FROM ancestor
+    INNER JOIN gold_dim_process pro ON pro.pid = ancestor.pid AND pro.started_at = ancestor.started_at
     LEFT JOIN gold_file_user usr ON usr.uid = pro.uid
-    WHERE pro.pid = ?""",
-        [str(pid)],
-    ).fetchone()
-    return Process(process) if process is not None else None
+    ORDER BY pro.pid = ? DESC, pro.started_at DESC""",
+        [pid, pid],
+    ).df()
+    return [Process(row) for row in ancestors.itertuples(index=False, name=None)]
 
 
-def get_processes_by_ppid(ppid):
-    process_buffer = []
-    processes = con.execute(
-        """
-    SELECT
-        HASH(pro.pid, started_at) AS _id,
-        pro.pid,
-        pro.ppid,
-        usr.name AS user,
-        pro.full_command,
-        pro.started_at,
-        pro.inserted_at,
-    FROM gold_dim_process pro
-    LEFT JOIN gold_file_user usr ON usr.uid = pro.uid
-    WHERE pro.ppid = ?
-    ORDER BY pro.started_at ASC""",
-        [str(ppid)],
-    ).df()
-    for row in processes.itertuples(index=False, name=None):
-        process_buffer.append(Process(row))
-    return process_buffer
+def get_descendant_processes(root):
+    descendants = get_descendants(con, root.pid)
+    ids = set(descendants["_id"].astype(str))
+    children_by_parent = {}
+    for row in descendants.itertuples(index=False, name=None):
+        parent_id = str(row[3]) if str(row[3]) in ids else root.id
+        process = Process(row[:3] + row[4:])
+        children_by_parent.setdefault(parent_id, []).append(process)
+    return children_by_parent
 
 
-def get_open_files_by_process(pid):
-    files_buffer = []
+def get_open_files_by_process(process_ids):
+    files_buffer = {}
     files = con.execute(
         """
         SELECT
+            process_key,
             name,
             CASE
                 WHEN min_size <> max_size THEN TRUE
@@ -174,125 +190,107 @@ def get_open_files_by_process(pid):
         FROM
         (
             SELECT
+                fact.process_key::TEXT AS process_key,
                 dim.name AS name,
                 MIN(fact.size) AS min_size,
                 MAX(fact.size) AS max_size,
-            FROM gold_fact_file_reg fact
+            FROM gold_fact_file_reg_keyed fact
             LEFT JOIN gold_dim_file_reg dim ON fact.pid = dim.pid AND fact.fd = dim.fd AND fact.node = dim.node
-            WHERE fact.pid = ?
-            GROUP BY dim.name
+            WHERE fact.process_key IN (SELECT UNNEST(?))
+            GROUP BY fact.process_key, dim.name
         )
     """,
-        [str(pid)],
+        [process_ids],
     ).df()
     for row in files.itertuples(index=False, name=None):
-        files_buffer.append(File(row))
+        files_buffer.setdefault(row[0], []).append(File(row[1:]))
     return files_buffer
 
 
-def get_open_sockets_by_process(pid):
-    socket_buffer = []
+def get_open_sockets_by_process(process_ids):
+    socket_buffer = {}
     socket = con.execute(
         """
         SELECT
+            process_key,
             port,
             LIST(address)
         FROM
         (
             SELECT DISTINCT
+                soc.process_key::TEXT AS process_key,
                 COALESCE(soc.source_port::TEXT, '*') AS port,
                 host.host AS address
-            FROM gold_dim_network_socket soc
+            FROM gold_dim_network_socket_keyed soc
             INNER JOIN gold_dim_network_host host ON soc.source_address = host.address
-            WHERE soc.pid = ?
+            WHERE soc.process_key IN (SELECT UNNEST(?))
         )
-        GROUP BY port
+        GROUP BY process_key, port
     """,
-        [str(pid)],
+        [process_ids],
     ).df()
     for row in socket.itertuples(index=False, name=None):
-        socket_buffer.append(Socket(row))
+        socket_buffer.setdefault(row[0], []).append(Socket(row[1:]))
     return socket_buffer
 
 
-def get_foreign_host_by_port(port, pid):
-    foreign_host_buffer = []
+def get_foreign_host_by_port(process_ids):
+    foreign_host_buffer = {}
     foreign_host = con.execute(
         """
-WITH fact_ip_host AS
+WITH ip_traffic AS
 (
-    SELECT
-     fact.*,
-     host1.host AS source_host,
-     host2.host AS destination_host
-    FROM gold_fact_network_ip fact
-    LEFT JOIN gold_dim_network_host host1 ON fact.source_address = host1.address
-    LEFT JOIN gold_dim_network_host host2 ON fact.destination_address = host2.address
-),
-ip_traffic AS
-(
-       SELECT _id,
-              source_host AS address,
-              source_port    AS port,
+       SELECT source_port AS port,
               destination_host AS foreign_address,
-              created_at,
-              inserted_at
-       FROM   fact_ip_host
+              first_seen
+       FROM   network_flow
+       WHERE  source_local
        UNION ALL
-       SELECT _id,
-              destination_host AS address,
-              destination_port    AS port,
+       SELECT destination_port AS port,
               source_host AS foreign_address,
-              created_at,
-              inserted_at
-       FROM   fact_ip_host
-),
-interface_host AS
-(
-    SELECT host.host
-    FROM gold_dim_network_interface int
-    LEFT JOIN gold_dim_network_host host ON host.address = int.address
+              first_seen
+       FROM   network_flow
+       WHERE  destination_local
 )
 SELECT
+    soc.process_key::TEXT AS process_key,
+    ip_traffic.port::TEXT AS port,
     ip_traffic.foreign_address AS foreign_address,
 FROM
     ip_traffic
-INNER JOIN gold_dim_network_socket soc
+INNER JOIN gold_dim_network_socket_keyed_index soc
 ON         soc.source_port = ip_traffic.port
-AND        ip_traffic.created_at >= soc.started_at
-AND        ip_traffic.created_at <= soc.inserted_at
-WHERE      ip_traffic.address IN (SELECT host FROM interface_host)
-AND        ip_traffic.port = ?
-AND        soc.pid = ?
-GROUP BY   ip_traffic.foreign_address
+AND        DATE_TRUNC('minute', ip_traffic.first_seen) = soc.bucket
+AND        ip_traffic.first_seen >= soc.started_at
+AND        ip_traffic.first_seen <= soc.inserted_at
+WHERE      soc.process_key IN (SELECT UNNEST(?))
+GROUP BY   soc.process_key, ip_traffic.port, ip_traffic.foreign_address
     """,
-        [str(port), str(pid)],
+        [process_ids],
     ).df()
     for row in foreign_host.itertuples(index=False, name=None):
-        foreign_host_buffer.append(ForeignHost(row))
+        foreign_host_buffer.setdefault((row[0], row[1]), []).append(ForeignHost(row[2:]))
     return foreign_host_buffer
 
 
 # Graph function
 
 
-def add_ancestor(process, graph):
-    parent = get_process_by_pid(process.ppid)
-    if parent is not None:
-        parent.add_node(graph)
-        graph.edge(parent.id, process.id, color=EDGE_COLOR)
-        add_ancestor(parent, graph)
+def add_ancestor(process, ancestors, graph):
+    candidates = [p for p in ancestors if p.pid == process.ppid and p.started_at <= process.started_at]
+    if len(candidates) > 0:
+        parent = max(candidates, key=lambda p: p.started_at)
+        if parent.id != process.id:
+            parent.add_node(graph)
+            graph.edge(parent.id, process.id, color=EDGE_COLOR)
+            add_ancestor(parent, [p for p in ancestors if p.id != process.id], graph)
 
 
-def add_descendant(node_id, pid, graph, process_node_buffer):
+def add_descendant(node_id, pid, children, graph, process_node_buffer):
     last_process_id = ""
-    children = get_processes_by_ppid(pid)
     cut_commands = []
-    for child in children:
-        if (
-            len([p for p in process_node_buffer if p.full_command == child.full_command and p.ppid == child.ppid])
-            > MAX_DISTINCT_COMMAND_BY_CHILD
-        ):
+    for child in children.get(node_id, []):
+        if process_node_buffer[(child.full_command, child.ppid)] > MAX_DISTINCT_COMMAND_BY_CHILD:
             cut_commands.append(child.full_command)
         else:
             child.add_node(graph)
@@ -300,10 +298,10 @@ def add_descendant(node_id, pid, graph, process_node_buffer):
             if last_process_id != "":
                 graph.edge(last_process_id, child.id, color=BACKGROUND_COLOR)
             last_process_id = child.id
-            add_open_file(child.id, child.pid, graph)
-            add_open_socket(child.id, child.pid, graph)
-            add_descendant(child.id, child.pid, graph, process_node_buffer)
-        process_node_buffer.append(child)
+            add_open_file(child.id, graph)
+            add_open_socket(child.id, graph)
+            add_descendant(child.id, child.pid, children, graph, process_node_buffer)
+        process_node_buffer[(child.full_command, child.ppid)] += 1
     for command in set(cut_commands):
         occurence = len([c for c in cut_commands if c == command]) + MAX_DISTINCT_COMMAND_BY_CHILD
         st.sidebar.warning(
@@ -311,10 +309,9 @@ def add_descendant(node_id, pid, graph, process_node_buffer):
         )
 
 
-def add_open_file(node_id, pid, graph):
+def add_open_file(node_id, graph):
     last_file_id = ""
-    open_files = get_open_files_by_process(pid)
-    for file in open_files:
+    for file in open_files.get(node_id, []):
         if (not show_only_modified_files) or file.modified:
             file.add_node(graph)
             graph.edge(node_id, file.id, color=EDGE_COLOR)
@@ -323,32 +320,44 @@ def add_open_file(node_id, pid, graph):
             last_file_id = file.id
 
 
-def add_open_socket(node_id, pid, graph):
+def add_open_socket(node_id, graph):
     last_socket_id = ""
-    open_sockets = get_open_sockets_by_process(pid)
-    for socket in open_sockets:
+    for socket in open_sockets.get(node_id, []):
         socket.add_node(graph)
         graph.edge(node_id, socket.id, color=EDGE_COLOR)
         if last_socket_id != "":
             graph.edge(last_socket_id, socket.id, color=BACKGROUND_COLOR)
         last_socket_id = socket.id
-        for foreign_host_node in get_foreign_host_by_port(socket.port, pid):
-            if foreign_host_node.id not in graph.source:
+        for foreign_host_node in foreign_hosts.get((node_id, socket.port), []):
+            if foreign_host_node.id not in foreign_host_node_buffer:
                 foreign_host_node.add_node(graph)
                 graph.edge(socket.id, foreign_host_node.id, color=EDGE_COLOR, dir="both")
+                foreign_host_node_buffer.add(foreign_host_node.id)
 
 
-pid = int(os.environ["RSBV_PID"])
+pid = session.pid
 graph = graphviz.Digraph(format="png")
 graph.attr(bgcolor=BACKGROUND_COLOR)
 
-process_node_buffer: list[Process] = []
-process = get_process_by_pid(pid)
+ancestors = get_ancestors(pid)
+process = ancestors.pop(0)
+children = get_descendant_processes(process)
+process_ids = [int(process.id)] + [int(child.id) for siblings in children.values() for child in siblings]
+register_process_key(con, "gold_fact_file_reg")
+register_process_key(con, "gold_dim_network_socket")
+register_network_flow(con)
+register_interval_index(con, "gold_dim_network_socket_keyed")
+open_files = get_open_files_by_process(process_ids)
+open_sockets = get_open_sockets_by_process(process_ids)
+foreign_hosts = get_foreign_host_by_port(process_ids)
+
+process_node_buffer: Counter[tuple[str, int]] = Counter()
+foreign_host_node_buffer: set[str] = set()
 process.add_node(graph)
-add_open_file(process.id, process.pid, graph)
-add_open_socket(process.id, pid, graph)
-add_ancestor(process, graph)
-add_descendant(process.id, process.pid, graph, process_node_buffer)
+add_open_file(process.id, graph)
+add_open_socket(process.id, graph)
+add_ancestor(process, ancestors, graph)
+add_descendant(process.id, process.pid, children, graph, process_node_buffer)
 
 st.graphviz_chart(graph)
 save_and_open = st.button("Open in explorer 🔎")
@@ -364,4 +373,8 @@ st.sidebar.header("Statistics", divider=True)
 
 st.sidebar.write("Command PID: ", pid)
 
+st.sidebar.write("Query cache: ", query_cache_stats())
+
 st.sidebar.write("Running time: ", round(end_timer - start_timer, 4), " seconds")
+
+query_panel()
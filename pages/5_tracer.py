@@ -0,0 +1,260 @@
+import os
+from datetime import datetime, timezone
+from timeit import default_timer as timer
+
+import pandas as pd
+import streamlit as st
+
+from pages import (
+    TABLES,
+    LiveSeries,
+    connection,
+    live_fragment,
+    query_cache_stats,
+    query_panel,
+    register_launched_tree,
+    register_process_key,
+    register_process_tree,
+    select_session,
+    snapshot_cursor,
+)
+from rstracer import DEFAULT_SCHEDULE, GROWTH_QUERY, load_config
+
+# rstracer defaults, applied without a rstracer.toml
+SCHEDULED_LAYERS = ["silver", "gold"]
+DEFAULT_GOLD_RETENTION = 600
+
+
+# CPU and memory of the tracer and of the command by second, the ps rows of a process are merged by second
+RESOURCE_QUERY = """
+WITH process AS
+(
+    SELECT
+        TO_TIMESTAMP(FLOOR(EXTRACT('epoch' FROM fact.created_at))) AT TIME ZONE 'UTC' AS time,
+        CASE WHEN tracer._id IS NOT NULL THEN 'rstracer' ELSE 'command' END AS source,
+        MAX(fact.pcpu) AS pcpu,
+        MAX(fact.pmem) AS pmem,
+    FROM gold_fact_process_keyed fact
+    LEFT JOIN {tracer} tracer ON fact.process_key = tracer._id
+    LEFT JOIN {launched} launched ON fact.process_key = launched._id
+    WHERE (tracer._id IS NOT NULL OR launched._id IS NOT NULL)
+    AND {predicate}
+    GROUP BY time, source, fact.process_key
+)
+SELECT
+    time,
+    source,
+    SUM(pcpu) AS pcpu,
+    SUM(pmem) AS pmem,
+FROM process
+GROUP BY time, source
+ORDER BY time
+"""
+
+
+def register_tables(con):
+    launched = register_launched_tree(con, pid)
+    tracer = register_process_tree(con, session.tracer_pid)
+    register_process_key(con, "gold_fact_process")
+    return launched, tracer
+
+
+start_timer = timer()
+st.set_page_config(
+    page_title="Tracer",
+    page_icon="🩺",
+    layout="wide",
+)
+session = select_session()
+con = connection(session)
+pid = session.pid
+config = load_config()
+
+launched, tracer = register_tables(con)
+
+st.header("Tracer Overhead & Pipeline Health", divider=True)
+
+# Tracer against command resources
+
+
+@live_fragment(session)
+def resource_usage():
+    con = snapshot_cursor(session)
+    register_tables(con)
+    series = LiveSeries("tracer_resource", (session.id, session.path))
+    resource_by_source = series.append(
+        con.execute(
+            RESOURCE_QUERY.format(tracer=tracer, launched=launched, predicate=series.predicate("fact.created_at")),
+            series.parameters,
+        ).df()
+    )
+
+    st.subheader("CPU Usage of the Tracer", divider=True)
+    st.text("rstracer and its ps and lsof runs against the launched processes, summed by second")
+    st.line_chart(resource_by_source, x="time", y="pcpu", color="source", x_label="date", y_label="CPU usage")
+    st.subheader("Memory Usage of the Tracer", divider=True)
+    st.line_chart(resource_by_source, x="time", y="pmem", color="source", x_label="date", y_label="Memory usage (%)")
+
+
+resource_usage()
+
+# ETL durations
+
+
+@live_fragment(session)
+def etl_durations():
+    con = snapshot_cursor(session)
+
+    st.subheader("ETL Duration by Layer", divider=True)
+
+    chrono = con.execute("""
+SELECT
+    created_at AS time,
+    name AS layer,
+    duration,
+FROM gold_tech_chrono
+ORDER BY created_at
+""").df()
+    st.line_chart(chrono, x="time", y="duration", color="layer", x_label="date", y_label="duration (ms)")
+
+    # A layer busy most of its period delays the next runs, and the rows reach the pages later
+    layers = con.execute("""
+SELECT
+    name AS layer,
+    COUNT(*) AS runs,
+    MEDIAN(duration) AS p50,
+    QUANTILE_CONT(duration, 0.95) AS p95,
+    MAX(duration) AS max,
+FROM gold_tech_chrono
+GROUP BY name
+ORDER BY name
+""").df()
+    # Bronze is filled by the collectors, only the other layers are scheduled. The cached result is shared, the
+    # columns are added to a copy.
+    layers = layers.assign(
+        **{
+            "schedule (s)": [
+                config.get(("schedule", layer), DEFAULT_SCHEDULE) if layer in SCHEDULED_LAYERS else None
+                for layer in layers["layer"]
+            ],
+            "p95 busy (%)": lambda layers: (layers["p95"] / 1000 / layers["schedule (s)"] * 100).round(1),
+        }
+    )
+    st.text("Duration in milliseconds, against the schedule of the layer in rstracer.toml")
+    st.dataframe(layers, use_container_width=True, hide_index=True)
+
+
+etl_durations()
+
+# Table growth
+
+
+@live_fragment(session)
+def table_growth():
+    con = snapshot_cursor(session)
+
+    st.subheader("Table Row Count", divider=True)
+
+    table_count = con.execute("""
+SELECT
+    created_at AS time,
+    name AS "table",
+    count,
+FROM gold_tech_table_count
+ORDER BY created_at
+""").df()
+    st.line_chart(table_count, x="time", y="count", color="table", x_label="date", y_label="rows")
+
+    retention = config.get(("vacuum", "gold"), DEFAULT_GOLD_RETENTION)
+    growth = con.execute(
+        f"""
+SELECT
+    name AS "table",
+    rows,
+    rows_per_second,
+    rows_per_second * ? AS rows_at_retention,
+FROM ({GROWTH_QUERY.format(table_count="gold_tech_table_count")})
+ORDER BY rows_at_retention DESC
+""",
+        [retention],
+    ).df()
+    st.text(f"Rows kept by rstracer once the gold vacuum drops rows older than {retention} seconds")
+    st.dataframe(growth.round(1), use_container_width=True, hide_index=True)
+
+
+table_growth()
+
+# Export freshness
+
+
+def export_age(path, now):
+    # Tables are missing until rstracer first exports them, and after the export directory is cleaned
+    try:
+        return now - os.stat(path).st_mtime
+    except FileNotFoundError:
+        return None
+
+
+@live_fragment(session)
+def export_freshness():
+    con = snapshot_cursor(session)
+
+    st.subheader("Export Freshness", divider=True)
+
+    # Delay between the collection of a row and its insertion in the gold layer
+    delay = con.execute("""
+WITH fact AS
+(
+    SELECT 'gold_fact_process' AS name, created_at, inserted_at FROM gold_fact_process
+    UNION ALL
+    SELECT 'gold_fact_file_reg' AS name, created_at, inserted_at FROM gold_fact_file_reg
+    UNION ALL
+    SELECT 'gold_fact_network_packet' AS name, created_at, inserted_at FROM gold_fact_network_packet
+)
+SELECT
+    TO_TIMESTAMP(FLOOR(EXTRACT('epoch' FROM created_at) / 10) * 10) AT TIME ZONE 'UTC' AS time,
+    name AS "table",
+    QUANTILE_CONT(EPOCH(inserted_at - created_at), 0.95) AS delay,
+FROM fact
+GROUP BY ALL
+ORDER BY time
+""").df()
+    st.text("Seconds from the collection of a row to its gold insertion, 95th percentile by 10 seconds")
+    st.line_chart(delay, x="time", y="delay", color="table", x_label="date", y_label="delay (s)")
+
+    if session.live():
+        now = datetime.now(timezone.utc).timestamp()
+        ages = pd.DataFrame(
+            [(table, export_age(f"{session.path}/{table}.parquet", now)) for table in TABLES],
+            columns=["table", "age"],
+        )
+        st.text("Seconds since the last export of each table")
+        st.bar_chart(ages.dropna(), x="table", y="age", x_label="table", y_label="age (s)")
+        missing = ages.loc[ages["age"].isna(), "table"].tolist()
+        if missing:
+            st.text(f"Not exported yet: {', '.join(missing)}")
+
+
+export_freshness()
+
+# Statistics
+
+st.sidebar.header("Statistics", divider=True)
+
+st.sidebar.write("Tracer PID: ", session.tracer_pid)
+
+resource_query = RESOURCE_QUERY.format(tracer=tracer, launched=launched, predicate="TRUE")
+cpu_by_source = con.execute(f"SELECT source, AVG(pcpu) AS pcpu FROM ({resource_query}) GROUP BY source").df()
+cpu_by_source = dict(zip(cpu_by_source["source"], cpu_by_source["pcpu"]))
+
+st.sidebar.write("Tracer mean CPU: ", round(cpu_by_source.get("rstracer", 0.0), 2))
+st.sidebar.write("Command mean CPU: ", round(cpu_by_source.get("command", 0.0), 2))
+
+# Query cache
+st.sidebar.write("Query cache: ", query_cache_stats())
+
+# Running time
+end_timer = timer()
+st.sidebar.write("Running time: ", round(end_timer - start_timer, 4), " seconds")
+
+query_panel()
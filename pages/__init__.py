@@ -1,6 +1,39 @@
+import glob
+import json
+import os
+import sys
+import threading
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from time import monotonic
+from timeit import default_timer as timer
+
 import duckdb
+import pandas as pd
+import psutil
+import streamlit as st
+from streamlit.runtime.scriptrunner import get_script_run_ctx
+
+from rstracer import DEFAULT_SCHEDULE, load_config
 
 OUTPUT_PATH = ".output/rstracer"
+SESSION_PATH = ".output/session"
+SAMPLER_PATH = ".output/sampler"
+
+# Snapshots kept loaded at once, the live export and the stored sessions being viewed
+SNAPSHOT_ENTRIES = 4
+
+# Seconds between two checks of the live export
+LIVE_POLL_INTERVAL = 1
+
+# Seconds between two refreshes of the charts of a running session
+LIVE_REFRESH = int(os.environ.get("RSBV_LIVE_REFRESH", "5"))
+
+# "lazy" exposes the export as parquet views, "eager" copies every table in memory
+LOAD_MODE = os.environ.get("RSBV_LOAD_MODE", "lazy")
+
+# Memory budget of the query result cache shared by every page and session, in Mo
+QUERY_CACHE_SIZE = int(os.environ.get("RSBV_QUERY_CACHE_SIZE", "256")) * 1024 * 1024
 
 TABLES = [
     "gold_dim_file_reg",
@@ -22,52 +55,833 @@ TABLES = [
     "gold_tech_table_count",
 ]
 
+# Gold tables the /proc sampler exports for the analysed processes, merged with the rstracer rows
+SAMPLER_TABLES = [
+    "gold_dim_file_reg",
+    "gold_dim_process",
+    "gold_fact_file_reg",
+    "gold_fact_process",
+]
+
+# Small dimensions joined by almost every page query, copying them once is cheaper than re-reading the parquet
+MATERIALIZED_TABLES = [
+    "gold_dim_process",
+    "gold_file_user",
+    "gold_dim_network_host",
+    "gold_dim_network_interface",
+    "gold_dim_network_foreign_ip",
+]
+
+# Columns computed while loading a table, the process key identifies a process incarnation across pid reuse
+DERIVED_COLUMNS = {
+    "gold_dim_process": ", HASH(pid, started_at) AS process_key",
+}
+
+# Relation of the {rows} of each table and timestamp its process key is resolved at, packets carry the time of
+# process_network rows
+PROCESS_KEY_SOURCES = {
+    "gold_fact_process": ("{rows}", "created_at"),
+    "gold_fact_file_reg": ("{rows}", "created_at"),
+    "gold_dim_network_socket": ("{rows}", "started_at"),
+    "gold_fact_process_network": (
+        """(
+    SELECT
+        net_pro.*,
+        packet.created_at AS packet_created_at,
+    FROM {rows} net_pro
+    INNER JOIN gold_fact_network_packet packet ON packet._id = net_pro.packet_id
+)""",
+        "packet_created_at",
+    ),
+}
+
+# Append-only tables and the key of rows exported several times
+FACT_KEYS = {
+    "gold_fact_file_reg": ["_id"],
+    "gold_fact_network_ip": ["_id"],
+    "gold_fact_network_packet": ["_id"],
+    "gold_fact_process": ["_id"],
+    "gold_fact_process_network": ["packet_id", "pid"],
+}
+
+# Other tables are small and merged whole, keeping the last exported row of each key, or every distinct row
+DIMENSION_KEYS = {
+    "gold_dim_file_reg": ["pid", "fd", "node"],
+    "gold_dim_network_host": ["address"],
+    "gold_dim_network_open_port": ["port", "started_at"],
+    "gold_dim_network_socket": ["pid", "source_address", "source_port", "started_at"],
+    "gold_dim_process": ["pid", "started_at"],
+}
+
+# Tables written by a contained analysis next to the archived gold tables, empty for the other sessions
+CGROUP_TABLES = {
+    "cgroup_stat": "created_at TIMESTAMP, cpu_usage_usec BIGINT, cpu_user_usec BIGINT, cpu_system_usec BIGINT, "
+    "memory_current BIGINT, io_read_bytes BIGINT, io_write_bytes BIGINT, io_read_count BIGINT, "
+    "io_write_count BIGINT, process_count BIGINT",
+    "cgroup_process": "pid BIGINT, first_seen TIMESTAMP, last_seen TIMESTAMP",
+}
+
+# Exported rows not stored yet, stored keys are only read at or after the oldest exported row
+NEW_ROWS_QUERY = """
+SELECT export.*
+FROM {export} export
+ANTI JOIN (
+    SELECT {keys}
+    FROM {stored}
+    WHERE created_at >= (SELECT MIN(created_at) FROM {export})
+) stored ON {condition}
+"""
+
+# Exported rows of a dimension whose key is not stored yet
+NEW_KEYS_QUERY = """
+SELECT export.*
+FROM {export} export
+ANTI JOIN {stored} stored ON {condition}
+"""
+
+MERGE_ROWS_QUERY = """
+SELECT * EXCLUDE (generation)
+FROM (
+    SELECT *, 1 AS generation FROM {export}
+    UNION ALL BY NAME
+    SELECT *, 0 AS generation FROM {stored}
+)
+QUALIFY ROW_NUMBER() OVER (PARTITION BY {keys} ORDER BY generation DESC) = 1
+"""
+
+MERGE_DISTINCT_ROWS_QUERY = """
+SELECT * FROM {export}
+UNION BY NAME
+SELECT * FROM {stored}
+"""
+
+# Descendants of a root pid, resolved once per snapshot and keyed on (pid, started_at) to survive pid reuse
+PROCESS_TREE_QUERY = """
+WITH RECURSIVE tree AS
+(
+    SELECT
+        pid,
+        ppid,
+        started_at,
+        NULL::TIMESTAMP AS parent_started_at,
+    FROM gold_dim_process
+    WHERE ppid = ?
+    UNION
+    SELECT
+        child.pid,
+        child.ppid,
+        child.started_at,
+        tree.started_at AS parent_started_at,
+    FROM tree
+    INNER JOIN gold_dim_process child ON child.ppid = tree.pid AND child.started_at >= tree.started_at
+)
+SELECT
+    HASH(pid, started_at) AS _id,
+    pid,
+    ppid,
+    HASH(ppid, parent_started_at) AS parent_id,
+    started_at,
+FROM tree
+QUALIFY ROW_NUMBER() OVER (PARTITION BY pid, started_at ORDER BY parent_started_at DESC NULLS LAST) = 1
+"""
+
+# New processes joining a process tree, started by its root or by a process of the tree, new or not
+PROCESS_TREE_APPEND_QUERY = """
+WITH RECURSIVE tree AS
+(
+    SELECT
+        child.pid,
+        child.ppid,
+        child.started_at,
+        parent.started_at AS parent_started_at,
+    FROM new_gold_dim_process child
+    LEFT JOIN {tree} parent ON parent.pid = child.ppid AND child.started_at >= parent.started_at
+    WHERE child.ppid = ? OR parent.pid IS NOT NULL
+    UNION
+    SELECT
+        child.pid,
+        child.ppid,
+        child.started_at,
+        tree.started_at AS parent_started_at,
+    FROM tree
+    INNER JOIN new_gold_dim_process child ON child.ppid = tree.pid AND child.started_at >= tree.started_at
+)
+SELECT
+    HASH(pid, started_at) AS _id,
+    pid,
+    ppid,
+    HASH(ppid, parent_started_at) AS parent_id,
+    started_at,
+FROM tree
+QUALIFY ROW_NUMBER() OVER (PARTITION BY pid, started_at ORDER BY parent_started_at DESC NULLS LAST) = 1
+"""
+
+# Process trees hold the keys of their processes, the attributes are read from the last exported dimension
+DESCENDANTS_QUERY = """
+SELECT
+    tree._id,
+    tree.pid,
+    tree.ppid,
+    tree.parent_id,
+    usr.name AS user,
+    pro.full_command,
+    pro.started_at,
+    pro.inserted_at,
+FROM {tree} tree
+INNER JOIN gold_dim_process pro ON pro.process_key = tree._id
+LEFT JOIN gold_file_user usr ON usr.uid = pro.uid
+ORDER BY pro.started_at
+"""
+
+# Members of the command cgroup, keyed as the process tree. The cgroup holds processes reparented out of the
+# launched tree, a member is the process started last before the member was seen, as a pid may be reused.
+CGROUP_TREE_QUERY = """
+SELECT DISTINCT ON (pro.process_key)
+    pro.process_key AS _id,
+    pro.pid,
+    pro.ppid,
+    HASH(pro.ppid, parent.started_at) AS parent_id,
+    pro.started_at,
+FROM cgroup_process member
+ASOF INNER JOIN gold_dim_process pro ON pro.pid = member.pid AND member.last_seen >= pro.started_at
+ASOF LEFT JOIN gold_dim_process parent ON parent.pid = pro.ppid AND pro.started_at >= parent.started_at
+WHERE member.pid != ?
+"""
+
+LAUNCHED_TREE_QUERY = """
+SELECT * FROM {tree}
+UNION ALL BY NAME
+SELECT * FROM ({cgroup}) cgroup
+WHERE cgroup._id NOT IN (SELECT _id FROM {tree})
+"""
+
+# Directional conversations per second, the local IP, foreign IP, local port and lineage views read it
+# instead of the packet facts. Sockets and open ports are sampled every second by lsof, so a flow is attributed
+# to them from its first packet of the second. Flows of a live snapshot are recomputed from the second of the
+# first new packet or attribution. Packets of a socket shared by several processes are attributed to each of them,
+# the flow lists their pids so its packets are still counted once.
+NETWORK_FLOW_QUERY = """
+WITH interface_host AS
+(
+    SELECT DISTINCT host.host
+    FROM gold_dim_network_interface int
+    INNER JOIN gold_dim_network_host host ON host.address = int.address
+),
+process_network AS
+(
+    SELECT
+        packet_id,
+        LIST(pid ORDER BY pid) AS pids,
+        LIST(process_key ORDER BY pid) AS process_keys,
+    FROM gold_fact_process_network_keyed
+    WHERE {attribution_window}
+    GROUP BY packet_id
+)
+SELECT
+    DATE_TRUNC('second', ip.created_at) AS second,
+    ip.source_address,
+    host1.host AS source_host,
+    ip.source_port,
+    COALESCE(host1.host IN (SELECT host FROM interface_host), FALSE) AS source_local,
+    ip.destination_address,
+    host2.host AS destination_host,
+    ip.destination_port,
+    COALESCE(host2.host IN (SELECT host FROM interface_host), FALSE) AS destination_local,
+    packet.transport,
+    net_pro.pids,
+    net_pro.process_keys,
+    MIN(ip.created_at) AS first_seen,
+    MAX(ip.created_at) AS last_seen,
+    COUNT(*) AS packet_count,
+    SUM(packet.length)::BIGINT AS byte_count,
+    SUM(EPOCH(ip.created_at)) AS epoch_sum,
+FROM gold_fact_network_ip ip
+LEFT JOIN gold_dim_network_host host1 ON ip.source_address = host1.address
+LEFT JOIN gold_dim_network_host host2 ON ip.destination_address = host2.address
+LEFT JOIN gold_fact_network_packet packet ON packet._id = ip._id
+LEFT JOIN process_network net_pro ON net_pro.packet_id = ip._id
+WHERE {packet_window}
+GROUP BY ALL
+"""
+
+# Every interval repeated in each minute it overlaps, attributing a timestamp to an interval becomes an equi-join
+# on (key, minute) followed by the range check instead of a range join degrading with the intervals per key. Only
+# packets are attributed, intervals are clamped to the packets of the snapshot: a port listening for days adds the
+# minutes of the snapshot, not of its age.
+INTERVAL_INDEX_QUERY = """
+WITH packet_window AS
+(
+    SELECT *
+    FROM (SELECT MIN(created_at) AS started_at, MAX(created_at) AS ended_at FROM gold_fact_network_ip)
+    WHERE started_at IS NOT NULL
+)
+SELECT
+    intervals.*,
+    bucket,
+FROM {table} intervals, packet_window,
+UNNEST(
+    GENERATE_SERIES(
+        DATE_TRUNC('minute', GREATEST(intervals.started_at, packet_window.started_at)),
+        DATE_TRUNC('minute', LEAST(intervals.inserted_at, packet_window.ended_at)),
+        INTERVAL 1 MINUTE
+    )
+) t(bucket)
+"""
+
+# Resolves each row to the process incarnation alive at its timestamp, the latest started_at before it
+PROCESS_KEY_QUERY = """
+SELECT
+    fact.*,
+    CASE WHEN dim.pid IS NOT NULL THEN dim.process_key END AS process_key,
+FROM {relation} fact
+ASOF LEFT JOIN gold_dim_process dim ON fact.pid = dim.pid AND fact.{timestamp} >= dim.started_at
+"""
 
-def connection():
+DERIVED_TABLE_LOCK = threading.Lock()
+
+SHOW_LAUNCHED = "launched"
+SHOW_NEW = "new"
+SHOW_ALL = "all"
+
+
+class Session:
+    # One analysis run, its window and processes, read from the live export until its snapshot is stored
+
+    def __init__(self, id, command, pid, tracer_pid, started_at, ended_at=None, path=OUTPUT_PATH):
+        self.id = id
+        self.command = command
+        self.pid = pid
+        self.tracer_pid = tracer_pid
+        # Naive UTC, as the gold timestamps
+        self.started_at = started_at
+        self.ended_at = ended_at
+        self.path = path
+
+    def __str__(self):
+        if self.stale():
+            state = "not stored"
+        else:
+            state = "live" if self.live() else self.ended_at.strftime("%H:%M:%S")
+        return f"{self.started_at:%Y/%m/%d %H:%M:%S} - {state} - {self.command}"
+
+    @property
+    def directory(self):
+        return f"{SESSION_PATH}/{self.id}"
+
+    def live(self):
+        return self.path == OUTPUT_PATH
+
+    def stale(self):
+        # A live session whose teardown started or whose command or rstracer is gone is not stored, the live export
+        # may hold another run
+        if not self.live():
+            return False
+        pids = [self.pid, self.tracer_pid]
+        return self.ended_at is not None or not all(pid is not None and psutil.pid_exists(pid) for pid in pids)
+
+    def save(self):
+        os.makedirs(self.directory, exist_ok=True)
+        with open(f"{self.directory}/session.json", "w") as session_file:
+            json.dump(vars(self), session_file, indent=2, default=datetime.isoformat)
+
+    def end(self, ended_at):
+        # Persisted when the teardown starts, a session never closed after it stays stale
+        self.ended_at = ended_at
+        self.save()
+
+    def close(self, ended_at, path):
+        self.path = path
+        self.end(ended_at)
+
+    @classmethod
+    def load(cls, directory):
+        with open(f"{directory}/session.json") as session_file:
+            session = json.load(session_file)
+        for field in ["started_at", "ended_at"]:
+            if session[field] is not None:
+                session[field] = datetime.fromisoformat(session[field])
+        return cls(**session)
+
+
+def list_sessions():
+    if not os.path.isdir(SESSION_PATH):
+        return []
+    sessions = [
+        Session.load(f"{SESSION_PATH}/{name}")
+        for name in os.listdir(SESSION_PATH)
+        if os.path.exists(f"{SESSION_PATH}/{name}/session.json")
+    ]
+    return sorted(sessions, key=lambda session: session.started_at, reverse=True)
+
+
+def select_session():
+    # Widget state is dropped when the page changes, the selected id is kept aside for the other pages
+    sessions = list_sessions()
+    if not sessions:
+        st.info("No analysis yet, launch one from the home page.")
+        st.stop()
+    ids = [session.id for session in sessions]
+    selected = st.session_state.get("session_id")
+    # Stale sessions stay listed with their label, the default is the last session still live or stored
+    fresh = [index for index, session in enumerate(sessions) if not session.stale()]
+    index = ids.index(selected) if selected in ids else (fresh or [0])[0]
+    session = st.sidebar.selectbox("Analysis", sessions, index=index, format_func=str)
+    st.session_state["session_id"] = session.id
+    return session
+
+
+def new_rows_query(table, export, stored):
+    keys = FACT_KEYS[table] if table in FACT_KEYS else DIMENSION_KEYS[table]
+    condition = " AND ".join(f"export.{key} = stored.{key}" for key in keys)
+    if table not in FACT_KEYS:
+        return NEW_KEYS_QUERY.format(export=export, stored=stored, condition=condition)
+    return NEW_ROWS_QUERY.format(export=export, stored=stored, keys=", ".join(keys), condition=condition)
+
+
+def merge_rows_query(table, export, stored):
+    if table not in DIMENSION_KEYS:
+        return MERGE_DISTINCT_ROWS_QUERY.format(export=export, stored=stored)
+    return MERGE_ROWS_QUERY.format(export=export, stored=stored, keys=", ".join(DIMENSION_KEYS[table]))
+
+
+def table_files(path, table):
+    # A live export holds one file per table, a session archive a directory of time buckets
+    if os.path.isdir(f"{path}/{table}"):
+        return sorted(glob.glob(f"{path}/{table}/*/*.parquet") + glob.glob(f"{path}/{table}/*.parquet"))
+    return [f"{path}/{table}.parquet"]
+
+
+def snapshot_version(path=OUTPUT_PATH, tables=TABLES):
+    version = []
+    for table in tables:
+        for file in table_files(path, table):
+            stat = os.stat(file)
+            version.append((file, stat.st_mtime_ns, stat.st_size))
+    return (path, tuple(version))
+
+
+@st.cache_resource(max_entries=SNAPSHOT_ENTRIES, show_spinner="Loading rstracer export...")
+def load_snapshot(path, version):
     con = duckdb.connect(database=":memory:")
     for table in TABLES:
-        con.execute(f"CREATE TABLE {table} AS SELECT * FROM '{OUTPUT_PATH}/{table}.parquet';")
+        relation = "TABLE" if LOAD_MODE == "eager" or table in MATERIALIZED_TABLES else "VIEW"
+        columns = DERIVED_COLUMNS.get(table, "")
+        files = table_files(path, table)
+        con.execute(
+            f"CREATE {relation} {table} AS SELECT *{columns} FROM read_parquet({files}, hive_partitioning = false);"
+        )
+    create_cgroup_tables(con, path)
     return con
 
 
-class Process:
-
-    def __init__(self, process_tuple):
-        self.id = str(process_tuple[0])
-        self.pid = process_tuple[1]
-        self.ppid = process_tuple[2]
-        self.user = process_tuple[3]
-        self.full_command = process_tuple[4]
-        self.started_at = process_tuple[5]
-
-
-def get_descendants(con, pid):
-    process_buffer = []
-
-    def get_processes_by_ppid(ppids):  # todo
-        process_buffer = []
-        processes = con.execute(
-            """
-        SELECT
-            HASH(pro.pid, started_at) AS _id,
-            pro.pid,
-            pro.ppid,
-            usr.name AS user,
-            pro.full_command,
-            pro.started_at,
-            pro.inserted_at,
-        FROM gold_dim_process pro
-        LEFT JOIN gold_file_user usr ON usr.uid = pro.uid
-        WHERE pro.ppid IN ?""",
-            [ppids],
-        ).df()
-        for row in processes.itertuples(index=False, name=None):
-            process_buffer.append(Process(row))
-        return process_buffer
-
-    children = get_processes_by_ppid([pid])
-    while len(children) > 0:
-        process_buffer += children
-        children = get_processes_by_ppid([child.pid for child in children])
-
-    return process_buffer
+def create_cgroup_tables(con, path):
+    for table, schema in CGROUP_TABLES.items():
+        if os.path.exists(f"{path}/{table}/data.parquet"):
+            con.execute(f"CREATE TABLE {table} AS SELECT * FROM '{path}/{table}/data.parquet'")
+        else:
+            con.execute(f"CREATE TABLE {table} ({schema})")
+
+
+class LiveSnapshot:
+    # Database of a running session, each export only appends its new rows and bumps the version. Derived tables
+    # are maintained in the same transaction from the new rows, kept as new_<table> temporary tables, so cursors
+    # never see base and derived tables of different exports.
+
+    def __init__(self, path):
+        self.path = path
+        self.con = duckdb.connect(database=":memory:")
+        self.version = 0
+        self.export_version = None
+        self.polled_at = None
+        self.derived = {}
+        self.lock = threading.Lock()
+
+    def refresh(self):
+        with self.lock:
+            if self.polled_at is None or monotonic() - self.polled_at >= LIVE_POLL_INTERVAL:
+                self.polled_at = monotonic()
+                # The sampler export of the analysis, if any, is merged after the rstracer one
+                sampled = [table for table in SAMPLER_TABLES if os.path.exists(f"{SAMPLER_PATH}/{table}.parquet")]
+                try:
+                    export_version = (snapshot_version(self.path), snapshot_version(SAMPLER_PATH, sampled))
+                except FileNotFoundError:
+                    # A table missing from the export is loaded once it is exported
+                    return self.version
+                if export_version != self.export_version and self.load(sampled):
+                    self.export_version = export_version
+                    self.version += 1
+            return self.version
+
+    def load(self, sampled):
+        # An export rewritten while it is read is loaded at the next poll
+        self.con.begin()
+        try:
+            for table in TABLES:
+                if self.version == 0:
+                    self.con.execute(f"CREATE TABLE {table} AS SELECT * FROM {self.export(self.path, table)}")
+                if table in FACT_KEYS or table in DIMENSION_KEYS:
+                    self.con.execute(f"CREATE OR REPLACE TEMP TABLE new_{table} AS SELECT * FROM {table} LIMIT 0")
+                if self.version > 0:
+                    self.merge(table, self.export(self.path, table))
+            for table in sampled:
+                self.merge(table, self.export(SAMPLER_PATH, table))
+            if self.version == 0:
+                create_cgroup_tables(self.con, self.path)
+            # In creation order, a derived table is created after the ones it reads
+            for table, (query, parameters, append) in self.derived.items():
+                if append is None:
+                    self.con.execute(f"CREATE OR REPLACE TABLE {table} AS {query}", parameters)
+                else:
+                    append(self.con)
+        except duckdb.Error:
+            self.con.rollback()
+            return False
+        self.con.commit()
+        return True
+
+    def export(self, path, table):
+        return f"(SELECT *{DERIVED_COLUMNS.get(table, '')} FROM '{path}/{table}.parquet')"
+
+    def merge(self, table, export):
+        if table in FACT_KEYS or table in DIMENSION_KEYS:
+            self.con.execute(f"CREATE OR REPLACE TEMP TABLE merged AS {new_rows_query(table, export, table)}")
+            self.con.execute(f"INSERT INTO new_{table} BY NAME SELECT * FROM merged")
+        if table in FACT_KEYS:
+            self.con.execute(f"INSERT INTO {table} BY NAME SELECT * FROM merged")
+        else:
+            self.con.execute(f"CREATE OR REPLACE TABLE {table} AS {merge_rows_query(table, export, table)}")
+
+    def derive(self, table, query, parameters, append):
+        # Tables derived from dimensions, merged whole, have no append and are rebuilt at each export
+        with self.lock:
+            if table not in self.derived:
+                self.con.execute(f"CREATE TABLE {table} AS {query}", parameters)
+                self.derived[table] = (query, parameters, append)
+
+    def cursor(self):
+        # The version is read with the cursor, a refresh in between would key results of the next export with it
+        with self.lock:
+            return self.version, self.con.cursor()
+
+
+@st.cache_resource(max_entries=SNAPSHOT_ENTRIES, show_spinner="Loading rstracer export...")
+def live_snapshot(session_id, path):
+    return LiveSnapshot(path)
+
+
+class QueryCache:
+    # Results are keyed by snapshot version, so sessions share the cache and results of outdated snapshots
+    # are the least recently used ones, evicted once the memory budget is exceeded
+
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self.entries = OrderedDict()
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    def get(self, version, key, compute):
+        key = (version, key)
+        with self.lock:
+            if key in self.entries:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return self.entries[key][0]
+            self.misses += 1
+        result = compute()
+        size = result_size(result)
+        with self.lock:
+            if key not in self.entries and size <= self.max_size:
+                self.entries[key] = (result, size)
+                self.size += size
+                while self.size > self.max_size:
+                    _, (_, evicted_size) = self.entries.popitem(last=False)
+                    self.size -= evicted_size
+        return result
+
+
+def result_size(result):
+    if hasattr(result, "memory_usage"):
+        return int(result.memory_usage(deep=True).sum())
+    return sys.getsizeof(result) + sum(sys.getsizeof(value) for value in result or ())
+
+
+@st.cache_resource
+def query_cache():
+    return QueryCache(QUERY_CACHE_SIZE)
+
+
+def query_cache_stats():
+    cache = query_cache()
+    return f"{cache.hits} hits, {cache.misses} misses, {round(cache.size / (1024 * 1024), 3)} Mo"
+
+
+class CachedResult:
+    # Cached results are shared by every page and session, callers must not modify them
+
+    def __init__(self, con, query, parameters):
+        self.con = con
+        self.query = query
+        self.parameters = parameters
+
+    def fetch(self, method):
+        key = (method, self.query, repr(self.parameters))
+        log = {"query": self.query, "parameters": repr(self.parameters), "method": method, "cached": True}
+        start = timer()
+        result = query_cache().get(self.con.version, key, lambda: self.compute(method, log))
+        log["seconds"] = timer() - start
+        log["rows"] = len(result) if hasattr(result, "memory_usage") else int(result is not None)
+        if st.session_state.get("query_profile") and not fragment_rerun():
+            log["profile"] = self.con.cursor.execute(f"EXPLAIN ANALYZE {self.query}", self.parameters).fetchone()[1]
+        query_log().append(log)
+        return result
+
+    def compute(self, method, log):
+        start = timer()
+        relation = self.con.cursor.execute(self.query, self.parameters)
+        log["execute_seconds"] = timer() - start
+        start = timer()
+        result = getattr(relation, method)()
+        log["fetch_seconds"] = timer() - start
+        log["cached"] = False
+        return result
+
+    def df(self):
+        return self.fetch("df")
+
+    def fetchone(self):
+        return self.fetch("fetchone")
+
+
+class SnapshotCursor:
+
+    def __init__(self, cursor, version, live=None):
+        self.cursor = cursor
+        self.version = version
+        self.live = live
+
+    def execute(self, query, parameters=None):
+        return CachedResult(self, query, parameters)
+
+
+def query_log():
+    # Queries run by the last page of the session, in execution order
+    return st.session_state.setdefault("query_log", [])
+
+
+def fragment_rerun():
+    # Fragments refreshing on their own run without the rest of the page, its query panel is not updated
+    ctx = get_script_run_ctx()
+    return ctx is not None and bool(ctx.fragment_ids_this_run)
+
+
+def query_panel():
+    with st.sidebar.expander("Queries"):
+        st.toggle("Profile with EXPLAIN ANALYZE", key="query_profile")
+        log = query_log()
+        st.dataframe(
+            [
+                {
+                    "seconds": round(entry["seconds"], 4),
+                    ".df() seconds": round(entry.get("fetch_seconds", 0), 4),
+                    "rows": entry["rows"],
+                    "cached": entry["cached"],
+                    "query": " ".join(entry["query"].split()),
+                }
+                for entry in log
+            ],
+            hide_index=True,
+        )
+        st.download_button("Download json", json.dumps(log, indent=2), file_name="queries.json")
+        for number, entry in enumerate(log):
+            if "profile" in entry:
+                st.caption(f"Query {number}")
+                st.code(entry["profile"], language=None)
+
+
+def connection(session):
+    st.session_state["query_log"] = []
+    return snapshot_cursor(session)
+
+
+def snapshot_cursor(session):
+    # The snapshot is shared by every page and viewer of the session, each caller works on its own cursor. The
+    # query log only keeps the last run of a refreshing fragment.
+    if fragment_rerun():
+        st.session_state["query_log"] = []
+    if session.live():
+        snapshot = live_snapshot(session.id, session.path)
+        snapshot.refresh()
+        version, cursor = snapshot.cursor()
+        return SnapshotCursor(cursor, (session.id, version), snapshot)
+    version = snapshot_version(session.path)
+    return SnapshotCursor(load_snapshot(session.path, version).cursor(), version)
+
+
+def derive_table(con, table, query, parameters=None, append=None):
+    # Derived tables live in the shared snapshot, the first page asking for one builds it for every other. A live
+    # snapshot then runs append at each export to add the rows derived from the new ones.
+    start = timer()
+    if con.live is not None:
+        con.live.derive(table, query, parameters, append)
+    else:
+        with DERIVED_TABLE_LOCK:
+            con.cursor.execute(f"CREATE TABLE IF NOT EXISTS {table} AS {query}", parameters)
+    seconds = timer() - start
+    query_log().append(
+        {
+            "query": f"CREATE TABLE IF NOT EXISTS {table}",
+            "parameters": repr(parameters),
+            "method": "derive",
+            "cached": False,
+            "seconds": seconds,
+            "execute_seconds": seconds,
+            "fetch_seconds": 0.0,
+            "rows": 0,
+        }
+    )
+    return table
+
+
+def register_process_tree(con, pid):
+    # Pages filter on the tree with semi and anti joins instead of binding its pids as IN-lists
+    table = f"process_tree_{int(pid)}"
+
+    def append(live):
+        query = PROCESS_TREE_APPEND_QUERY.format(tree=table)
+        live.execute(f"CREATE OR REPLACE TEMP TABLE new_{table} AS {query}", [pid])
+        live.execute(f"INSERT INTO {table} SELECT * FROM new_{table}")
+
+    return derive_table(con, table, PROCESS_TREE_QUERY, [pid], append)
+
+
+def register_launched_tree(con, pid):
+    # Processes of the command: its tree, completed by the members of its cgroup when it was contained. The cgroup
+    # is only known once the session is stored, a live launched tree grows with the process tree.
+    tree = register_process_tree(con, pid)
+    table = f"launched_tree_{int(pid)}"
+
+    def append(live):
+        live.execute(f"INSERT INTO {table} SELECT * FROM new_{tree} WHERE _id NOT IN (SELECT _id FROM {table})")
+
+    query = LAUNCHED_TREE_QUERY.format(tree=tree, cgroup=CGROUP_TREE_QUERY)
+    return derive_table(con, table, query, [pid], append)
+
+
+def get_descendants(con, pid, cgroup=False):
+    table = register_launched_tree(con, pid) if cgroup else register_process_tree(con, pid)
+    return con.execute(DESCENDANTS_QUERY.format(tree=table)).df()
+
+
+def register_process_key(con, table):
+    relation, timestamp = PROCESS_KEY_SOURCES[table]
+    keyed = f"{table}_keyed"
+
+    def append(live):
+        query = PROCESS_KEY_QUERY.format(relation=relation.format(rows=f"new_{table}"), timestamp=timestamp)
+        parameters = []
+        # Rows of a pid loaded before its new incarnation were resolved to the previous one
+        started_at = live.execute("SELECT MIN(started_at) FROM new_gold_dim_process").fetchone()[0]
+        if started_at is not None:
+            rows = f"(SELECT * FROM {table} WHERE created_at >= ? AND pid IN (SELECT pid FROM new_gold_dim_process))"
+            rekeyed = PROCESS_KEY_QUERY.format(relation=relation.format(rows=rows), timestamp=timestamp)
+            query = f"{query} UNION SELECT * FROM ({rekeyed}) WHERE {timestamp} >= ?"
+            parameters = [started_at, started_at]
+        live.execute(f"CREATE OR REPLACE TEMP TABLE new_{keyed} AS {query}", parameters)
+        if started_at is not None:
+            live.execute(
+                f"DELETE FROM {keyed} WHERE {timestamp} >= ? AND pid IN (SELECT pid FROM new_gold_dim_process)",
+                [started_at],
+            )
+        live.execute(f"INSERT INTO {keyed} BY NAME SELECT * FROM new_{keyed}")
+
+    query = PROCESS_KEY_QUERY.format(relation=relation.format(rows=table), timestamp=timestamp)
+    return derive_table(con, keyed, query, append=append if table in FACT_KEYS else None)
+
+
+def register_network_flow(con):
+    register_process_key(con, "gold_fact_process_network")
+
+    def append(live):
+        since = live.execute("""
+            SELECT DATE_TRUNC('second', MIN(created_at)) FROM (
+                SELECT created_at FROM new_gold_fact_network_ip
+                UNION ALL
+                SELECT packet_created_at FROM new_gold_fact_process_network_keyed
+            )""").fetchone()[0]
+        if since is not None:
+            live.execute("DELETE FROM network_flow WHERE second >= ?", [since])
+            query = NETWORK_FLOW_QUERY.format(
+                attribution_window="packet_created_at >= ?", packet_window="ip.created_at >= ?"
+            )
+            live.execute(f"INSERT INTO network_flow BY NAME {query}", [since, since])
+
+    query = NETWORK_FLOW_QUERY.format(attribution_window="TRUE", packet_window="TRUE")
+    return derive_table(con, "network_flow", query, append=append)
+
+
+def register_interval_index(con, table):
+    return derive_table(con, f"{table}_index", INTERVAL_INDEX_QUERY.format(table=table))
+
+
+class ShowFilter:
+    # Emits the predicate of the selected "Show only" mode, a disjunction of every mode can't be pruned nor pushed down
+
+    def __init__(self, mode, launched, analyse_start):
+        self.mode = mode
+        self.launched = launched
+        self.analyse_start = analyse_start
+
+    def predicate(self, key, started_at):
+        if self.mode == SHOW_LAUNCHED:
+            return f"{key} IN (SELECT _id FROM {self.launched})"
+        if self.mode == SHOW_NEW:
+            return f"{started_at} >= ?"
+        return "TRUE"
+
+    @property
+    def parameters(self):
+        return [self.analyse_start] if self.mode == SHOW_NEW else []
+
+
+def live_fragment(session):
+    # Sections of a running session refresh on their own, the ones of a stored session only run with the page
+    return st.fragment(run_every=LIVE_REFRESH if session.live() else None)
+
+
+# Tasks a row goes through before it is exported, each may run up to its period after the previous one
+LIVE_TASKS = ["silver", "gold", "export"]
+
+
+def live_window():
+    config = load_config()
+    return timedelta(seconds=sum(config.get(("schedule", task), DEFAULT_SCHEDULE) for task in LIVE_TASKS))
+
+
+class LiveSeries:
+    # Rows of a time series kept across the runs of its fragment, a run only queries the rows from the last time it
+    # holds minus the live window, whose rows may still be completed by the next exports and are replaced
+
+    def __init__(self, key, context, time="time"):
+        self.key = key
+        self.context = context
+        self.time = time
+        state = st.session_state.get(key)
+        self.rows = state["rows"] if state is not None and state["context"] == context else None
+        self.since = None
+        if self.rows is not None and not self.rows.empty:
+            self.since = self.rows[time].max().to_pydatetime() - live_window()
+
+    def predicate(self, created_at):
+        return "TRUE" if self.since is None else f"{created_at} >= ?"
+
+    @property
+    def parameters(self):
+        return [] if self.since is None else [self.since]
+
+    def append(self, rows):
+        if self.since is not None:
+            rows = pd.concat([self.rows[self.rows[self.time] < self.since], rows], ignore_index=True)
+        st.session_state[self.key] = {"context": self.context, "rows": rows}
+        return rows
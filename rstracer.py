@@ -1,9 +1,64 @@
+import os
+import re
 import subprocess
-from time import sleep
+import threading
+from collections import deque
+from time import monotonic, sleep, time
 from typing import Dict, Type
 
+import duckdb
 import psutil
 
+READY_INTERVAL = 0.5
+CONFIG_PATH = "rstracer.toml"
+
+# Period of the scheduled tasks rstracer applies without a rstracer.toml, in seconds
+DEFAULT_SCHEDULE = 10
+
+# Rows added per second to each table of gold_tech_table_count. Counts drop at each vacuum, growth only sums their
+# increases.
+GROWTH_QUERY = """
+SELECT
+    name,
+    ARG_MAX(count, created_at) AS rows,
+    SUM(GREATEST(count - previous, 0)) / NULLIF(EPOCH(MAX(created_at) - MIN(created_at)), 0) AS rows_per_second,
+FROM (
+    SELECT
+        name,
+        count,
+        created_at,
+        LAG(count) OVER (PARTITION BY name ORDER BY created_at) AS previous,
+    FROM {table_count}
+)
+GROUP BY name
+"""
+
+# rstracer.toml only holds flat sections of scalar values
+SECTION = re.compile(r"^\[([\w.]+)\]")
+VALUE = re.compile(r"^(\w+)(\s*=\s*)(\S+)(.*)$")
+
+
+def read_config(text):
+    config = {}
+    section = None
+    for line in text.splitlines():
+        header = SECTION.match(line)
+        if header:
+            section = header.group(1)
+        value = VALUE.match(line)
+        if value:
+            raw = value.group(3)
+            config[(section, value.group(1))] = int(raw) if raw.isdigit() else raw
+    return config
+
+
+def load_config(path=CONFIG_PATH):
+    # rstracer applies its defaults without a rstracer.toml
+    if not os.path.exists(path):
+        return {}
+    with open(path) as config_file:
+        return read_config(config_file.read())
+
 
 class SingletonMeta(type):
 
@@ -16,11 +71,34 @@ class SingletonMeta(type):
         return cls._instances[cls]
 
 
+class ProcessTree:
+    # Children of every pid from a single pass over the process table, walks never rescan it
+
+    def __init__(self):
+        self.children = {}
+        for proc in psutil.process_iter(attrs=["pid", "ppid"]):
+            self.children.setdefault(proc.info["ppid"], []).append(proc.info["pid"])
+
+    def descendants(self, pid):
+        # Each pid is listed once, even if pid reuse makes the table look like a cycle
+        descendants = []
+        visited = {pid}
+        queue = deque(self.children.get(pid, []))
+        while queue:
+            child = queue.popleft()
+            if child not in visited:
+                visited.add(child)
+                descendants.append(child)
+                queue.extend(self.children.get(child, []))
+        return descendants
+
+
 class Rstracer(metaclass=SingletonMeta):
 
     def __init__(self, path="rstracer"):
         self.path = path
         self.process = None
+        self.launched_at = None
 
     def __del__(self):
         try:
@@ -29,11 +107,46 @@ class Rstracer(metaclass=SingletonMeta):
         except ImportError:
             pass
 
-    def launch(self):
+    def launch(self, cwd=None):
+        # rstracer reads the rstracer.toml of its working directory
         if not self.state() == "Running":
-            self.process = subprocess.Popen(["sudo", self.path])
+            self.launched_at = time()
+            self.process = subprocess.Popen(["sudo", self.path], cwd=cwd)
             return self.process.pid
 
+    def ready(self, directory, tables, since=None):
+        # Ready once every table was exported after the launch and the collectors already counted rows
+        since = since or self.launched_at
+        if since is None:
+            return False
+        for table in tables:
+            path = f"{directory}/{table}.parquet"
+            if not os.path.exists(path) or os.stat(path).st_mtime < since:
+                return False
+        try:
+            with duckdb.connect() as con:
+                count = con.execute(f"SELECT COUNT(*) FROM '{directory}/gold_tech_table_count.parquet'").fetchone()
+        except duckdb.Error:
+            return False
+        return count is not None and count[0] > 0
+
+    def ensure_running(self, directory, tables, timeout, cancelled=None, cwd=None):
+        # A warm rstracer is ready at once, only a stopped one pays the launch and the first export
+        if self.state() != "Running":
+            self.launch(cwd)
+        return self.wait_ready(directory, tables, timeout, cancelled)
+
+    def wait_ready(self, directory, tables, timeout, cancelled=None, since=None):
+        cancelled = cancelled or threading.Event()
+        deadline = monotonic() + timeout
+        while not self.ready(directory, tables, since):
+            if self.state() != "Running" or monotonic() > deadline or cancelled.wait(READY_INTERVAL):
+                return False
+        return True
+
+    def pid(self):
+        return self.process.pid if self.process is not None else None
+
     def state(self):
         if self.process is None:
             return "Not running"
@@ -41,11 +154,8 @@ class Rstracer(metaclass=SingletonMeta):
 
     def stop(self):
         if self.process is not None:
-            child_processes = [
-                proc for proc in psutil.process_iter(attrs=["pid", "ppid"]) if proc.info["ppid"] == self.process.pid
-            ]
-            for child in child_processes:
-                subprocess.run(["sudo", "kill", "-SIGINT", str(child.info["pid"])])
+            for child in ProcessTree().children.get(self.process.pid, []):
+                subprocess.run(["sudo", "kill", "-SIGINT", str(child)])
             subprocess.run(["sudo", "kill", "-SIGINT", str(self.process.pid)])
             while self.state() != "Exited":
                 sleep(1)
@@ -0,0 +1,196 @@
+import os
+import shutil
+import stat
+import threading
+from datetime import datetime, timezone
+from time import monotonic, time
+
+import duckdb
+import pandas as pd
+
+from pages import SAMPLER_PATH
+from rstracer import DEFAULT_SCHEDULE, load_config
+
+SAMPLE_INTERVAL = float(os.environ.get("RSBV_SAMPLER_INTERVAL", 0.2))
+# Facts stay in the export longer than the archive interval, as the gold tables until their vacuum
+RETENTION = 120
+
+# Rows are written with the types of the gold tables they are merged into
+SAMPLER_QUERIES = {
+    "gold_fact_process": """
+SELECT
+    HASH(pid, created_at, 'sampler') AS _id,
+    pid::INTEGER AS pid,
+    pcpu::DOUBLE AS pcpu,
+    pmem::DOUBLE AS pmem,
+    created_at::TIMESTAMP AS created_at,
+    created_at::TIMESTAMP AS inserted_at,
+FROM rows
+""",
+    "gold_fact_file_reg": """
+SELECT
+    HASH(pid, fd, node, created_at, 'sampler') AS _id,
+    pid::INTEGER AS pid,
+    fd::VARCHAR AS fd,
+    node::INTEGER AS node,
+    size::BIGINT AS size,
+    created_at::TIMESTAMP AS created_at,
+    created_at::TIMESTAMP AS inserted_at,
+FROM rows
+""",
+    "gold_dim_file_reg": """
+SELECT pid::INTEGER AS pid, fd::VARCHAR AS fd, node::INTEGER AS node, name::VARCHAR AS name
+FROM rows
+""",
+    "gold_dim_process": """
+SELECT
+    pid::BIGINT AS pid,
+    ppid::INTEGER AS ppid,
+    uid::INTEGER AS uid,
+    command::VARCHAR AS command,
+    full_command::VARCHAR AS full_command,
+    started_at::TIMESTAMP AS started_at,
+    inserted_at::TIMESTAMP AS inserted_at,
+FROM rows
+""",
+}
+
+SAMPLER_COLUMNS = {
+    "gold_fact_process": ["pid", "pcpu", "pmem", "created_at"],
+    "gold_fact_file_reg": ["pid", "fd", "node", "size", "created_at"],
+    "gold_dim_file_reg": ["pid", "fd", "node", "name"],
+    "gold_dim_process": ["pid", "ppid", "uid", "command", "full_command", "started_at", "inserted_at"],
+}
+
+
+def utc(timestamp):
+    return datetime.fromtimestamp(timestamp, timezone.utc).replace(tzinfo=None)
+
+
+def read(path):
+    with open(path, "rb") as proc_file:
+        return proc_file.read().decode(errors="replace")
+
+
+def field(path, name, index=1):
+    return next(line.split()[index] for line in read(path).splitlines() if line.startswith(name))
+
+
+class ProcSampler:
+    # Reads /proc of the analysed processes only, at a higher rate than the ps and lsof scans of the whole host,
+    # and exports gold rows merged with the rstracer ones
+
+    def __init__(self, pid, pids=None, path=SAMPLER_PATH):
+        self.pid = pid
+        # Members of the command cgroup when it is contained, the descendants of the command otherwise
+        self.pids = pids or self.descendants
+        self.path = path
+        self.facts = {"gold_fact_process": [], "gold_fact_file_reg": []}
+        self.processes = {}
+        self.files = {}
+        # Processes whose open files could not be read, /proc/<pid>/fd is only readable by their user and root
+        self.denied = set()
+        # Each flush bumps the version of the live snapshot, as rstracer exports do, no more often than them
+        self.flush_interval = max(load_config().get(("schedule", "export"), DEFAULT_SCHEDULE), 1)
+        self.clock_ticks = os.sysconf("SC_CLK_TCK")
+        self.page_size = os.sysconf("SC_PAGE_SIZE")
+        self.boot_time = int(field("/proc/stat", "btime"))
+        self.memory_total = int(field("/proc/meminfo", "MemTotal:")) * 1024
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+
+    def start(self):
+        shutil.rmtree(self.path, ignore_errors=True)
+        os.makedirs(self.path)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.stopped.set()
+        if self.thread.is_alive():
+            self.thread.join()
+            self.flush()
+
+    def run(self):
+        flushed_at = monotonic()
+        while not self.stopped.wait(SAMPLE_INTERVAL):
+            self.sample()
+            if monotonic() - flushed_at >= self.flush_interval:
+                self.flush()
+                flushed_at = monotonic()
+
+    def descendants(self):
+        # Children files of each thread, instead of the stat of every process of the host
+        pids = [self.pid]
+        for pid in pids:
+            try:
+                for task in os.listdir(f"/proc/{pid}/task"):
+                    pids.extend(int(child) for child in read(f"/proc/{pid}/task/{task}/children").split())
+            except OSError:
+                pass
+        return pids
+
+    def sample(self):
+        now = time()
+        created_at = utc(now)
+        for pid in self.pids():
+            # Processes exit between two reads, their last rows are kept
+            try:
+                self.sample_process(pid, now, created_at)
+            except (OSError, ValueError, IndexError):
+                pass
+
+    def sample_process(self, pid, now, created_at):
+        # Fields after the command name, which may contain spaces and parentheses
+        fields = read(f"/proc/{pid}/stat").rsplit(")", 1)[1].split()
+        ppid, start_ticks, rss = int(fields[1]), int(fields[19]), int(fields[21])
+        cpu_seconds = (int(fields[11]) + int(fields[12])) / self.clock_ticks
+        elapsed = now - self.boot_time - start_ticks / self.clock_ticks
+        # pcpu and started_at are computed as ps does: cpu time over lifetime, start second from the boot time
+        started_at = utc(self.boot_time + start_ticks // self.clock_ticks)
+        key = (pid, started_at)
+        description = self.processes[key][:-1] if key in self.processes else self.describe(pid, ppid, started_at)
+        # inserted_at is the last sample of the process, as the ps rows of rstracer
+        self.processes[key] = description + (created_at,)
+        pcpu = cpu_seconds / elapsed * 100 if elapsed > 0 else 0.0
+        pmem = rss * self.page_size / self.memory_total * 100
+        self.facts["gold_fact_process"].append((pid, pcpu, pmem, created_at))
+
+        try:
+            fds = os.listdir(f"/proc/{pid}/fd")
+        except PermissionError:
+            self.denied.add(key)
+            return
+        for fd in fds:
+            try:
+                fd_stat = os.stat(f"/proc/{pid}/fd/{fd}")
+                if stat.S_ISREG(fd_stat.st_mode):
+                    name = os.readlink(f"/proc/{pid}/fd/{fd}")
+                    self.files[(pid, fd, fd_stat.st_ino)] = name
+                    self.facts["gold_fact_file_reg"].append((pid, fd, fd_stat.st_ino, fd_stat.st_size, created_at))
+            except OSError:
+                pass
+
+    def describe(self, pid, ppid, started_at):
+        # Effective uid, as ps
+        uid = int(field(f"/proc/{pid}/status", "Uid:", 2))
+        command = read(f"/proc/{pid}/comm").strip()
+        full_command = " ".join(read(f"/proc/{pid}/cmdline").split("\0")).strip() or f"[{command}]"
+        return (pid, ppid, uid, command, full_command, started_at)
+
+    def flush(self):
+        # Each flush rewrites the export, readers see the previous or the next one
+        expired = utc(time() - RETENTION)
+        for table, rows in self.facts.items():
+            self.facts[table] = [row for row in rows if row[-1] >= expired]
+        tables = {
+            **self.facts,
+            "gold_dim_file_reg": [key + (name,) for key, name in self.files.items()],
+            "gold_dim_process": list(self.processes.values()),
+        }
+        with duckdb.connect() as con:
+            for table, rows in tables.items():
+                con.register("rows", pd.DataFrame(rows, columns=SAMPLER_COLUMNS[table]))
+                con.execute(f"COPY ({SAMPLER_QUERIES[table]}) TO '{self.path}/{table}.parquet.tmp' (FORMAT PARQUET)")
+                con.unregister("rows")
+                os.replace(f"{self.path}/{table}.parquet.tmp", f"{self.path}/{table}.parquet")
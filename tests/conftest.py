@@ -0,0 +1,20 @@
+import pytest
+
+import benchmark
+from pages import SnapshotCursor, load_snapshot, snapshot_version
+
+SCALE = 10_000
+
+
+@pytest.fixture(scope="session")
+def export(tmp_path_factory):
+    # Synthetic export of the benchmark: reused pids, a launched tree and an rstracer tree
+    path = str(tmp_path_factory.mktemp("export"))
+    benchmark.generate(path, SCALE)
+    return path
+
+
+@pytest.fixture
+def snapshot(export):
+    version = snapshot_version(export)
+    return SnapshotCursor(load_snapshot(export, version).cursor(), version)
@@ -0,0 +1,43 @@
+from types import SimpleNamespace
+
+import pytest
+
+import analysis
+from analysis import Analysis
+
+PID = 4242
+
+
+@pytest.fixture
+def stopped(monkeypatch):
+    # A daemon analysis of a command whose process belongs to root, as the sudo child of its shell
+    def kill(pid, signal):
+        raise PermissionError(1, "Operation not permitted")
+
+    sudo = []
+    monkeypatch.setattr(analysis.os, "kill", kill)
+    monkeypatch.setattr(analysis.subprocess, "run", lambda command: sudo.append(command))
+    monkeypatch.setattr(analysis, "ProcessTree", lambda: SimpleNamespace(descendants=lambda pid: [PID + 1]))
+    stopped = Analysis("sleep 60", "nobody", 60, daemon=True)
+    stopped.process = SimpleNamespace(pid=PID)
+    stopped.sudo = sudo
+    return stopped
+
+
+def test_analysis_stop_signals_root_processes_through_sudo(stopped):
+    stopped.stop()
+    assert stopped.sudo == [["sudo", "kill", "-TERM", str(PID)], ["sudo", "kill", "-TERM", str(PID + 1)]]
+    assert stopped.state == "Done"
+
+
+def test_analysis_stop_runs_every_step(stopped, monkeypatch):
+    def stop():
+        raise RuntimeError("sampler thread died")
+
+    stopped.sampler = SimpleNamespace(stop=stop)
+    stored = []
+    monkeypatch.setattr(stopped, "store_session", lambda: stored.append(True))
+    stopped.stop()
+    assert stored == [True]
+    assert stopped.state == "Failed"
+    assert str(stopped.error) == "sampler thread died"
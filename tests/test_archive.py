@@ -0,0 +1,164 @@
+import glob
+import itertools
+import os
+
+import duckdb
+import pytest
+
+from archive import Archive
+from pages import merge_rows_query, new_rows_query
+
+TABLES = ["gold_fact_process", "gold_fact_process_network", "gold_dim_process", "gold_file_user"]
+
+# Facts every 10 minutes from midnight, each export covers a window of them
+EXPORT_QUERIES = {
+    "gold_fact_process": """
+SELECT
+    i AS _id,
+    1000 + i % 3 AS pid,
+    i / 10 AS pcpu,
+    0.1 AS pmem,
+    TIMESTAMP '2024-01-01 00:00:00' + TO_MINUTES(i * 10) AS created_at,
+    created_at AS inserted_at,
+FROM range({start}, {end}) t(i)
+""",
+    "gold_fact_process_network": """
+SELECT i AS packet_id, pid, TIMESTAMP '2024-01-01 00:00:00' + TO_MINUTES(i * 10) AS created_at
+FROM range({start}, {end}) t(i), (VALUES (1000), (1001)) p(pid)
+""",
+    "gold_dim_process": """
+SELECT
+    1000 + i AS pid,
+    1 AS ppid,
+    TIMESTAMP '2024-01-01 00:00:00' + TO_MINUTES(i) AS started_at,
+    TIMESTAMP '2024-01-01 00:00:00' + TO_MINUTES({end} * 10) AS inserted_at,
+FROM range(3) t(i)
+""",
+    "gold_file_user": "SELECT i AS uid, 'user' || i AS name FROM range({start} // 3, {end} // 3) t(i)",
+}
+
+# Modification time of each export, rewrites within the same clock tick still change the version
+EXPORT_TIMES = itertools.count(1)
+
+
+def write_export(path, start, end):
+    os.makedirs(path, exist_ok=True)
+    with duckdb.connect() as con:
+        for table, query in EXPORT_QUERIES.items():
+            con.execute(f"COPY ({query.format(start=start, end=end)}) TO '{path}/{table}.parquet' (FORMAT PARQUET)")
+    export_time = next(EXPORT_TIMES)
+    for table in EXPORT_QUERIES:
+        os.utime(f"{path}/{table}.parquet", (export_time, export_time))
+
+
+def read(path, table, order):
+    files = glob.glob(f"{path}/{table}/*/*.parquet") + glob.glob(f"{path}/{table}/*.parquet")
+    with duckdb.connect() as con:
+        return con.execute(f"SELECT * FROM read_parquet({files}, hive_partitioning = false) ORDER BY {order}").df()
+
+
+@pytest.fixture
+def export(tmp_path):
+    return str(tmp_path / "export")
+
+
+@pytest.fixture
+def archive(tmp_path):
+    return Archive(str(tmp_path / "session"), TABLES)
+
+
+def test_archive_repeated_export(export, archive):
+    write_export(export, 0, 6)
+    assert archive.update(export, force=True)
+    write_export(export, 0, 6)
+    assert archive.update(export, force=True)
+    assert read(archive.path, "gold_fact_process", "_id")["_id"].tolist() == list(range(6))
+    assert len(read(archive.path, "gold_fact_process_network", "packet_id, pid")) == 12
+
+
+def test_archive_overlapping_exports(export, archive):
+    write_export(export, 0, 6)
+    archive.update(export, force=True)
+    write_export(export, 3, 12)
+    archive.update(export, force=True)
+    facts = read(archive.path, "gold_fact_process", "_id")
+    assert facts["_id"].tolist() == list(range(12))
+    # Rows are partitioned by hour of created_at
+    assert sorted(os.listdir(f"{archive.path}/gold_fact_process")) == ["bucket=2024010100", "bucket=2024010101"]
+    packets = read(archive.path, "gold_fact_process_network", "packet_id, pid")
+    assert len(packets) == 24
+    assert not packets.duplicated(["packet_id", "pid"]).any()
+
+
+def test_archive_skips_unchanged_export(export, archive):
+    write_export(export, 0, 6)
+    assert archive.update(export, force=True)
+    assert not archive.update(export, force=True)
+    write_export(export, 0, 7)
+    # Exports are archived at most every ARCHIVE_INTERVAL seconds
+    assert not archive.update(export)
+    assert archive.update(export, force=True)
+
+
+def test_archive_dimension_keeps_last_export(export, archive):
+    write_export(export, 0, 6)
+    archive.update(export, force=True)
+    write_export(export, 3, 12)
+    archive.update(export, force=True)
+    processes = read(archive.path, "gold_dim_process", "pid")
+    assert processes["pid"].tolist() == [1000, 1001, 1002]
+    assert (processes["inserted_at"] == "2024-01-01 02:00:00").all()
+
+
+def test_archive_dimension_without_key_keeps_distinct_rows(export, archive):
+    write_export(export, 0, 6)
+    archive.update(export, force=True)
+    write_export(export, 3, 12)
+    archive.update(export, force=True)
+    assert read(archive.path, "gold_file_user", "uid")["uid"].tolist() == [0, 1, 2, 3]
+
+
+def test_archive_compact(export, archive):
+    for start, end in [(0, 4), (2, 8), (6, 12)]:
+        write_export(export, start, end)
+        archive.update(export, force=True)
+    archive.compact(export)
+    for bucket in glob.glob(f"{archive.path}/gold_fact_process/bucket=*"):
+        assert os.listdir(bucket) == ["part_0.parquet"]
+        facts = read(bucket, "", "_id")
+        assert facts["created_at"].is_monotonic_increasing
+    assert read(archive.path, "gold_fact_process", "_id")["_id"].tolist() == list(range(12))
+
+
+def test_archive_compact_keeps_schema_of_empty_tables(export, archive):
+    write_export(export, 0, 0)
+    archive.update(export, force=True)
+    archive.compact(export)
+    facts = read(archive.path, "gold_fact_process", "_id")
+    assert facts.empty
+    assert list(facts.columns) == ["_id", "pid", "pcpu", "pmem", "created_at", "inserted_at"]
+
+
+def test_new_rows_query_composite_key():
+    with duckdb.connect() as con:
+        con.execute("CREATE TABLE stored AS SELECT 1 AS packet_id, 1000 AS pid, TIMESTAMP '2024-01-01' AS created_at")
+        con.execute(
+            "CREATE TABLE export AS SELECT * FROM (VALUES (1, 1000), (1, 1001), (2, 1000)) t(packet_id, pid), "
+            "(SELECT TIMESTAMP '2024-01-01' AS created_at)"
+        )
+        rows = con.execute(new_rows_query("gold_fact_process_network", "export", "stored")).fetchall()
+    assert sorted(row[:2] for row in rows) == [(1, 1001), (2, 1000)]
+
+
+def test_merge_rows_query_keeps_export_rows():
+    with duckdb.connect() as con:
+        con.execute(
+            "CREATE TABLE stored AS SELECT * FROM (VALUES ('10.0.0.1', 'old'), ('10.0.0.2', 'kept')) t(address, host)"
+        )
+        con.execute(
+            "CREATE TABLE export AS SELECT * FROM (VALUES ('10.0.0.1', 'new'), ('10.0.0.3', 'added')) t(address, host)"
+        )
+        rows = con.execute(
+            f"{merge_rows_query('gold_dim_network_host', 'export', 'stored')} ORDER BY address"
+        ).fetchall()
+    assert rows == [("10.0.0.1", "new"), ("10.0.0.2", "kept"), ("10.0.0.3", "added")]
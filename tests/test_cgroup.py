@@ -0,0 +1,117 @@
+import os
+from datetime import datetime
+
+import duckdb
+import pytest
+
+import cgroup
+from benchmark import ROOT_PID
+from cgroup import Cgroup
+from pages import TABLES, SnapshotCursor, get_descendants, load_snapshot, snapshot_version
+
+CPU_STAT = """usage_usec 1500
+user_usec 1000
+system_usec 500
+nr_periods 0
+"""
+
+# Counters of every device are summed
+IO_STAT = """8:0 rbytes=4096 wbytes=8192 rios=1 wios=2 dbytes=0 dios=0
+8:16 rbytes=1024 wbytes=0 rios=3 wios=0 dbytes=0 dios=0
+"""
+
+
+def seen(time):
+    return datetime.fromisoformat(f"2024-01-01 {time}")
+
+
+@pytest.fixture
+def fake_cgroup(tmp_path, monkeypatch):
+    monkeypatch.setattr(cgroup, "CGROUP_ROOT", str(tmp_path / "rsbv"))
+    fake_cgroup = Cgroup("test")
+    os.makedirs(fake_cgroup.path)
+    return fake_cgroup
+
+
+def write(fake_cgroup, name, content):
+    with open(f"{fake_cgroup.path}/{name}", "w") as cgroup_file:
+        cgroup_file.write(content)
+
+
+def test_cgroup_sample_counters(fake_cgroup):
+    write(fake_cgroup, "cpu.stat", CPU_STAT)
+    write(fake_cgroup, "memory.current", "2048\n")
+    write(fake_cgroup, "io.stat", IO_STAT)
+    stat = fake_cgroup.sample()
+    assert stat.pop("created_at") is not None
+    assert stat == {
+        "cpu_usage_usec": 1500,
+        "cpu_user_usec": 1000,
+        "cpu_system_usec": 500,
+        "memory_current": 2048,
+        "io_read_bytes": 5120,
+        "io_write_bytes": 8192,
+        "io_read_count": 4,
+        "io_write_count": 2,
+    }
+
+
+def test_cgroup_sample_without_controllers(fake_cgroup):
+    # Controllers missing from the hierarchy leave their counters out
+    stat = fake_cgroup.sample()
+    assert stat["cpu_usage_usec"] is None and stat["memory_current"] is None
+    assert stat["io_read_bytes"] == 0
+
+
+def test_cgroup_record_membership(fake_cgroup, tmp_path):
+    for procs in ["100\n101\n", "100\n", "100\n101\n", ""]:
+        write(fake_cgroup, "cgroup.procs", procs)
+        fake_cgroup.record()
+    assert [stat["process_count"] for stat in fake_cgroup.stats] == [2, 1, 2, 0]
+    times = [stat["created_at"] for stat in fake_cgroup.stats]
+    # A pid back in the cgroup starts a new presence interval
+    assert [(member["pid"], member["first_seen"], member["last_seen"]) for member in fake_cgroup.members] == [
+        (100, times[0], times[2]),
+        (101, times[0], times[0]),
+        (101, times[2], times[2]),
+    ]
+    directory = str(tmp_path / "session")
+    fake_cgroup.write(directory)
+    with duckdb.connect() as con:
+        assert con.execute(f"SELECT COUNT(*) FROM '{directory}/cgroup_stat/data.parquet'").fetchone()[0] == 4
+        members = con.execute(f"SELECT pid FROM '{directory}/cgroup_process/data.parquet' ORDER BY ALL").fetchall()
+    assert members == [(100,), (101,), (101,)]
+
+
+@pytest.fixture
+def contained(export, tmp_path, fake_cgroup):
+    # Stored session of the benchmark command, its cgroup holds members of the tree and pid 1000 once reparented
+    # to pid 1 between 00:37:30 and 00:45
+    path = str(tmp_path / "contained")
+    os.makedirs(path)
+    for table in TABLES:
+        os.symlink(f"{export}/{table}.parquet", f"{path}/{table}.parquet")
+    fake_cgroup.members = [
+        {"pid": ROOT_PID, "first_seen": seen("00:30:00"), "last_seen": seen("00:59:00")},
+        {"pid": 1000, "first_seen": seen("00:31:00"), "last_seen": seen("00:36:00")},
+        {"pid": 1000, "first_seen": seen("00:38:00"), "last_seen": seen("00:40:00")},
+        {"pid": 1000, "first_seen": seen("00:41:00"), "last_seen": seen("00:42:00")},
+        {"pid": 99999, "first_seen": seen("00:38:00"), "last_seen": seen("00:40:00")},
+    ]
+    fake_cgroup.write(path)
+    version = snapshot_version(path)
+    return SnapshotCursor(load_snapshot(path, version).cursor(), version)
+
+
+def test_launched_tree_adds_reparented_members(contained):
+    tree = get_descendants(contained, ROOT_PID)
+    launched = get_descendants(contained, ROOT_PID, cgroup=True)
+    added = launched[~launched["_id"].isin(tree["_id"])]
+    assert added[["pid", "ppid", "started_at"]].values.tolist() == [[1000, 1, seen("00:37:30")]]
+    init = contained.execute(
+        "SELECT process_key FROM gold_dim_process WHERE pid = 1 AND started_at = TIMESTAMP '2024-01-01'"
+    ).fetchone()[0]
+    assert added["parent_id"].tolist() == [init]
+    # Members already in the tree, the root and unknown pids are not added
+    assert tree["_id"].isin(launched["_id"]).all()
+    assert launched["_id"].is_unique
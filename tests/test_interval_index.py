@@ -0,0 +1,45 @@
+from datetime import datetime
+
+import duckdb
+import pytest
+
+from pages import INTERVAL_INDEX_QUERY
+
+# Ports listening since 2020, during the packets, before and after them
+PORTS = """
+SELECT * FROM (VALUES
+    (22, 'sshd', TIMESTAMP '2020-01-01 00:00:00', TIMESTAMP '2024-01-01 01:00:00'),
+    (8000, 'python', TIMESTAMP '2024-01-01 00:12:30', TIMESTAMP '2024-01-01 00:14:10'),
+    (8001, 'python', TIMESTAMP '2024-01-01 00:01:00', TIMESTAMP '2024-01-01 00:05:00'),
+    (8002, 'python', TIMESTAMP '2024-01-01 00:25:00', TIMESTAMP '2024-01-01 00:40:00')
+) t(port, command, started_at, inserted_at)
+"""
+
+# Packets every second from 00:10:15 to 00:20:14
+PACKETS = "SELECT TIMESTAMP '2024-01-01 00:10:15' + TO_SECONDS(i) AS created_at FROM range(600) t(i)"
+
+
+@pytest.fixture
+def con():
+    with duckdb.connect() as con:
+        con.execute(f"CREATE TABLE gold_dim_network_open_port AS {PORTS}")
+        con.execute(f"CREATE TABLE gold_fact_network_ip AS {PACKETS}")
+        yield con
+
+
+def index(con):
+    query = INTERVAL_INDEX_QUERY.format(table="gold_dim_network_open_port")
+    return con.execute(f"SELECT port, started_at, MIN(bucket), MAX(bucket) FROM ({query}) GROUP BY ALL ORDER BY port")
+
+
+def test_interval_index_clamped_to_packets(con):
+    # Intervals keep their bounds for the range check of the join
+    assert index(con).fetchall() == [
+        (22, datetime(2020, 1, 1), datetime(2024, 1, 1, 0, 10), datetime(2024, 1, 1, 0, 20)),
+        (8000, datetime(2024, 1, 1, 0, 12, 30), datetime(2024, 1, 1, 0, 12), datetime(2024, 1, 1, 0, 14)),
+    ]
+
+
+def test_interval_index_without_packets(con):
+    con.execute("DELETE FROM gold_fact_network_ip")
+    assert index(con).fetchall() == []
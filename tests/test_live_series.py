@@ -0,0 +1,43 @@
+from datetime import datetime
+
+import pandas as pd
+import pytest
+import streamlit as st
+
+import pages
+from pages import LiveSeries
+
+CONFIG = {("schedule", "silver"): 5, ("schedule", "gold"): 20, ("schedule", "export"): 30}
+TIMES = pd.date_range("2024-01-01 00:00:00", periods=120, freq="s")
+
+
+@pytest.fixture(autouse=True)
+def config(monkeypatch):
+    monkeypatch.setattr(pages, "load_config", lambda: CONFIG)
+    st.session_state.pop("series", None)
+
+
+def test_live_series_first_run_queries_everything():
+    series = LiveSeries("series", "context")
+    assert series.predicate("created_at") == "TRUE"
+    assert series.parameters == []
+
+
+def test_live_series_requeries_export_window():
+    LiveSeries("series", "context").append(pd.DataFrame({"time": TIMES, "value": 1}))
+    series = LiveSeries("series", "context")
+    # Rows of the last silver, gold and export periods may still be completed by the next export
+    assert series.parameters == [datetime(2024, 1, 1, 0, 1, 4)]
+    rows = series.append(pd.DataFrame({"time": TIMES[TIMES >= series.since], "value": 2}))
+    assert rows["time"].tolist() == TIMES.tolist()
+    assert (rows.set_index("time")["value"] == 2).sum() == 56
+
+
+def test_live_series_restarts_on_new_context():
+    LiveSeries("series", "context").append(pd.DataFrame({"time": TIMES, "value": 1}))
+    assert LiveSeries("series", "other").since is None
+
+
+def test_live_window_defaults_to_rstracer_schedule(monkeypatch):
+    monkeypatch.setattr(pages, "load_config", lambda: {})
+    assert pages.live_window().total_seconds() == 3 * pages.DEFAULT_SCHEDULE
@@ -0,0 +1,141 @@
+import os
+
+import duckdb
+import pytest
+
+import pages
+from benchmark import ROOT_PID
+from pages import (
+    FACT_KEYS,
+    TABLES,
+    LiveSnapshot,
+    Session,
+    SnapshotCursor,
+    get_descendants,
+    load_snapshot,
+    register_interval_index,
+    register_launched_tree,
+    register_network_flow,
+    register_process_key,
+    snapshot_cursor,
+    snapshot_version,
+)
+
+# Successive exports of a running session, cut within a second, the processes of an export are exported after
+# their first facts
+CUTS = ["00:10:56.5", "00:31:51.5", "00:39:24.5", "01:00:01"]
+PROCESS_DELAY = "INTERVAL 2 MINUTE"
+
+DERIVED_TABLES = {
+    "gold_fact_process_keyed": "_id",
+    "gold_fact_process_network_keyed": "packet_id, pid",
+    "gold_dim_network_socket_keyed": "pid, source_port, started_at",
+    "gold_dim_network_open_port_index": "port, started_at, bucket",
+    "network_flow": "ALL",
+    f"process_tree_{ROOT_PID}": "_id",
+    f"launched_tree_{ROOT_PID}": "_id",
+}
+
+
+def write_export(export, path, cut):
+    os.makedirs(path, exist_ok=True)
+    with duckdb.connect() as con:
+        for table in TABLES:
+            query = f"SELECT * FROM '{export}/{table}.parquet'"
+            if table in FACT_KEYS:
+                query += f" WHERE created_at < TIMESTAMP '2024-01-01 {cut}'"
+            elif table == "gold_dim_process":
+                query += f" WHERE started_at < TIMESTAMP '2024-01-01 {cut}' - {PROCESS_DELAY}"
+            con.execute(f"COPY ({query}) TO '{path}/{table}.parquet.tmp' (FORMAT PARQUET)")
+    for table in TABLES:
+        os.replace(f"{path}/{table}.parquet.tmp", f"{path}/{table}.parquet")
+
+
+def register_tables(con):
+    register_launched_tree(con, ROOT_PID)
+    register_process_key(con, "gold_fact_process")
+    register_process_key(con, "gold_dim_network_socket")
+    register_network_flow(con)
+    register_interval_index(con, "gold_dim_network_open_port")
+
+
+def read(con, table, order):
+    return con.cursor.execute(f"SELECT * FROM {table} ORDER BY {order}").df()
+
+
+@pytest.fixture
+def live(tmp_path, monkeypatch):
+    monkeypatch.setattr(pages, "SAMPLER_PATH", str(tmp_path / "sampler"))
+    monkeypatch.setattr(pages, "LIVE_POLL_INTERVAL", 0)
+    return LiveSnapshot(str(tmp_path / "live"))
+
+
+def cursor(live):
+    live.refresh()
+    version, cursor = live.cursor()
+    return SnapshotCursor(cursor, version, live)
+
+
+def test_live_snapshot_derived_tables_match_full_build(export, live):
+    write_export(export, live.path, CUTS[0])
+    register_tables(cursor(live))
+    for cut in CUTS[1:]:
+        write_export(export, live.path, cut)
+        con = cursor(live)
+        version = snapshot_version(live.path)
+        stored = SnapshotCursor(load_snapshot(live.path, version).cursor(), version)
+        register_tables(stored)
+        for table, order in DERIVED_TABLES.items():
+            expected = read(stored, table, order)
+            assert not expected.empty
+            assert read(con, table, order).equals(expected), (cut, table)
+        assert get_descendants(con, ROOT_PID).equals(get_descendants(stored, ROOT_PID))
+    assert live.version == len(CUTS)
+
+
+def test_live_snapshot_keeps_tables_of_running_cursors(export, live):
+    # Cursors opened before the last exports query the same derived tables, which are never dropped
+    write_export(export, live.path, CUTS[0])
+    con = cursor(live)
+    register_tables(con)
+    before = con.cursor.execute("SELECT COUNT(*) FROM network_flow").fetchone()[0]
+    for cut in CUTS[1:3]:
+        write_export(export, live.path, cut)
+        live.refresh()
+    assert con.version == 1 and live.version == 3
+    assert con.cursor.execute("SELECT COUNT(*) FROM network_flow").fetchone()[0] > before
+
+
+def test_snapshot_cursor_keys_the_version_it_reads(export, live, monkeypatch):
+    write_export(export, live.path, CUTS[0])
+    refresh = live.refresh
+
+    def racing_refresh():
+        # Another viewer loads the next export between the refresh of this one and its cursor
+        version = refresh()
+        write_export(export, live.path, CUTS[1])
+        refresh()
+        return version
+
+    monkeypatch.setattr(live, "refresh", racing_refresh)
+    monkeypatch.setattr(pages, "live_snapshot", lambda session_id, path: live)
+    con = snapshot_cursor(Session("live", "live", ROOT_PID, ROOT_PID, None))
+    assert con.version == ("live", 2)
+    count = con.execute("SELECT COUNT(*) FROM gold_fact_process").fetchone()[0]
+    assert count == live.con.execute("SELECT COUNT(*) FROM gold_fact_process").fetchone()[0]
+
+
+def test_live_snapshot_skips_unchanged_export(export, live):
+    write_export(export, live.path, CUTS[0])
+    assert live.refresh() == 1
+    assert live.refresh() == 1
+
+
+def test_live_snapshot_waits_for_missing_tables(export, live):
+    write_export(export, live.path, CUTS[0])
+    assert live.refresh() == 1
+    write_export(export, live.path, CUTS[1])
+    os.remove(f"{live.path}/gold_file_service.parquet")
+    assert live.refresh() == 1
+    write_export(export, live.path, CUTS[1])
+    assert live.refresh() == 2
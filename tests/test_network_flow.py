@@ -0,0 +1,32 @@
+import duckdb
+import pytest
+
+from pages import NETWORK_FLOW_QUERY
+
+# Two packets from the local port 5000 shared by pids 10 and 11, then one packet of pid 12 alone
+TABLES = {
+    "gold_dim_network_interface": "SELECT '10.0.0.1' AS address",
+    "gold_dim_network_host": "SELECT * FROM (VALUES ('10.0.0.1', 'local'), ('1.1.1.1', 'remote')) t(address, host)",
+    "gold_fact_network_ip": """SELECT * FROM (VALUES
+        (1, TIMESTAMP '2024-01-01 00:00:00.1', '10.0.0.1', 5000, '1.1.1.1', 443),
+        (2, TIMESTAMP '2024-01-01 00:00:00.6', '10.0.0.1', 5000, '1.1.1.1', 443),
+        (3, TIMESTAMP '2024-01-01 00:00:00.8', '10.0.0.1', 5000, '1.1.1.1', 443)
+    ) t(_id, created_at, source_address, source_port, destination_address, destination_port)""",
+    "gold_fact_network_packet": "SELECT i AS _id, 'TCP' AS transport, 100 AS length FROM range(1, 4) t(i)",
+    "gold_fact_process_network_keyed": """SELECT *, pid * 100 AS process_key
+        FROM (VALUES (1, 11), (1, 10), (2, 10), (2, 11), (3, 12)) t(packet_id, pid)""",
+}
+
+
+@pytest.fixture
+def con():
+    with duckdb.connect() as con:
+        for table, query in TABLES.items():
+            con.execute(f"CREATE TABLE {table} AS {query}")
+        yield con
+
+
+def test_network_flow_keeps_every_process_of_a_shared_socket(con):
+    query = NETWORK_FLOW_QUERY.format(attribution_window="TRUE", packet_window="TRUE")
+    flows = con.execute(f"SELECT pids, process_keys, packet_count, byte_count FROM ({query}) ORDER BY pids").fetchall()
+    assert flows == [([10, 11], [1000, 1100], 2, 200), ([12], [1200], 1, 100)]
@@ -0,0 +1,41 @@
+from types import SimpleNamespace
+
+import pytest
+
+import rstracer
+from rstracer import ProcessTree
+
+
+def process_table(monkeypatch, edges):
+    processes = [SimpleNamespace(info={"pid": pid, "ppid": ppid}) for pid, ppid in edges]
+    monkeypatch.setattr(rstracer.psutil, "process_iter", lambda attrs: iter(processes))
+    return ProcessTree()
+
+
+def test_process_tree_descendants_breadth_first(monkeypatch):
+    tree = process_table(monkeypatch, [(1, 0), (100, 1), (101, 100), (102, 100), (103, 101), (200, 1)])
+    assert tree.descendants(100) == [101, 102, 103]
+    assert tree.descendants(103) == []
+    assert tree.descendants(999) == []
+
+
+@pytest.mark.parametrize(
+    "edges",
+    [
+        # A reused pid shows up as the parent of its own ancestor
+        [(100, 1), (101, 100), (102, 101), (100, 102)],
+        # A pid listed as its own parent
+        [(100, 1), (101, 100), (101, 101)],
+    ],
+)
+def test_process_tree_descendants_survive_pid_reuse_cycles(monkeypatch, edges):
+    tree = process_table(monkeypatch, edges)
+    descendants = tree.descendants(100)
+    assert sorted(descendants) == sorted({pid for pid, _ in edges} - {100})
+    assert len(descendants) == len(set(descendants))
+
+
+def test_process_tree_descendants_with_shared_child(monkeypatch):
+    # A child listed under two parents, as when the table is read while it is reparented
+    tree = process_table(monkeypatch, [(100, 1), (101, 100), (102, 100), (103, 101), (103, 102)])
+    assert tree.descendants(100) == [101, 102, 103]
@@ -0,0 +1,69 @@
+import pandas as pd
+
+from pages import QueryCache, result_size
+
+ROW = (1,)
+
+
+class Compute:
+    # Counts the queries the cache runs
+
+    def __init__(self, result=ROW):
+        self.result = result
+        self.calls = 0
+
+    def __call__(self):
+        self.calls += 1
+        return self.result
+
+
+def test_query_cache_hit():
+    cache = QueryCache(10 * result_size(ROW))
+    compute = Compute()
+    assert cache.get(1, "query", compute) == ROW
+    assert cache.get(1, "query", compute) == ROW
+    assert compute.calls == 1
+    assert (cache.hits, cache.misses) == (1, 1)
+
+
+def test_query_cache_keyed_by_version():
+    cache = QueryCache(10 * result_size(ROW))
+    compute = Compute()
+    cache.get(1, "query", compute)
+    cache.get(2, "query", compute)
+    assert compute.calls == 2
+
+
+def test_query_cache_evicts_least_recently_used():
+    cache = QueryCache(2 * result_size(ROW))
+    cache.get(1, "a", Compute())
+    cache.get(1, "b", Compute())
+    # "a" is used again, "b" becomes the least recently used entry
+    cache.get(1, "a", Compute())
+    cache.get(1, "c", Compute())
+    assert list(cache.entries) == [(1, "a"), (1, "c")]
+    assert cache.size == 2 * result_size(ROW)
+    compute = Compute()
+    cache.get(1, "b", compute)
+    assert compute.calls == 1
+
+
+def test_query_cache_evicts_outdated_versions_first():
+    cache = QueryCache(2 * result_size(ROW))
+    cache.get(1, "a", Compute())
+    cache.get(1, "b", Compute())
+    cache.get(2, "a", Compute())
+    cache.get(2, "b", Compute())
+    assert list(cache.entries) == [(2, "a"), (2, "b")]
+
+
+def test_query_cache_skips_results_over_budget():
+    result = pd.DataFrame({"value": range(1000)})
+    cache = QueryCache(result_size(result) - 1)
+    cache.get(1, "a", Compute())
+    compute = Compute(result)
+    assert cache.get(1, "large", compute) is result
+    assert cache.get(1, "large", compute) is result
+    assert compute.calls == 2
+    # Entries under the budget are kept
+    assert list(cache.entries) == [(1, "a")]
@@ -0,0 +1,53 @@
+import os
+
+import duckdb
+import pytest
+
+import sampler
+from sampler import ProcSampler
+
+PID = os.getpid()
+
+
+@pytest.fixture
+def proc_sampler(tmp_path, monkeypatch):
+    monkeypatch.setattr(sampler, "load_config", lambda: {("schedule", "export"): 30})
+    path = tmp_path / "sampler"
+    path.mkdir()
+    return ProcSampler(PID, lambda: [PID], str(path))
+
+
+def test_sampler_flushes_at_export_period(proc_sampler):
+    assert proc_sampler.flush_interval == 30
+
+
+def test_sampler_updates_process_last_seen(proc_sampler):
+    proc_sampler.sample()
+    first = proc_sampler.processes.copy()
+    proc_sampler.sample()
+    assert first.keys() == proc_sampler.processes.keys()
+    ((key, row),) = proc_sampler.processes.items()
+    assert row[:-1] == first[key][:-1]
+    assert row[-1] == proc_sampler.facts["gold_fact_process"][-1][-1] > first[key][-1]
+    proc_sampler.flush()
+    with duckdb.connect() as con:
+        started_at, inserted_at = con.execute(
+            f"SELECT started_at, inserted_at FROM '{proc_sampler.path}/gold_dim_process.parquet'"
+        ).fetchone()
+    assert (started_at, inserted_at) == (key[1], row[-1])
+
+
+def test_sampler_counts_processes_with_unreadable_files(proc_sampler, monkeypatch):
+    with open(__file__):
+        proc_sampler.sample()
+    assert proc_sampler.facts["gold_fact_file_reg"]
+    assert not proc_sampler.denied
+
+    def listdir(path):
+        raise PermissionError(13, "Permission denied", path)
+
+    monkeypatch.setattr(sampler.os, "listdir", listdir)
+    proc_sampler.sample()
+    assert proc_sampler.denied == set(proc_sampler.processes)
+    # The process itself is still sampled
+    assert len(proc_sampler.facts["gold_fact_process"]) == 2
@@ -0,0 +1,46 @@
+import os
+from datetime import datetime
+
+import pytest
+
+import pages
+from pages import OUTPUT_PATH, Session, list_sessions
+
+STARTED_AT = datetime(2024, 1, 1, 0, 30)
+ENDED_AT = datetime(2024, 1, 1, 0, 45)
+
+
+@pytest.fixture
+def session(tmp_path, monkeypatch):
+    # A running session of this process, traced by this process
+    monkeypatch.setattr(pages, "SESSION_PATH", str(tmp_path / "session"))
+    session = Session("running", "sleep 60", os.getpid(), os.getpid(), STARTED_AT)
+    session.save()
+    return session
+
+
+def test_session_live_until_stored(session):
+    assert session.live() and not session.stale()
+    assert str(session) == "2024/01/01 00:30:00 - live - sleep 60"
+    session.close(ENDED_AT, "archive")
+    (stored,) = list_sessions()
+    assert vars(stored) == vars(session)
+    assert not stored.live() and not stored.stale()
+    assert str(stored) == "2024/01/01 00:30:00 - 00:45:00 - sleep 60"
+
+
+def test_session_stale_after_unfinished_teardown(session):
+    # The teardown marker is persisted, the session was never stored
+    session.end(ENDED_AT)
+    (stored,) = list_sessions()
+    assert stored.path == OUTPUT_PATH
+    assert stored.stale()
+    assert str(stored) == "2024/01/01 00:30:00 - not stored - sleep 60"
+
+
+@pytest.mark.parametrize("field", ["pid", "tracer_pid"])
+def test_session_stale_without_its_processes(session, field, monkeypatch):
+    monkeypatch.setattr(pages.psutil, "pid_exists", lambda pid: pid != getattr(session, field))
+    assert session.stale()
+    setattr(session, field, None)
+    assert session.stale()
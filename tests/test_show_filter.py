@@ -0,0 +1,118 @@
+import pytest
+
+from benchmark import ANALYSE_START, ROOT_PID
+from pages import SHOW_ALL, SHOW_LAUNCHED, SHOW_NEW, ShowFilter, register_launched_tree, register_process_key
+
+# Predicate the pages sent for every mode before ShowFilter, the selected mode was bound as a parameter
+OR_PREDICATE = """(
+    ({key} IN (SELECT _id FROM {launched}) AND ? = 'launched')
+    OR ({started_at} >= ? AND ? = 'new')
+    OR (? = 'all')
+)"""
+
+# Page queries and the process key and start timestamp their filter is applied on
+QUERIES = [
+    (
+        """
+SELECT COALESCE(dim.command, dim.full_command) AS command, COUNT(*) AS count, MAX(fact.pcpu) AS pcpu
+FROM gold_fact_process_keyed fact
+LEFT JOIN gold_dim_process dim ON fact.process_key = dim.process_key
+WHERE {predicate}
+GROUP BY ALL
+""",
+        "fact.process_key",
+        "dim.started_at",
+    ),
+    (
+        """
+SELECT fact.pid, fact.fd, fact.node, MAX(size) - MIN(size) AS modification_size
+FROM gold_fact_file_reg_keyed fact
+LEFT JOIN gold_dim_process pro ON fact.process_key = pro.process_key
+WHERE {predicate}
+GROUP BY ALL
+""",
+        "fact.process_key",
+        "pro.started_at",
+    ),
+    (
+        """
+SELECT COALESCE(pro.command, 'Unknown') AS command, COUNT(*) AS count, SUM(length) AS size
+FROM gold_fact_network_packet packet
+LEFT JOIN gold_fact_process_network_keyed net_pro ON net_pro.packet_id = packet._id
+LEFT JOIN gold_dim_process pro ON net_pro.process_key = pro.process_key
+WHERE {predicate}
+GROUP BY ALL
+""",
+        "net_pro.process_key",
+        "packet.created_at",
+    ),
+]
+
+# Count of new packets, the scan the network page runs in "new packet" mode
+PACKET_QUERY = "SELECT COUNT(*) FROM gold_fact_network_packet packet WHERE {predicate}"
+
+
+def register_tables(snapshot):
+    for table in ["gold_fact_process", "gold_fact_file_reg", "gold_fact_process_network"]:
+        register_process_key(snapshot, table)
+    return register_launched_tree(snapshot, ROOT_PID)
+
+
+def or_query(query, key, started_at, launched, mode):
+    predicate = OR_PREDICATE.format(key=key, started_at=started_at, launched=launched)
+    return query.format(predicate=predicate), [mode, ANALYSE_START, mode, mode]
+
+
+def sort(result):
+    return result.sort_values(list(result.columns)).reset_index(drop=True)
+
+
+def explain(snapshot, query, parameters):
+    return snapshot.cursor.execute(f"EXPLAIN {query}", parameters).fetchone()[1]
+
+
+def packet_plan(snapshot, show_filter):
+    query = PACKET_QUERY.format(predicate=show_filter.predicate("packet._id", "packet.created_at"))
+    return explain(snapshot, query, show_filter.parameters)
+
+
+@pytest.mark.parametrize("mode", [SHOW_LAUNCHED, SHOW_NEW, SHOW_ALL])
+@pytest.mark.parametrize("query, key, started_at", QUERIES)
+def test_show_filter_matches_or_predicate(snapshot, mode, query, key, started_at):
+    launched = register_tables(snapshot)
+    show_filter = ShowFilter(mode, launched, ANALYSE_START)
+    filtered = snapshot.cursor.execute(
+        query.format(predicate=show_filter.predicate(key, started_at)), show_filter.parameters
+    ).df()
+    expected = snapshot.cursor.execute(*or_query(query, key, started_at, launched, mode)).df()
+    assert not filtered.empty
+    assert sort(filtered).equals(sort(expected))
+
+
+@pytest.mark.parametrize("mode", [SHOW_NEW, SHOW_ALL])
+def test_show_filter_drops_launched_tree_join(snapshot, mode):
+    # The disjunction probes the launched tree for every row whatever the mode
+    launched = register_tables(snapshot)
+    show_filter = ShowFilter(mode, launched, ANALYSE_START)
+    plan = packet_plan(snapshot, show_filter)
+    or_plan = explain(snapshot, *or_query(PACKET_QUERY, "packet._id", "packet.created_at", launched, mode))
+    assert "Join Type: MARK" in or_plan
+    assert "HASH_JOIN" not in plan
+    assert launched not in plan
+
+
+def test_show_filter_pushes_start_into_scan(snapshot):
+    launched = register_tables(snapshot)
+    show_filter = ShowFilter(SHOW_NEW, launched, ANALYSE_START)
+    plan = packet_plan(snapshot, show_filter)
+    scan = plan.split("READ_PARQUET", 1)[1]
+    assert "Filters:" in scan
+    assert "created_at>=" in scan
+
+
+def test_show_filter_launched_is_semi_join(snapshot):
+    launched = register_tables(snapshot)
+    show_filter = ShowFilter(SHOW_LAUNCHED, launched, ANALYSE_START)
+    plan = packet_plan(snapshot, show_filter)
+    assert "Join Type: SEMI" in plan
+    assert "Join Type: MARK" not in plan
@@ -0,0 +1,182 @@
+import os
+
+import duckdb
+import pytest
+
+import tuner
+from pages import OUTPUT_PATH
+from rstracer import CONFIG_PATH, GROWTH_QUERY, read_config
+from tuner import BOUNDS, tune, write_config
+
+CONFIG = """# Configuration File for rstracer
+in_memory = true
+
+# [Scheduling Tasks]
+[schedule]
+silver = 10        # Frequency in seconds to run the silver task
+gold = 10          # Frequency in seconds to run the gold task
+export = 10       # Frequency in seconds to run the file task
+
+[request]
+channel_size = 500           # Maximum number of requests in the queue
+
+[ps]
+producer_frequency = 300    # Time interval (in milliseconds) between consecutive executions of `ps`
+consumer_batch_size = 200    # Rows per batch in the `INSERT INTO` statements
+
+[lsof.regular]
+producer_frequency = 5000   # Time interval (in milliseconds) between consecutive executions of `lsof /`
+
+[lsof.network]
+producer_frequency = 1000    # Time interval (in milliseconds) between consecutive executions of `lsof -i`
+
+[network]
+channel_size = 500           # Maximum number of packets in the queue
+producer_frequency = 1000    # Time interval (in milliseconds) between consecutive reads from the queue
+
+[export]
+directory = ".output/rstracer"        # Output directory
+"""
+
+# One minute at 8% of a core for a 10% budget, ETL tasks on schedule and a quiet host
+CALIBRATION = {
+    "duration": 60,
+    "cpu": 8.0,
+    "chrono": {
+        "silver": {"runs": 6, "p95_duration": 500.0, "max_duration": 800.0},
+        "gold": {"runs": 6, "p95_duration": 1000.0, "max_duration": 1500.0},
+    },
+    "growth": {"gold_fact_process": 100.0, "gold_fact_network_packet": 50.0},
+}
+
+
+def calibration(**changes):
+    return {**CALIBRATION, **changes}
+
+
+def test_read_config():
+    config = read_config(CONFIG)
+    assert config[(None, "in_memory")] == "true"
+    assert config[("schedule", "gold")] == 10
+    assert config[("lsof.regular", "producer_frequency")] == 5000
+    assert config[("network", "producer_frequency")] == 1000
+    assert config[("export", "directory")] == '".output/rstracer"'
+
+
+def test_write_config_keeps_comments():
+    text = write_config(CONFIG, {("ps", "producer_frequency"): 600, ("schedule", "gold"): 20})
+    lines = text.splitlines()
+    changed = [line for line, original in zip(lines, CONFIG.splitlines()) if line != original]
+    assert changed == [
+        "gold = 20          # Frequency in seconds to run the gold task",
+        "producer_frequency = 600    # Time interval (in milliseconds) between consecutive executions of `ps`",
+    ]
+    assert text.endswith("\n")
+    # Keys of the same name in other sections are kept
+    config = read_config(text)
+    assert config == {**read_config(CONFIG), ("ps", "producer_frequency"): 600, ("schedule", "gold"): 20}
+
+
+def test_write_config_on_shipped_config():
+    with open(os.path.join(os.path.dirname(__file__), "..", CONFIG_PATH)) as config_file:
+        text = config_file.read()
+    config = read_config(text)
+    assert write_config(text, config) == text
+    tuned = write_config(text, {("lsof.network", "producer_frequency"): 2000})
+    assert [line for line in tuned.splitlines() if line.startswith("#")] == [
+        line for line in text.splitlines() if line.startswith("#")
+    ]
+    assert read_config(tuned) == {**config, ("lsof.network", "producer_frequency"): 2000}
+
+
+def test_tune_keeps_config_within_budget():
+    config = read_config(CONFIG)
+    tuned, _ = tune(config, CALIBRATION, 10)
+    assert tuned == {
+        ("ps", "producer_frequency"): 300,
+        ("lsof.regular", "producer_frequency"): 5000,
+        ("lsof.network", "producer_frequency"): 1000,
+        ("schedule", "silver"): 10,
+        ("schedule", "gold"): 10,
+        ("request", "channel_size"): 500,
+        ("network", "channel_size"): 500,
+    }
+
+
+def test_tune_scales_collectors_to_budget():
+    tuned, reasons = tune(read_config(CONFIG), calibration(cpu=16.0), 10)
+    assert tuned[("ps", "producer_frequency")] == 600
+    assert tuned[("lsof.regular", "producer_frequency")] == 10000
+    assert tuned[("lsof.network", "producer_frequency")] == 2000
+    assert reasons[("ps", "producer_frequency")] == "rstracer used 16.0% of a core for a 10% budget"
+    # Periods are kept within their fidelity bounds
+    tuned, _ = tune(read_config(CONFIG), calibration(cpu=400.0), 10)
+    assert tuned[("ps", "producer_frequency")] == BOUNDS[("ps", "producer_frequency")][1]
+    tuned, _ = tune(read_config(CONFIG), calibration(cpu=0.1), 10)
+    assert tuned[("lsof.network", "producer_frequency")] == BOUNDS[("lsof.network", "producer_frequency")][0]
+
+
+@pytest.mark.parametrize(
+    "chrono, period",
+    [
+        # Busy 80% of its period, the period leaves it busy half of the time
+        ({"runs": 6, "p95_duration": 8000.0, "max_duration": 9000.0}, 16),
+        # Half of its runs skipped, the period follows the measured one
+        ({"runs": 3, "p95_duration": 1000.0, "max_duration": 1500.0}, 20),
+    ],
+)
+def test_tune_slows_lagging_etl_task(chrono, period):
+    tuned, reasons = tune(read_config(CONFIG), calibration(chrono={**CALIBRATION["chrono"], "gold": chrono}), 10)
+    assert tuned[("schedule", "gold")] == period
+    assert tuned[("schedule", "silver")] == 10
+    assert ("schedule", "gold") in reasons
+
+
+def test_tune_grows_queues_with_load():
+    growth = {"gold_fact_process": 50000.0, "gold_fact_network_packet": 2000.0}
+    tuned, _ = tune(read_config(CONFIG), calibration(growth=growth), 10)
+    # 52000 rows per second in batches of 200 during the 1.5s of the longest task, twice
+    assert tuned[("request", "channel_size")] == 780
+    # 2000 packets per second read every second, twice
+    assert tuned[("network", "channel_size")] == 4000
+
+
+def test_tune_without_chrono_rows():
+    tuned, _ = tune(read_config(CONFIG), calibration(chrono={}), 10)
+    assert tuned[("schedule", "silver")] == 10
+    assert tuned[("schedule", "gold")] == 10
+    assert tuned[("request", "channel_size")] == 500
+
+
+def test_run_tuner_leaves_config_in_place(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / CONFIG_PATH).write_text(CONFIG)
+    workspaces = []
+
+    def calibrate(warmup, duration, workspace):
+        # rstracer reads the candidate configuration of each round from its working directory
+        with open(os.path.join(workspace, CONFIG_PATH)) as config_file:
+            workspaces.append((workspace, read_config(config_file.read())))
+        return calibration(cpu=16.0)
+
+    monkeypatch.setattr(tuner, "calibrate", calibrate)
+    tuner.run_tuner(10, 0, 60, 2, str(tmp_path / "tuned.toml"))
+    assert (tmp_path / CONFIG_PATH).read_text() == CONFIG
+    assert sorted(os.listdir(tmp_path)) == [CONFIG_PATH, "tuned.toml"]
+    (workspace, first), (_, second) = workspaces
+    assert not os.path.exists(workspace)
+    assert first[("export", "directory")] == f'"{tmp_path / OUTPUT_PATH}"'
+    assert second[("ps", "producer_frequency")] == 600
+    assert read_config((tmp_path / "tuned.toml").read_text())[("ps", "producer_frequency")] == 1200
+
+
+def test_growth_ignores_vacuum_drops():
+    # The vacuum empties the table at 00:00:20, only the two increases of 100 rows are counted
+    table_count = """(SELECT * FROM (VALUES
+        ('gold_fact_process', 100, TIMESTAMP '2024-01-01 00:00:00'),
+        ('gold_fact_process', 200, TIMESTAMP '2024-01-01 00:00:10'),
+        ('gold_fact_process', 0, TIMESTAMP '2024-01-01 00:00:20'),
+        ('gold_fact_process', 100, TIMESTAMP '2024-01-01 00:00:30')
+    ) t(name, count, created_at))"""
+    growth = duckdb.sql(GROWTH_QUERY.format(table_count=table_count)).fetchall()
+    assert growth == [("gold_fact_process", 100, 200 / 30)]
@@ -0,0 +1,205 @@
+import argparse
+import math
+import os
+import tempfile
+from datetime import datetime, timezone
+from time import sleep, time
+
+import duckdb
+import psutil
+
+from analysis import RSTRACER_READY_TIMEOUT
+from pages import OUTPUT_PATH, TABLES
+from rstracer import CONFIG_PATH, GROWTH_QUERY, SECTION, VALUE, ProcessTree, Rstracer, read_config
+
+TUNED_PATH = ".output/rstracer.toml"
+WARMUP = 30
+CALIBRATION = 60
+ROUNDS = 2
+# Percent of one core, as the pcpu of ps
+CPU_BUDGET = 10
+# The collectors are tuned to use this share of the budget, the next calibration round measures the result
+HEADROOM = 0.8
+# An ETL task busy more than this share of its period falls behind on the next burst of rows
+ETL_LOAD = 0.5
+# Scheduled runs missing from the calibration window, over which a task lags
+ETL_LAG = 0.8
+# Queues absorb the requests arriving during the longest ETL run, with this margin
+QUEUE_MARGIN = 2
+
+COLLECTORS = [
+    ("ps", "producer_frequency"),
+    ("lsof.regular", "producer_frequency"),
+    ("lsof.network", "producer_frequency"),
+]
+ETL_TASKS = {"silver": ("schedule", "silver"), "gold": ("schedule", "gold")}
+
+# Fidelity floor and ceiling of each tuned value, in the unit of rstracer.toml
+BOUNDS = {
+    ("ps", "producer_frequency"): (100, 2000),
+    ("lsof.regular", "producer_frequency"): (1000, 30000),
+    ("lsof.network", "producer_frequency"): (250, 5000),
+    ("schedule", "silver"): (1, 60),
+    ("schedule", "gold"): (1, 60),
+    ("request", "channel_size"): (100, 5000),
+    ("network", "channel_size"): (100, 5000),
+}
+
+# Durations are in milliseconds
+CHRONO_QUERY = """
+SELECT
+    name,
+    COUNT(*) AS runs,
+    QUANTILE_CONT(duration, 0.95) AS p95_duration,
+    MAX(duration) AS max_duration,
+FROM '{export}/gold_tech_chrono.parquet'
+WHERE created_at >= ?
+GROUP BY name
+"""
+
+
+def write_config(text, values):
+    # Values are replaced in place, the comments documenting each option are kept
+    lines = []
+    section = None
+    for line in text.splitlines(keepends=True):
+        header = SECTION.match(line)
+        if header:
+            section = header.group(1)
+        value = VALUE.match(line)
+        if value and (section, value.group(1)) in values:
+            line = VALUE.sub(lambda match: f"{match[1]}{match[2]}{values[(section, match[1])]}{match[4]}", line)
+        lines.append(line)
+    return "".join(lines)
+
+
+def clamp(key, value):
+    low, high = BOUNDS[key]
+    return max(low, min(high, int(math.ceil(value))))
+
+
+def rstracer_cpu_seconds():
+    # ps and lsof runs reaped by rstracer are counted in its children times
+    pid = Rstracer().pid()
+    seconds = 0.0
+    for process_pid in [pid] + ProcessTree().descendants(pid):
+        try:
+            times = psutil.Process(process_pid).cpu_times()
+            seconds += times.user + times.system + times.children_user + times.children_system
+        except psutil.Error:
+            pass
+    return seconds
+
+
+def write_workspace(workspace, text):
+    # rstracer runs from the temporary workspace, its export directory is made absolute to keep exporting to OUTPUT_PATH
+    export = f'"{os.path.abspath(OUTPUT_PATH)}"'
+    with open(f"{workspace}/{CONFIG_PATH}", "w") as config_file:
+        config_file.write(write_config(text, {("export", "directory"): export}))
+
+
+def calibrate(warmup, duration, workspace=None):
+    if not Rstracer().ensure_running(OUTPUT_PATH, TABLES, RSTRACER_READY_TIMEOUT, cwd=workspace):
+        raise RuntimeError(f"no complete rstracer export, rstracer is {Rstracer().state().lower()}")
+    sleep(warmup)
+    started_at = datetime.now(timezone.utc).replace(tzinfo=None)
+    cpu_seconds = rstracer_cpu_seconds()
+    sleep(duration)
+    cpu = (rstracer_cpu_seconds() - cpu_seconds) / duration * 100
+    # The export covering the whole window
+    Rstracer().wait_ready(OUTPUT_PATH, TABLES, RSTRACER_READY_TIMEOUT, since=time())
+    with duckdb.connect() as con:
+        chrono = con.execute(CHRONO_QUERY.format(export=OUTPUT_PATH), [started_at]).df()
+        table_count = f"(SELECT * FROM '{OUTPUT_PATH}/gold_tech_table_count.parquet' WHERE created_at >= ?)"
+        growth = con.execute(GROWTH_QUERY.format(table_count=table_count), [started_at]).df()
+    return {
+        "duration": duration,
+        "cpu": cpu,
+        "chrono": chrono.set_index("name").to_dict(orient="index"),
+        "growth": growth.set_index("name")["rows_per_second"].fillna(0).to_dict(),
+    }
+
+
+def tune(config, calibration, budget):
+    tuned = {}
+    reasons = {}
+
+    # Collector cost follows its frequency, every period is scaled by the measured overhead over the budget
+    scale = calibration["cpu"] / (budget * HEADROOM)
+    for key in COLLECTORS:
+        tuned[key] = clamp(key, config[key] * scale)
+        reasons[key] = f"rstracer used {calibration['cpu']:.1f}% of a core for a {budget}% budget"
+
+    # A task lags when its runs take most of its period or when scheduled runs were skipped
+    for name, key in ETL_TASKS.items():
+        tuned[key] = config[key]
+        chrono = calibration["chrono"].get(name)
+        if chrono is None:
+            continue
+        expected_runs = calibration["duration"] / config[key]
+        busy = chrono["p95_duration"] / 1000 / config[key]
+        if busy > ETL_LOAD or chrono["runs"] < expected_runs * ETL_LAG:
+            effective_period = calibration["duration"] / chrono["runs"]
+            tuned[key] = clamp(key, max(chrono["p95_duration"] / 1000 / ETL_LOAD, effective_period))
+            reasons[key] = f"{name} ran {chrono['runs']} times for {expected_runs:.0f} expected, p95 {busy:.0%} busy"
+
+    # Insert requests keep arriving while the longest task holds the database, queues are never shrunk below the
+    # configured size by a calibration on a quiet host
+    longest = max([chrono["max_duration"] / 1000 for chrono in calibration["chrono"].values()] or [0])
+    rows_per_second = sum(calibration["growth"].values())
+    requests = rows_per_second / config[("ps", "consumer_batch_size")] * max(longest, 1)
+    tuned[("request", "channel_size")] = clamp(
+        ("request", "channel_size"), max(config[("request", "channel_size")], requests * QUEUE_MARGIN)
+    )
+    reasons[("request", "channel_size")] = f"{rows_per_second:.0f} rows per second, longest task {longest:.1f}s"
+
+    # The packet queue holds the packets captured between two reads
+    packets = (
+        calibration["growth"].get("gold_fact_network_packet", 0) * config[("network", "producer_frequency")] / 1000
+    )
+    tuned[("network", "channel_size")] = clamp(
+        ("network", "channel_size"), max(config[("network", "channel_size")], packets * QUEUE_MARGIN)
+    )
+    reasons[("network", "channel_size")] = f"{packets:.0f} packets per read"
+    return tuned, reasons
+
+
+def run_tuner(budget, warmup, duration, rounds, output):
+    with open(CONFIG_PATH) as config_file:
+        text = config_file.read()
+    # Each round runs rstracer from a temporary workspace holding the candidate configuration, an interrupted run
+    # never leaves it in place of the tracked rstracer.toml
+    with tempfile.TemporaryDirectory() as workspace:
+        try:
+            for number in range(rounds):
+                Rstracer().stop()
+                write_workspace(workspace, text)
+                config = read_config(text)
+                calibration = calibrate(warmup, duration, workspace)
+                tuned, reasons = tune(config, calibration, budget)
+                print(f"Round {number + 1}: rstracer used {calibration['cpu']:.1f}% of a core")
+                for key, value in tuned.items():
+                    if value != config[key]:
+                        print(f"  {'.'.join(key)}: {config[key]} -> {value} ({reasons.get(key, '')})")
+                text = write_config(text, tuned)
+        finally:
+            Rstracer().stop()
+    os.makedirs(os.path.dirname(output) or ".", exist_ok=True)
+    with open(output, "w") as tuned_file:
+        tuned_file.write(text)
+    print(f"Tuned configuration -> {output}")
+
+
+def run():
+    parser = argparse.ArgumentParser(description="Tune rstracer.toml to the host from calibration runs.")
+    parser.add_argument("--budget", type=float, default=CPU_BUDGET, help="rstracer CPU budget, in percent of a core")
+    parser.add_argument("--warmup", type=int, default=WARMUP, help="seconds ignored after rstracer is ready")
+    parser.add_argument("--duration", type=int, default=CALIBRATION, help="seconds measured by each round")
+    parser.add_argument("--rounds", type=int, default=ROUNDS, help="calibration rounds, each one runs the last tuning")
+    parser.add_argument("--output", default=TUNED_PATH, help="tuned configuration file")
+    args = parser.parse_args()
+    run_tuner(args.budget, args.warmup, args.duration, args.rounds, args.output)
+
+
+if __name__ == "__main__":
+    run()